@@ -0,0 +1,270 @@
+import argparse
+import asyncio
+import importlib.util
+import json
+import logging
+import os
+from datetime import datetime, timezone
+
+from dateutil import parser
+
+from storage import InfluxDBStorage
+from timeline import TimelineIngester, item_time
+
+backfill_logger = logging.getLogger("general")
+
+
+def load_collector_module():
+    # sense-collector.py is not importable by name, so load it from its path
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sense-collector.py")
+    spec = importlib.util.spec_from_file_location("sense_collector", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def to_api_time(epoch):
+    return datetime.fromtimestamp(epoch, timezone.utc).strftime(
+        "%Y-%m-%dT%H:%M:%S.000Z"
+    )
+
+
+class BulkTimelineWriter:
+    # Stands in for the storage of a TimelineIngester: events are buffered as
+    # line protocol and written with the gzip bulk client, so a checkpoint is
+    # only saved once the events before it are in InfluxDB
+    def __init__(self, influxdb_storage):
+        self.influxdb_storage = influxdb_storage
+        self.lines = []
+
+    async def persist_timeline_events(self, events):
+        for event in events:
+            line = self.influxdb_storage.timeline_point(*event).to_line_protocol()
+            if line:
+                self.lines.append(line)
+
+    async def flush(self):
+        if not self.lines:
+            return 0
+        data = ("\n".join(self.lines) + "\n").encode()
+        await asyncio.to_thread(self.influxdb_storage.bulk_write_line_protocol, data)
+        count = len(self.lines)
+        self.lines = []
+        return count
+
+
+class Checkpoint:
+    def __init__(self, path, start, end):
+        self.path = path
+        self.start = start
+        self.end = end
+        # Oldest timeline time already written; paging resumes before it
+        self.cursor = end
+        self.items = 0
+        self.complete = False
+
+    def load(self):
+        # Without an explicit end, an unfinished run for the same start is resumed
+        if not os.path.exists(self.path):
+            return
+        with open(self.path) as f:
+            saved = json.load(f)
+        if self.end is None and saved.get("start") == self.start:
+            if saved.get("complete"):
+                return
+            self.end = saved["end"]
+        if saved.get("start") != self.start or saved.get("end") != self.end:
+            backfill_logger.warning(
+                f"Ignoring checkpoint {self.path} for a different time range"
+            )
+            return
+        self.cursor = saved["cursor"]
+        self.items = saved.get("items", 0)
+        self.complete = saved.get("complete", False)
+        backfill_logger.info(
+            f"Resuming backfill at {to_api_time(self.cursor)} ({self.items} items written)"
+        )
+
+    def save(self):
+        temporary_path = f"{self.path}.tmp"
+        with open(temporary_path, "w") as f:
+            json.dump(
+                {
+                    "start": self.start,
+                    "end": self.end,
+                    "cursor": self.cursor,
+                    "items": self.items,
+                    "complete": self.complete,
+                },
+                f,
+            )
+        os.replace(temporary_path, self.path)
+
+
+async def backfill_timeline(
+    account, url, ingester, writer, checkpoint, page_size, batch_size
+):
+    # Pages backwards from the checkpoint cursor until the start of the range
+    while not checkpoint.complete:
+        page = await account.get_json(
+            url, params={"n_items": page_size, "end": to_api_time(checkpoint.cursor)}
+        )
+        items = page.get("items", [])
+        times = [item_time(item) for item in items]
+        in_range = [
+            item
+            for item, epoch in zip(items, times)
+            if epoch is not None and checkpoint.start <= epoch <= checkpoint.cursor
+        ]
+        written = await ingester.ingest(in_range, advance_cursor=False)
+        checkpoint.items += written
+
+        valid_times = [epoch for epoch in times if epoch is not None]
+        oldest = min(valid_times) if valid_times else None
+        if oldest is None or oldest <= checkpoint.start or not page.get("more", True):
+            checkpoint.cursor = checkpoint.start
+            checkpoint.complete = True
+        elif oldest >= checkpoint.cursor:
+            backfill_logger.warning(
+                "Timeline did not page past %s, stopping",
+                to_api_time(checkpoint.cursor),
+            )
+            checkpoint.complete = True
+        else:
+            checkpoint.cursor = oldest
+
+        if checkpoint.complete or len(writer.lines) >= batch_size:
+            flushed = await writer.flush()
+            await asyncio.to_thread(checkpoint.save)
+            backfill_logger.info(
+                "Wrote %d timeline events, backfilled to %s",
+                flushed,
+                to_api_time(checkpoint.cursor),
+            )
+
+
+async def backfill_devices(collector, url, influxdb_storage, concurrency):
+    # Device responses carry current usage totals only; they are re-persisted once
+    devices = await collector.account.get_json(url)
+    if not isinstance(devices, list):
+        backfill_logger.warning(f"Unexpected devices response: {devices}")
+        return
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def persist(device_id):
+        async with semaphore:
+            device_data = await collector.lookup_device_data(device_id)
+        if device_data:
+            await influxdb_storage.persist_device_data(device_data)
+
+    device_ids = [device["id"] for device in devices if device.get("id")]
+    await asyncio.gather(*(persist(device_id) for device_id in device_ids))
+    backfill_logger.info(
+        f"Persisted {len(device_ids)} devices for monitor {collector.monitor_id}"
+    )
+
+
+async def backfill(
+    start, end, checkpoint_path, page_size, batch_size, concurrency, devices
+):
+    collector_module = load_collector_module()
+
+    auth_response = await collector_module.authenticate_with_sense(
+        os.environ["SENSE_COLLECTOR_API_USERNAME"],
+        os.environ["SENSE_COLLECTOR_API_PASSWORD"],
+    )
+    monitor_ids = [str(monitor["id"]) for monitor in auth_response["monitors"]]
+    user_id = auth_response["user_id"]
+
+    # No spool: a running collector owns it, and checkpoints need confirmed writes
+    influxdb_params = collector_module.influxdb_params_from_env()
+    influxdb_params.update({"spool_max_bytes": 0, "write_overflow_policy": "block"})
+    influxdb_storage = InfluxDBStorage(influxdb_params)
+
+    account = collector_module.SenseAccount(auth_response["access_token"], user_id)
+    writer = BulkTimelineWriter(influxdb_storage)
+    ingester = TimelineIngester(writer, concurrency=concurrency)
+    collectors = [
+        collector_module.SenseCollector(
+            monitor_id, account, influxdb_storage, timeline=ingester
+        )
+        for monitor_id in monitor_ids
+    ]
+
+    checkpoint = Checkpoint(checkpoint_path, start, end)
+    checkpoint.load()
+    if checkpoint.end is None:
+        checkpoint.end = checkpoint.cursor = datetime.now(timezone.utc).timestamp()
+
+    await account.start_session()
+    try:
+        if devices:
+            for collector in collectors:
+                url = f"{collector_module.SenseAPIEndpoints.BASE_URL}/app/monitors/{collector.monitor_id}/devices"
+                await backfill_devices(collector, url, influxdb_storage, concurrency)
+        if checkpoint.complete:
+            backfill_logger.info("Timeline backfill already complete for this range")
+        else:
+            await backfill_timeline(
+                account,
+                collector_module.SenseAPIEndpoints.TIMELINE.format(user_id=user_id),
+                ingester,
+                writer,
+                checkpoint,
+                page_size,
+                batch_size,
+            )
+        backfill_logger.info(
+            f"Backfill finished: {checkpoint.items} timeline events written"
+        )
+    finally:
+        await account.close_session()
+        await influxdb_storage.close()
+
+
+def main():
+    argument_parser = argparse.ArgumentParser(
+        description="Backfill Sense timeline events and device data into InfluxDB"
+    )
+    argument_parser.add_argument(
+        "--start", required=True, help="Start of the range (ISO 8601)"
+    )
+    argument_parser.add_argument(
+        "--end", help="End of the range (ISO 8601, defaults to now)"
+    )
+    argument_parser.add_argument(
+        "--checkpoint",
+        help="Checkpoint file (defaults to backfill_checkpoint.json in the export folder)",
+    )
+    argument_parser.add_argument("--page-size", type=int, default=500)
+    argument_parser.add_argument(
+        "--batch-size", type=int, default=5000, help="Events per bulk write"
+    )
+    argument_parser.add_argument(
+        "--concurrency", type=int, default=4, help="Concurrent device lookups"
+    )
+    argument_parser.add_argument(
+        "--devices", action="store_true", help="Also re-persist current device data"
+    )
+    args = argument_parser.parse_args()
+
+    start = parser.isoparse(args.start).timestamp()
+    end = parser.isoparse(args.end).timestamp() if args.end else None
+    checkpoint_path = args.checkpoint or os.path.join(
+        os.getenv("SENSE_COLLECTOR_EXPORT_FOLDER", "export"), "backfill_checkpoint.json"
+    )
+    asyncio.run(
+        backfill(
+            start,
+            end,
+            checkpoint_path,
+            args.page_size,
+            args.batch_size,
+            args.concurrency,
+            args.devices,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
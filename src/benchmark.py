@@ -0,0 +1,314 @@
+import argparse
+import json
+import random
+import time
+
+from influxdb_client import Point
+
+from capture import open_capture
+from decoder import FrameDecoder, msgspec, orjson, realtime_from_dict
+from line_protocol import RealtimeEncoder
+
+
+def load_realtime_frames(capture_path, limit=None):
+    # Reads realtime_update payloads from a SENSE_COLLECTOR_OUTPUT_RECEIVED_DATA capture
+    frames = []
+    with open_capture(capture_path) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            data = json.loads(line)
+            if data.get("type") == "realtime_update":
+                frames.append(data["payload"])
+                if limit and len(frames) >= limit:
+                    break
+    return frames
+
+
+def load_raw_realtime_frames(capture_path, limit=None):
+    # Raw realtime_update text frames, as receive_data sees them
+    frames = []
+    with open_capture(capture_path) as f:
+        for line in f:
+            line = line.strip()
+            if line and '"realtime_update"' in line:
+                frames.append(line)
+                if limit and len(frames) >= limit:
+                    break
+    return frames
+
+
+def synthetic_realtime_frames(count, device_count, seed=0):
+    rng = random.Random(seed)
+    devices = [
+        {
+            "id": f"device{index:04d}",
+            "name": f"Device {index}",
+            "icon": "socket" if index % 5 == 0 else "stove",
+        }
+        for index in range(device_count)
+    ]
+    frames = []
+    epoch = int(time.time())
+    for offset in range(count):
+        frame_devices = []
+        for index, device in enumerate(devices):
+            frame_device = dict(device, w=round(rng.uniform(0, 1500), 3))
+            if index % 5 == 0:
+                frame_device["sd"] = {
+                    "w": round(rng.uniform(0, 1500), 3),
+                    "i": round(rng.uniform(0, 12), 3),
+                    "v": round(rng.uniform(118, 122), 3),
+                    "e": round(rng.uniform(0, 5000), 3),
+                }
+            if index == 0:
+                frame_device["ao_w"] = 120
+                frame_device["ao_st"] = True
+            frame_devices.append(frame_device)
+        frames.append(
+            {
+                "hz": round(rng.uniform(59.9, 60.1), 4),
+                "c": round(rng.uniform(10, 40), 3),
+                "w": round(rng.uniform(1000, 5000), 3),
+                "epoch": epoch + offset,
+                "voltage": [round(rng.uniform(118, 122), 3) for _ in range(2)],
+                "channels": [round(rng.uniform(500, 2500), 3) for _ in range(2)],
+                "devices": frame_devices,
+            }
+        )
+    return frames
+
+
+def frame_arguments(monitor_id, payload):
+    return (
+        monitor_id,
+        float(payload["hz"]),
+        float(payload["c"]),
+        float(payload["w"]),
+        int(payload["epoch"]),
+        payload.get("voltage", []),
+        payload.get("devices", []),
+        payload.get("channels", []),
+        0.25,
+    )
+
+
+def encode_with_points(
+    monitor_id,
+    hertz,
+    total_current,
+    total_watts,
+    epoch,
+    voltage,
+    devices,
+    channels,
+    time_difference,
+):
+    # Reference implementation of the previous fluent Point path
+    points = [
+        Point("sense_mains")
+        .tag("monitor_id", monitor_id)
+        .field("hertz", hertz)
+        .field("current", total_current)
+        .field("watts", total_watts)
+        .time(epoch, write_precision="s"),
+        Point("sense_mains")
+        .tag("monitor_id", monitor_id)
+        .tag("leg", "L1")
+        .field("watts", channels[0])
+        .time(epoch, write_precision="s"),
+        Point("sense_mains")
+        .tag("monitor_id", monitor_id)
+        .tag("leg", "L2")
+        .field("watts", channels[1])
+        .time(epoch, write_precision="s"),
+        Point("sense_mains")
+        .tag("monitor_id", monitor_id)
+        .tag("leg", "L1")
+        .field("voltage", voltage[0])
+        .time(epoch, write_precision="s"),
+        Point("sense_mains")
+        .tag("monitor_id", monitor_id)
+        .tag("leg", "L2")
+        .field("voltage", voltage[1])
+        .time(epoch, write_precision="s"),
+        Point("sense_o11y")
+        .tag("monitor_id", monitor_id)
+        .field("time_difference", time_difference)
+        .time(epoch, write_precision="s"),
+    ]
+    for device in devices:
+        device_sd = device.get("sd", {})
+        is_plug = any(device_sd.get(key) is not None for key in ["w", "i", "v", "e"])
+        points.append(
+            Point("sense_devices")
+            .tag("monitor_id", monitor_id)
+            .tag("device_id", device.get("id"))
+            .tag("device_name", device.get("name"))
+            .tag("is_plug", str(is_plug).lower())
+            .field("icon", device.get("icon"))
+            .field("watts", device.get("w"))
+            .field("sd_watts", device_sd.get("w"))
+            .field("sd_current", device_sd.get("i"))
+            .field("sd_voltage", device_sd.get("v"))
+            .field("sd_energy", device_sd.get("e"))
+            .field("always_on_watts", device.get("ao_w"))
+            .field("always_on_state", device.get("ao_st"))
+            .time(epoch, write_precision="s")
+        )
+    lines = [point.to_line_protocol() for point in points]
+    return "\n".join(line for line in lines if line).encode()
+
+
+def time_per_frame(function, arguments, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        for args in arguments:
+            function(*args)
+    elapsed = time.perf_counter() - start
+    return elapsed / (iterations * len(arguments))
+
+
+def benchmark_encoder(frames, iterations, monitor_id="benchmark"):
+    encoder = RealtimeEncoder()
+    arguments = [frame_arguments(monitor_id, frame) for frame in frames]
+
+    # tests/test_line_protocol.py checks that both paths produce the same lines
+    point_seconds = time_per_frame(encode_with_points, arguments, iterations)
+    encoder_seconds = time_per_frame(
+        lambda *args: encoder.encode_realtime(*args), arguments, iterations
+    )
+    device_count = sum(len(args[6]) for args in arguments) / len(arguments)
+
+    print(f"Frames: {len(frames)} (avg {device_count:.1f} devices per frame)")
+    print(f"Point path:   {point_seconds * 1e6:10.1f} us/frame")
+    print(f"Encoder path: {encoder_seconds * 1e6:10.1f} us/frame")
+    print(f"Speedup:      {point_seconds / encoder_seconds:10.2f}x")
+
+
+def decode_with_json(raw):
+    # The decode and validation steps receive_data used before the decoder layer
+    data = json.loads(raw)
+    payload = data["payload"]
+    missing_keys = [key for key in ("hz", "c", "w", "epoch") if key not in payload]
+    if missing_keys:
+        raise KeyError(missing_keys)
+    return frame_arguments("benchmark", payload)
+
+
+def decode_with_decoder(decoder, raw):
+    data_type, payload = decoder.decode(raw)
+    if isinstance(payload, dict):
+        payload = realtime_from_dict(payload)
+    return (
+        "benchmark",
+        payload.hz,
+        payload.c,
+        payload.w,
+        int(payload.epoch),
+        payload.voltage,
+        payload.devices,
+        payload.channels,
+        0.25,
+    )
+
+
+def benchmark_decoder(raw_frames, iterations):
+    backends = ["json"]
+    if orjson is not None:
+        backends.append("orjson")
+    if msgspec is not None:
+        backends.append("msgspec")
+
+    encoder = RealtimeEncoder()
+    arguments = [(raw,) for raw in raw_frames]
+
+    # Every backend must hand the encoder the same arguments
+    expected = [decode_with_json(raw) for raw in raw_frames]
+    for backend in backends:
+        decoder = FrameDecoder(backend)
+        actual = [decode_with_decoder(decoder, raw) for raw in raw_frames]
+        if actual != expected:
+            raise AssertionError(f"{backend} decoder output differs from json.loads")
+
+    def before(raw):
+        encode_with_points(*decode_with_json(raw))
+
+    print(f"Frames: {len(raw_frames)} (avg {sum(map(len, raw_frames)) / len(raw_frames):.0f} bytes)")
+    json_seconds = time_per_frame(decode_with_json, arguments, iterations)
+    print(f"{'json.loads + checks':<22}{json_seconds * 1e6:10.1f} us/frame")
+    for backend in backends:
+        decoder = FrameDecoder(backend)
+        seconds = time_per_frame(
+            lambda raw: decode_with_decoder(decoder, raw), arguments, iterations
+        )
+        print(
+            f"{'decoder ' + backend:<22}{seconds * 1e6:10.1f} us/frame"
+            f"{json_seconds / seconds:8.2f}x"
+        )
+
+    # Decode plus encode, before and after this change set
+    decoder = FrameDecoder()
+    before_seconds = time_per_frame(before, arguments, iterations)
+    after_seconds = time_per_frame(
+        lambda raw: encoder.encode_realtime(*decode_with_decoder(decoder, raw)),
+        arguments,
+        iterations,
+    )
+    print(f"{'before (json + Point)':<22}{before_seconds * 1e6:10.1f} us/frame")
+    print(
+        f"{'after (' + decoder.backend + ' + encoder)':<22}{after_seconds * 1e6:10.1f} us/frame"
+        f"{before_seconds / after_seconds:8.2f}x"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sense Collector benchmarks")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    encoder_parser = subparsers.add_parser(
+        "encoder", help="Compare the realtime line protocol encoder with Point"
+    )
+    encoder_parser.add_argument(
+        "--capture", help="Path to a received_data.json capture file"
+    )
+    encoder_parser.add_argument("--frames", type=int, default=200)
+    encoder_parser.add_argument("--devices", type=int, default=40)
+    encoder_parser.add_argument("--iterations", type=int, default=20)
+
+    decode_parser = subparsers.add_parser(
+        "decode", help="Compare per-frame decode cost of the JSON decoder backends"
+    )
+    decode_parser.add_argument(
+        "--capture", help="Path to a received_data.json capture file"
+    )
+    decode_parser.add_argument("--frames", type=int, default=200)
+    decode_parser.add_argument("--devices", type=int, default=40)
+    decode_parser.add_argument("--iterations", type=int, default=20)
+
+    args = parser.parse_args()
+
+    if args.benchmark == "encoder":
+        if args.capture:
+            frames = load_realtime_frames(args.capture, args.frames)
+        else:
+            frames = synthetic_realtime_frames(args.frames, args.devices)
+        if not frames:
+            parser.error("No realtime_update frames found")
+        benchmark_encoder(frames, args.iterations)
+    elif args.benchmark == "decode":
+        if args.capture:
+            raw_frames = load_raw_realtime_frames(args.capture, args.frames)
+        else:
+            raw_frames = [
+                json.dumps({"type": "realtime_update", "payload": frame})
+                for frame in synthetic_realtime_frames(args.frames, args.devices)
+            ]
+        if not raw_frames:
+            parser.error("No realtime_update frames found")
+        benchmark_decoder(raw_frames, args.iterations)
+
+
+if __name__ == "__main__":
+    main()
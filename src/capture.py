@@ -0,0 +1,183 @@
+import asyncio
+import gzip
+import io
+import logging
+import os
+import time
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger("general")
+
+COMPRESSION_EXTENSIONS = {"none": "", "gzip": ".gz", "zstd": ".zst"}
+
+
+class CaptureWriter:
+    # Collects captured frames and API responses in memory and appends them
+    # to disk from one background task, so the event loop never touches files.
+    # Each stream (e.g. received_data.json) is rotated by size and age.
+    def __init__(
+        self,
+        folder,
+        max_bytes=100 * 1024 * 1024,
+        rotate_interval=86400.0,
+        max_files=10,
+        compression="none",
+        flush_interval=1.0,
+        buffer_bytes=16 * 1024 * 1024,
+    ):
+        if compression not in COMPRESSION_EXTENSIONS:
+            raise ValueError(f"Unknown capture compression {compression}")
+        if compression == "zstd" and zstandard is None:
+            raise ValueError("zstandard is not installed")
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.rotate_interval = rotate_interval
+        self.max_files = max_files
+        self.compression = compression
+        self.extension = COMPRESSION_EXTENSIONS[compression]
+        self.flush_interval = flush_interval
+        self.buffer_bytes = buffer_bytes
+        os.makedirs(folder, exist_ok=True)
+
+        # stream name -> pending chunks
+        self.buffers = {}
+        self.buffered_bytes = 0
+        # stream name -> time its current file was started
+        self.started = {}
+        self.wakeup = asyncio.Event()
+        self.flush_lock = asyncio.Lock()
+        self.closed = False
+
+        self.records = 0
+        self.bytes_written = 0
+        self.dropped = 0
+        self.rotations = 0
+
+    def write(self, stream, data):
+        # Never blocks: when the buffer is full the record is dropped
+        if isinstance(data, str):
+            data = data.encode()
+        size = len(data) + 1
+        if self.closed or self.buffered_bytes + size > self.buffer_bytes:
+            self.dropped += 1
+            return
+        chunks = self.buffers.get(stream)
+        if chunks is None:
+            chunks = self.buffers[stream] = []
+        chunks.append(data)
+        chunks.append(b"\n")
+        self.buffered_bytes += size
+        self.records += 1
+        if self.buffered_bytes >= self.buffer_bytes // 4:
+            self.wakeup.set()
+
+    async def run(self):
+        while not self.closed:
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self.wakeup.clear()
+            await self.flush()
+
+    async def flush(self):
+        async with self.flush_lock:
+            if not self.buffers:
+                return
+            buffers, self.buffers = self.buffers, {}
+            self.buffered_bytes = 0
+            try:
+                await asyncio.to_thread(self.write_buffers, buffers)
+            except OSError as e:
+                logger.error(f"Failed to write capture files: {e}")
+
+    def write_buffers(self, buffers):
+        for stream, chunks in buffers.items():
+            data = b"".join(chunks)
+            if self.compression == "gzip":
+                # Appended gzip members and zstd frames read back as one stream
+                data = gzip.compress(data, compresslevel=6)
+            elif self.compression == "zstd":
+                data = zstandard.ZstdCompressor().compress(data)
+            path = os.path.join(self.folder, stream + self.extension)
+            self.rotate_if_needed(stream, path)
+            with open(path, "ab") as f:
+                f.write(data)
+            self.bytes_written += len(data)
+
+    def rotate_if_needed(self, stream, path):
+        now = time.time()
+        try:
+            size = os.path.getsize(path)
+        except FileNotFoundError:
+            self.started[stream] = now
+            return
+        started = self.started.setdefault(stream, now)
+        if size < self.max_bytes and now - started < self.rotate_interval:
+            return
+
+        stem, suffix = os.path.splitext(stream)
+        stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(now))
+        rotated = os.path.join(
+            self.folder, f"{stem}-{stamp}{suffix}{self.extension}"
+        )
+        sequence = 1
+        while os.path.exists(rotated):
+            rotated = os.path.join(
+                self.folder, f"{stem}-{stamp}.{sequence}{suffix}{self.extension}"
+            )
+            sequence += 1
+        os.replace(path, rotated)
+        self.started[stream] = now
+        self.rotations += 1
+        logger.debug("Rotated capture %s to %s", path, rotated)
+        self.prune(stem)
+
+    def prune(self, stem):
+        # Keep the newest max_files rotated files of a stream
+        if self.max_files <= 0:
+            return
+        prefix = f"{stem}-"
+        rotated = sorted(
+            file_name
+            for file_name in os.listdir(self.folder)
+            if file_name.startswith(prefix)
+            and file_name[len(prefix) : len(prefix) + 1].isdigit()
+        )
+        for file_name in rotated[: -self.max_files]:
+            try:
+                os.remove(os.path.join(self.folder, file_name))
+            except OSError as e:
+                logger.warning(f"Failed to remove old capture {file_name}: {e}")
+
+    async def close(self):
+        self.closed = True
+        self.wakeup.set()
+        await self.flush()
+
+    def stats(self):
+        return {
+            "capture_records": self.records,
+            "capture_bytes_written": self.bytes_written,
+            "capture_buffered_bytes": self.buffered_bytes,
+            "capture_dropped": self.dropped,
+            "capture_rotations": self.rotations,
+        }
+
+
+def open_capture(path):
+    # Opens a capture file for reading as text, whatever its compression
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt")
+    if path.endswith(".zst"):
+        if zstandard is None:
+            raise ValueError("zstandard is not installed")
+        reader = zstandard.ZstdDecompressor().stream_reader(
+            open(path, "rb"), read_across_frames=True, closefd=True
+        )
+        return io.TextIOWrapper(reader)
+    return open(path)
@@ -0,0 +1,69 @@
+from influxdb_client import Point
+
+
+def is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+class ChangeFilter:
+    # Last written value per (series, field). A field is suppressed while it
+    # equals the last written value, or stays within deadband of it for
+    # numbers, until keepalive seconds have passed since it was last written.
+    def __init__(self, deadband=0.0, keepalive=900.0, max_entries=65536):
+        self.deadband = deadband
+        self.keepalive = keepalive
+        self.max_entries = max_entries
+        # (series, field) -> (last written value, time it was written)
+        self.last = {}
+        self.emitted = 0
+        self.suppressed = 0
+
+    def changed(self, series, field, value, now):
+        # None values are never written, so they neither count nor reset the table
+        if value is None:
+            return True
+        key = (series, field)
+        previous = self.last.get(key)
+        if previous is not None:
+            last_value, written_at = previous
+            if now - written_at < self.keepalive:
+                if is_number(value) and is_number(last_value):
+                    unchanged = abs(value - last_value) <= self.deadband
+                else:
+                    unchanged = value == last_value
+                if unchanged:
+                    self.suppressed += 1
+                    return False
+        elif len(self.last) >= self.max_entries:
+            self.last.clear()
+        self.last[key] = (value, now)
+        self.emitted += 1
+        return True
+
+    def point(self, measurement, tags, fields, timestamp):
+        # Builds a Point holding only the fields that need writing, or None
+        series = (measurement,) + tuple(sorted(tags.items()))
+        point = Point(measurement)
+        for key, value in tags.items():
+            point.tag(key, value)
+        has_fields = False
+        for field, value in fields.items():
+            if value is not None and self.changed(series, field, value, timestamp):
+                point.field(field, value)
+                has_fields = True
+        if not has_fields:
+            return None
+        return point.time(timestamp, write_precision="s")
+
+    def stats(self):
+        return {
+            "change_filter_series": len(self.last),
+            "change_filter_emitted": self.emitted,
+            "change_filter_suppressed": self.suppressed,
+        }
+
+
+class PassthroughFilter(ChangeFilter):
+    # Writes every field; used when change-only emission is disabled
+    def changed(self, series, field, value, now):
+        return True
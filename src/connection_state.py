@@ -0,0 +1,90 @@
+import logging
+import random
+import time
+
+import metrics
+
+api_logger = logging.getLogger("api")
+
+# Opening a WebSocket
+CONNECTING = "connecting"
+# Frames are arriving
+STREAMING = "streaming"
+# Connected, but nothing received for longer than the ping interval
+DEGRADED = "degraded"
+# Waiting before the next connection attempt
+BACKOFF = "backoff"
+
+STATES = (CONNECTING, STREAMING, DEGRADED, BACKOFF)
+
+
+class DecorrelatedJitterBackoff:
+    # Each delay is drawn between base and three times the previous delay,
+    # capped, so monitors reconnecting after an outage spread out instead of
+    # retrying in lockstep. The delay keeps growing across attempts until
+    # reset() is called after a connection has proved stable.
+    def __init__(self, base=5.0, cap=60.0):
+        self.base = base
+        self.cap = cap
+        self.delay = base
+        self.attempts = 0
+
+    def next(self):
+        self.delay = min(self.cap, random.uniform(self.base, self.delay * 3))
+        self.attempts += 1
+        return self.delay
+
+    def reset(self):
+        self.delay = self.base
+        self.attempts = 0
+
+
+class ConnectionStateMachine:
+    # Current WebSocket state of one monitor and the time spent in each state
+    def __init__(self, monitor_id):
+        self.monitor_id = monitor_id
+        self.state = None
+        self.entered = time.monotonic()
+        # Last time the time in the current state was added to the totals
+        self.recorded = self.entered
+        self.seconds = {state: 0.0 for state in STATES}
+        self.transitions = 0
+
+    def transition(self, state, reason=None):
+        if state == self.state:
+            return
+        self.record()
+        if self.state is not None:
+            metrics.WS_STATE.set(0, self.monitor_id, self.state)
+        metrics.WS_STATE.set(1, self.monitor_id, state)
+        api_logger.info(
+            "WebSocket for %s: %s -> %s%s",
+            self.monitor_id,
+            self.state,
+            state,
+            f" ({reason})" if reason else "",
+        )
+        self.state = state
+        self.entered = time.monotonic()
+        self.transitions += 1
+
+    def record(self):
+        now = time.monotonic()
+        if self.state is not None:
+            elapsed = now - self.recorded
+            self.seconds[self.state] += elapsed
+            metrics.WS_STATE_SECONDS.inc(self.monitor_id, self.state, amount=elapsed)
+        self.recorded = now
+
+    def time_in_state(self):
+        return time.monotonic() - self.entered
+
+    def stats(self):
+        self.record()
+        stats = {
+            "connection_state": self.state or "",
+            "connection_transitions": self.transitions,
+        }
+        for state, seconds in self.seconds.items():
+            stats[f"connection_{state}_seconds"] = round(seconds, 3)
+        return stats
@@ -0,0 +1,124 @@
+import json
+from typing import Any, Optional, Union
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+REQUIRED_REALTIME_KEYS = ("hz", "c", "w", "epoch")
+
+
+class FrameDecodeError(ValueError):
+    pass
+
+
+class RealtimeUpdate:
+    # Typed realtime_update payload used when msgspec is not installed
+    __slots__ = ("hz", "c", "w", "epoch", "voltage", "channels", "devices")
+
+    def __init__(self, hz, c, w, epoch, voltage, channels, devices):
+        self.hz = hz
+        self.c = c
+        self.w = w
+        self.epoch = epoch
+        self.voltage = voltage
+        self.channels = channels
+        self.devices = devices
+
+    def __repr__(self):
+        fields = ", ".join(f"{name}={getattr(self, name)!r}" for name in self.__slots__)
+        return f"RealtimeUpdate({fields})"
+
+
+def realtime_from_dict(payload):
+    if not isinstance(payload, dict):
+        raise FrameDecodeError(f"Invalid realtime_update payload: {type(payload)}")
+    missing_keys = [key for key in REQUIRED_REALTIME_KEYS if key not in payload]
+    if missing_keys:
+        raise FrameDecodeError(f"Missing required keys in payload: {missing_keys}")
+    try:
+        return RealtimeUpdate(
+            float(payload["hz"]),
+            float(payload["c"]),
+            float(payload["w"]),
+            int(payload["epoch"]),
+            payload.get("voltage", []),
+            payload.get("channels", []),
+            payload.get("devices", []),
+        )
+    except (TypeError, ValueError) as e:
+        raise FrameDecodeError(f"Invalid realtime_update payload: {e}") from e
+
+
+if msgspec is not None:
+
+    class RealtimePayload(msgspec.Struct):
+        hz: float
+        c: float
+        w: float
+        epoch: Union[int, float]
+        voltage: list = []
+        channels: list = []
+        devices: list = []
+
+    class Envelope(msgspec.Struct):
+        # The payload is left undecoded until the message type is known
+        type: Optional[str] = None
+        payload: msgspec.Raw = msgspec.Raw(b"null")
+
+
+class FrameDecoder:
+    # Decodes WebSocket text frames into (type, payload). realtime_update
+    # payloads come back as a typed object with hz, c, w, epoch, voltage,
+    # channels and devices attributes; every other payload is a dict.
+    def __init__(self, backend="auto"):
+        if backend == "auto":
+            if msgspec is not None:
+                backend = "msgspec"
+            elif orjson is not None:
+                backend = "orjson"
+            else:
+                backend = "json"
+        if backend == "msgspec" and msgspec is None:
+            raise ValueError("msgspec is not installed")
+        if backend == "orjson" and orjson is None:
+            raise ValueError("orjson is not installed")
+        if backend not in ("msgspec", "orjson", "json"):
+            raise ValueError(f"Unknown JSON decoder {backend}")
+        self.backend = backend
+
+        if backend == "msgspec":
+            self.envelope_decoder = msgspec.json.Decoder(Envelope)
+            self.realtime_decoder = msgspec.json.Decoder(RealtimePayload)
+            self.payload_decoder = msgspec.json.Decoder(Any)
+            self.decode = self.decode_msgspec
+        else:
+            self.loads = orjson.loads if backend == "orjson" else json.loads
+            self.decode = self.decode_dict
+
+    def decode_msgspec(self, raw):
+        try:
+            envelope = self.envelope_decoder.decode(raw)
+            if envelope.type == "realtime_update":
+                return envelope.type, self.realtime_decoder.decode(envelope.payload)
+            return envelope.type, self.payload_decoder.decode(envelope.payload)
+        except msgspec.DecodeError as e:
+            raise FrameDecodeError(str(e)) from e
+
+    def decode_dict(self, raw):
+        try:
+            data = self.loads(raw)
+        except ValueError as e:
+            raise FrameDecodeError(str(e)) from e
+        if not isinstance(data, dict):
+            raise FrameDecodeError(f"Unexpected frame: {type(data)}")
+        data_type = data.get("type")
+        if data_type == "realtime_update":
+            return data_type, realtime_from_dict(data.get("payload"))
+        return data_type, data.get("payload")
@@ -0,0 +1,103 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+
+api_logger = logging.getLogger("api")
+
+
+class DeviceCache:
+    # LRU cache of device metadata with per-key request coalescing and
+    # stale-while-revalidate refreshes
+    def __init__(self, ttl_seconds=120, stale_seconds=600, max_entries=1024):
+        self.ttl_seconds = ttl_seconds
+        self.stale_seconds = stale_seconds
+        self.max_entries = max_entries
+
+        # key -> (value, fetched_at), least recently used first
+        self.entries = OrderedDict()
+
+        # key -> task fetching that key, shared by every concurrent caller
+        self.inflight = {}
+
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.refreshes = 0
+        self.evictions = 0
+
+    async def get(self, key, fetch):
+        # fetch is a coroutine function returning the value, or None on failure
+        entry = self.entries.get(key)
+        if entry is not None:
+            value, fetched_at = entry
+            age = time.monotonic() - fetched_at
+            if age < self.ttl_seconds:
+                self.hits += 1
+                self.entries.move_to_end(key)
+                return value
+            if age < self.ttl_seconds + self.stale_seconds:
+                self.stale_hits += 1
+                self.entries.move_to_end(key)
+                self.refresh(key, fetch)
+                return value
+
+        task = self.inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+            return await asyncio.shield(task)
+
+        self.misses += 1
+        return await asyncio.shield(self.start_fetch(key, fetch))
+
+    def peek(self, key):
+        entry = self.entries.get(key)
+        return entry[0] if entry is not None else None
+
+    def start_fetch(self, key, fetch):
+        task = asyncio.create_task(self.fetch_and_store(key, fetch))
+        self.inflight[key] = task
+        task.add_done_callback(lambda _: self.inflight.pop(key, None))
+        return task
+
+    def refresh(self, key, fetch):
+        if key in self.inflight:
+            return
+        self.refreshes += 1
+        task = self.start_fetch(key, fetch)
+        task.add_done_callback(self.log_refresh_error)
+
+    def log_refresh_error(self, task):
+        if not task.cancelled() and task.exception() is not None:
+            api_logger.error(f"Background device refresh failed: {task.exception()}")
+
+    async def fetch_and_store(self, key, fetch):
+        value = await fetch()
+        if value is not None:
+            self.set(key, value)
+        return value
+
+    def set(self, key, value):
+        self.entries[key] = (value, time.monotonic())
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self):
+        lookups = self.hits + self.stale_hits + self.misses + self.coalesced
+        return {
+            "device_cache_entries": len(self.entries),
+            "device_cache_hits": self.hits,
+            "device_cache_stale_hits": self.stale_hits,
+            "device_cache_misses": self.misses,
+            "device_cache_coalesced": self.coalesced,
+            "device_cache_refreshes": self.refreshes,
+            "device_cache_evictions": self.evictions,
+            "device_cache_hit_ratio": (
+                (self.hits + self.stale_hits + self.coalesced) / lookups
+                if lookups
+                else 0.0
+            ),
+        }
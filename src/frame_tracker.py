@@ -0,0 +1,105 @@
+import metrics
+
+# Outcomes of FrameTracker.observe
+NEW = "new"
+LATE = "late"
+DUPLICATE = "duplicate"
+
+
+class FrameTracker:
+    # Sequence integrity of one monitor's realtime feed. Frames arrive a few
+    # times a second, so coverage is judged per slot of `interval` seconds:
+    # the last `window` slots are kept as a bitmap in a single int (bit 0 is
+    # the newest slot). Slots skipped without any frame are reported as gaps
+    # and count as missing until a late frame fills them. A frame is LATE when
+    # its epoch is older than the newest one seen. A frame is DUPLICATE when
+    # its key (epoch and content) matches one of the last `recent` frames,
+    # e.g. while two sockets overlap during a rotation or when Sense resends
+    # after a reconnect; several frames in the same second are normal.
+    def __init__(self, monitor_id, interval=1, window=4096, recent=64):
+        self.monitor_id = monitor_id
+        self.interval = interval
+        self.window = window
+        self.mask = (1 << window) - 1
+        self.seen = 0
+        self.newest = None
+        self.oldest = None
+        self.newest_epoch = None
+        # Keys of the last `recent` frames, oldest first
+        self.recent = recent
+        self.recent_keys = {}
+
+        self.frames = 0
+        self.duplicates = 0
+        self.late = 0
+        self.gaps = 0
+        self.missing = 0
+
+    def remember(self, key):
+        self.recent_keys[key] = None
+        if len(self.recent_keys) > self.recent:
+            del self.recent_keys[next(iter(self.recent_keys))]
+
+    def observe(self, epoch, key=None):
+        # Returns (outcome, gap) where gap is None or (first epoch, last epoch, slots)
+        if key is not None:
+            if key in self.recent_keys:
+                self.duplicates += 1
+                metrics.REALTIME_FRAMES_DUPLICATE.inc(self.monitor_id)
+                return DUPLICATE, None
+            self.remember(key)
+
+        self.frames += 1
+        slot = int(epoch // self.interval)
+        if self.newest is None:
+            self.newest = self.oldest = slot
+            self.newest_epoch = epoch
+            self.seen = 1
+            return NEW, None
+
+        if epoch >= self.newest_epoch:
+            self.newest_epoch = epoch
+            advance = slot - self.newest
+            if advance <= 0:
+                return NEW, None
+            self.seen = ((self.seen << advance) | 1) & self.mask
+            self.newest = slot
+            if advance == 1:
+                return NEW, None
+            missing = advance - 1
+            self.gaps += 1
+            self.missing += missing
+            metrics.REALTIME_FRAME_GAPS.inc(self.monitor_id)
+            metrics.REALTIME_FRAMES_MISSING.inc(self.monitor_id, amount=missing)
+            gap = (
+                (slot - advance + 1) * self.interval,
+                (slot - 1) * self.interval,
+                missing,
+            )
+            return NEW, gap
+
+        # Older than the newest epoch; it may fill a slot counted as missing.
+        # Slots older than the window cannot be told apart and are let through.
+        offset = self.newest - slot
+        bit = 1 << offset
+        if offset < self.window and not self.seen & bit:
+            self.seen |= bit
+            if slot > self.oldest:
+                self.missing -= 1
+        self.oldest = min(self.oldest, slot)
+        self.late += 1
+        metrics.REALTIME_FRAMES_LATE.inc(self.monitor_id)
+        return LATE, None
+
+    def stats(self):
+        expected = 0 if self.newest is None else self.newest - self.oldest + 1
+        return {
+            "realtime_frames": self.frames,
+            "realtime_frames_duplicate": self.duplicates,
+            "realtime_frames_late": self.late,
+            "realtime_frame_gaps": self.gaps,
+            "realtime_frames_missing": self.missing,
+            "realtime_completeness": (
+                round(1 - self.missing / expected, 6) if expected else 1.0
+            ),
+        }
@@ -0,0 +1,270 @@
+import math
+from decimal import Decimal
+
+from change_filter import is_number
+from models import FrameDevices
+
+# Escaping rules mirror influxdb_client.client.write.point so that lines built
+# here are byte-for-byte identical to Point.to_line_protocol()
+_ESCAPE_MEASUREMENT = str.maketrans(
+    {
+        ",": r"\,",
+        " ": r"\ ",
+        "\n": r"\n",
+        "\t": r"\t",
+        "\r": r"\r",
+    }
+)
+
+_ESCAPE_KEY = str.maketrans(
+    {
+        ",": r"\,",
+        "=": r"\=",
+        " ": r"\ ",
+        "\n": r"\n",
+        "\t": r"\t",
+        "\r": r"\r",
+    }
+)
+
+_ESCAPE_STRING = str.maketrans(
+    {
+        '"': r"\"",
+        "\\": r"\\",
+    }
+)
+
+# Upper bound on cached device tag-set prefixes before the cache is reset
+MAX_CACHED_PREFIXES = 4096
+
+
+def escape_measurement(name):
+    return str(name).translate(_ESCAPE_MEASUREMENT)
+
+
+def escape_key(key):
+    return str(key).translate(_ESCAPE_KEY)
+
+
+def escape_tag_value(value):
+    escaped = str(value).translate(_ESCAPE_KEY)
+    if escaped.endswith("\\"):
+        escaped += " "
+    return escaped
+
+
+def format_field_value(value):
+    # Returns None for values that Point would silently drop
+    if value is None:
+        return None
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, float) or isinstance(value, Decimal):
+        if not math.isfinite(value):
+            return None
+        formatted = str(value)
+        if formatted.endswith(".0"):
+            formatted = formatted[:-2]
+        return formatted
+    if isinstance(value, int):
+        return f"{value}i"
+    if isinstance(value, str):
+        return f'"{value.translate(_ESCAPE_STRING)}"'
+    raise ValueError(f'Type: "{type(value)}" is not supported.')
+
+
+def encode_prefix(measurement, tags):
+    # Measurement and sorted tag set, including the trailing separator space
+    parts = [escape_measurement(measurement)]
+    for key, value in sorted(tags.items()):
+        if value is None:
+            continue
+        escaped_key = escape_key(key)
+        escaped_value = escape_tag_value(value)
+        if escaped_key != "" and escaped_value != "":
+            parts.append(f"{escaped_key}={escaped_value}")
+    return ",".join(parts) + " "
+
+
+def encode_fields(fields):
+    # Expects fields as (escaped_key, value) pairs already in sorted key order
+    encoded = []
+    for key, value in fields:
+        formatted = format_field_value(value)
+        if formatted is not None:
+            encoded.append(f"{key}={formatted}")
+    return ",".join(encoded)
+
+
+def format_column(key, values):
+    # Encodes one field for a whole column: "key=value" per row, or None where
+    # Point would drop the value. Expects an already escaped key. Floats and
+    # strings, the common cases, skip the generic type dispatch.
+    if values.count(None) == len(values):
+        return values
+    prefix = key + "="
+    texts = []
+    append = texts.append
+    for value in values:
+        if value is None:
+            append(None)
+        elif type(value) is float:
+            if math.isfinite(value):
+                formatted = str(value)
+                if formatted.endswith(".0"):
+                    formatted = formatted[:-2]
+                append(prefix + formatted)
+            else:
+                append(None)
+        elif type(value) is str:
+            append(f'{prefix}"{value.translate(_ESCAPE_STRING)}"')
+        else:
+            formatted = format_field_value(value)
+            append(None if formatted is None else prefix + formatted)
+    return texts
+
+
+class RealtimeEncoder:
+    def __init__(
+        self,
+        max_cached_prefixes=MAX_CACHED_PREFIXES,
+        change_filter=None,
+        derived_fields=False,
+    ):
+        self.max_cached_prefixes = max_cached_prefixes
+
+        # Whether mains lines also carry unattributed_watts and leg_imbalance_watts
+        self.derived_fields = derived_fields
+
+        # Optional ChangeFilter for the rarely changing device fields
+        self.change_filter = change_filter
+
+        # Escaped "measurement,tags " prefixes keyed by their tag values
+        self.mains_prefix_cache = {}
+        self.device_prefix_cache = {}
+
+        # Reusable output buffer for a single frame
+        self.buffer = bytearray()
+
+    def mains_prefixes(self, monitor_id):
+        prefixes = self.mains_prefix_cache.get(monitor_id)
+        if prefixes is None:
+            prefixes = (
+                encode_prefix("sense_mains", {"monitor_id": monitor_id}),
+                encode_prefix("sense_mains", {"monitor_id": monitor_id, "leg": "L1"}),
+                encode_prefix("sense_mains", {"monitor_id": monitor_id, "leg": "L2"}),
+                encode_prefix("sense_o11y", {"monitor_id": monitor_id}),
+            )
+            self.mains_prefix_cache[monitor_id] = prefixes
+        return prefixes
+
+    def device_prefix(self, monitor_id, device_id, device_name, is_plug):
+        key = (monitor_id, device_id, device_name, is_plug)
+        prefix = self.device_prefix_cache.get(key)
+        if prefix is None:
+            if len(self.device_prefix_cache) >= self.max_cached_prefixes:
+                self.device_prefix_cache.clear()
+            prefix = encode_prefix(
+                "sense_devices",
+                {
+                    "monitor_id": monitor_id,
+                    "device_id": device_id,
+                    "device_name": device_name,
+                    "is_plug": "true" if is_plug else "false",
+                },
+            )
+            self.device_prefix_cache[key] = prefix
+        return prefix
+
+    def append_line(self, prefix, fields, timestamp):
+        # Lines without any fields are dropped, as Point does
+        encoded_fields = encode_fields(fields)
+        if not encoded_fields:
+            return 0
+        self.buffer += f"{prefix}{encoded_fields} {timestamp}\n".encode()
+        return 1
+
+    def encode_realtime(
+        self,
+        monitor_id,
+        hertz,
+        total_current,
+        total_watts,
+        epoch,
+        voltage,
+        devices,
+        channels,
+        time_difference,
+    ):
+        # Returns (line protocol bytes, number of lines) for one realtime frame
+        self.buffer.clear()
+        mains_prefix, leg1_prefix, leg2_prefix, o11y_prefix = self.mains_prefixes(
+            monitor_id
+        )
+
+        frame = FrameDevices(devices)
+        mains_fields = [("current", total_current), ("hertz", hertz)]
+        if self.derived_fields:
+            if len(channels) >= 2 and is_number(channels[0]) and is_number(channels[1]):
+                mains_fields.append(("leg_imbalance_watts", channels[0] - channels[1]))
+            if is_number(total_watts):
+                mains_fields.append(
+                    ("unattributed_watts", total_watts - frame.attributed_watts())
+                )
+        mains_fields.append(("watts", total_watts))
+
+        count = self.append_line(mains_prefix, mains_fields, epoch)
+        count += self.append_line(leg1_prefix, (("watts", channels[0]),), epoch)
+        count += self.append_line(leg2_prefix, (("watts", channels[1]),), epoch)
+        count += self.append_line(leg1_prefix, (("voltage", voltage[0]),), epoch)
+        count += self.append_line(leg2_prefix, (("voltage", voltage[1]),), epoch)
+        count += self.append_line(
+            o11y_prefix, (("time_difference", time_difference),), epoch
+        )
+        count += self.encode_devices(monitor_id, frame, epoch)
+
+        return bytes(self.buffer), count
+
+    def encode_devices(self, monitor_id, frame, epoch):
+        # Appends one sense_devices line per device of a FrameDevices, field by
+        # field over whole columns rather than device by device
+        prefixes = [
+            self.device_prefix(monitor_id, device_id, device_name, is_plug)
+            for device_id, device_name, is_plug in zip(
+                frame.ids, frame.names, frame.is_plug()
+            )
+        ]
+        always_on_states = frame.always_on_state
+        icons = frame.icons
+        if self.change_filter is not None:
+            changed = self.change_filter.changed
+            always_on_states = [
+                value if changed(prefix, "always_on_state", value, epoch) else None
+                for prefix, value in zip(prefixes, always_on_states)
+            ]
+            icons = [
+                value if changed(prefix, "icon", value, epoch) else None
+                for prefix, value in zip(prefixes, icons)
+            ]
+
+        # Columns in sorted field key order, as Point writes them
+        columns = (
+            format_column("always_on_state", always_on_states),
+            format_column("always_on_watts", frame.always_on_watts),
+            format_column("icon", icons),
+            format_column("sd_current", frame.sd_current),
+            format_column("sd_energy", frame.sd_energy),
+            format_column("sd_voltage", frame.sd_voltage),
+            format_column("sd_watts", frame.sd_watts),
+            format_column("watts", frame.watts),
+        )
+
+        count = 0
+        suffix = f" {epoch}\n"
+        for prefix, fields in zip(prefixes, zip(*columns)):
+            # Devices without any fields are dropped, as Point does
+            encoded_fields = ",".join(filter(None, fields))
+            if encoded_fields:
+                self.buffer += (prefix + encoded_fields + suffix).encode()
+                count += 1
+        return count
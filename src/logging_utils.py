@@ -0,0 +1,67 @@
+import json
+import logging
+import time
+
+
+class JsonFormatter(logging.Formatter):
+    # One JSON object per line for log shippers
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def configure_logging(log_format="text"):
+    handler = logging.StreamHandler()
+    if log_format == "json":
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(
+            logging.Formatter("%(asctime)s %(levelname)s:%(name)s:%(message)s")
+        )
+    logging.basicConfig(handlers=[handler])
+
+
+class PayloadSampler:
+    # Rate-limits full payload dumps per message key so a repeating malformed
+    # payload logs once per interval instead of once per frame
+    def __init__(self, interval=60.0, max_chars=4000):
+        self.interval = interval
+        self.max_chars = max_chars
+        # key -> [window start, suppressed count]
+        self.windows = {}
+
+    def log(self, logger, level, key, message, payload, *args):
+        # message is a %-style format; the serialized payload is appended last
+        if not logger.isEnabledFor(level):
+            return
+        now = time.monotonic()
+        window = self.windows.get(key)
+        if window is not None and now - window[0] < self.interval:
+            window[1] += 1
+            return
+
+        suppressed = window[1] if window is not None else 0
+        self.windows[key] = [now, 0]
+        if isinstance(payload, bytes):
+            payload = payload.decode(errors="replace")
+        # Raw frames are logged as received
+        dump = payload if isinstance(payload, str) else json.dumps(payload, default=str)
+        if len(dump) > self.max_chars:
+            dump = f"{dump[: self.max_chars]}... ({len(dump)} chars)"
+        if suppressed:
+            logger.log(
+                level,
+                f"{message} (%d similar suppressed). Payload: %s",
+                *args,
+                suppressed,
+                dump,
+            )
+        else:
+            logger.log(level, f"{message}. Payload: %s", *args, dump)
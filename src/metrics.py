@@ -0,0 +1,302 @@
+import asyncio
+import bisect
+import logging
+from collections import defaultdict
+
+from aiohttp import web
+
+logger = logging.getLogger("general")
+
+DEFAULT_BUCKETS = (
+    0.0001,
+    0.00025,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+
+def escape_label_value(value):
+    return str(value).replace("\\", r"\\").replace('"', r"\"").replace("\n", r"\n")
+
+
+def format_labels(label_names, label_values, extra=""):
+    pairs = [
+        f'{name}="{escape_label_value(value)}"'
+        for name, value in zip(label_names, label_values)
+    ]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+
+class Counter:
+    def __init__(self, name, documentation, label_names=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+        self.values = defaultdict(float)
+
+    def inc(self, *label_values, amount=1.0):
+        self.values[label_values] += amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        for label_values, value in list(self.values.items()):
+            lines.append(
+                f"{self.name}{format_labels(self.label_names, label_values)} {format_value(value)}"
+            )
+        return lines
+
+
+class Gauge:
+    def __init__(self, name, documentation, label_names=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+        self.values = {}
+        # label values -> callable evaluated at scrape time
+        self.functions = {}
+
+    def set(self, value, *label_values):
+        self.values[label_values] = value
+
+    def set_function(self, function, *label_values):
+        self.functions[label_values] = function
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge"]
+        values = dict(self.values)
+        for label_values, function in list(self.functions.items()):
+            try:
+                values[label_values] = function()
+            except Exception as e:
+                logger.debug(f"Metric callback for {self.name} failed: {e}")
+        for label_values, value in values.items():
+            lines.append(
+                f"{self.name}{format_labels(self.label_names, label_values)} {format_value(value)}"
+            )
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, documentation, label_names=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+        self.buckets = tuple(buckets)
+        # label values -> [per-bucket counts (plus +Inf), sum]
+        self.values = {}
+
+    def observe(self, value, *label_values):
+        entry = self.values.get(label_values)
+        if entry is None:
+            entry = self.values[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+        entry[0][bisect.bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+
+    def render(self):
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} histogram",
+        ]
+        for label_values, (counts, total) in list(self.values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                labels = format_labels(
+                    self.label_names, label_values, f'le="{format_value(bound)}"'
+                )
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = format_labels(self.label_names, label_values)
+            lines.append(f"{self.name}_sum{labels} {format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+FRAMES_RECEIVED = REGISTRY.register(
+    Counter(
+        "sense_collector_frames_received_total",
+        "WebSocket frames received by message type",
+        ("monitor_id", "type"),
+    )
+)
+HANDLER_SECONDS = REGISTRY.register(
+    Histogram(
+        "sense_collector_handler_seconds",
+        "Time spent in process_and_send_data and each handle_* method",
+        ("handler",),
+    )
+)
+POINTS_QUEUED = REGISTRY.register(
+    Counter(
+        "sense_collector_points_queued_total",
+        "Points passed to write_points",
+    )
+)
+WRITE_POINTS_SECONDS = REGISTRY.register(
+    Histogram(
+        "sense_collector_write_points_seconds",
+        "Time write_points spends queueing points, including backpressure",
+    )
+)
+POINTS_WRITTEN = REGISTRY.register(
+    Counter(
+        "sense_collector_points_written_total",
+        "Points successfully written to InfluxDB",
+    )
+)
+POINTS_REJECTED = REGISTRY.register(
+    Counter(
+        "sense_collector_points_rejected_total",
+        "Points InfluxDB refused for good (400, 413, 422), dropped instead of retried",
+    )
+)
+FLUSH_SECONDS = REGISTRY.register(
+    Histogram(
+        "sense_collector_flush_seconds",
+        "Latency of InfluxDB write batches",
+    )
+)
+WRITE_QUEUE_DEPTH = REGISTRY.register(
+    Gauge(
+        "sense_collector_write_queue_depth",
+        "Entries waiting in an InfluxDB write queue (main, or rollup for a separate rollup bucket)",
+        ("pipeline",),
+    )
+)
+BUFFERED_RECORDS = REGISTRY.register(
+    Gauge(
+        "sense_collector_buffered_records",
+        "Records held in memory before they reach a write queue: open rollup series, or always_on samples waiting for a device name",
+        ("stage",),
+    )
+)
+API_QUEUE_DEPTH = REGISTRY.register(
+    Gauge(
+        "sense_collector_api_queue_depth",
+        "Device lookups waiting in api_call_queue",
+        ("monitor_id",),
+    )
+)
+DEVICE_CACHE_HIT_RATIO = REGISTRY.register(
+    Gauge(
+        "sense_collector_device_cache_hit_ratio",
+        "Share of device lookups answered without a new API request",
+    )
+)
+WS_RECONNECTS = REGISTRY.register(
+    Counter(
+        "sense_collector_websocket_reconnects_total",
+        "WebSocket reconnects by reason",
+        ("monitor_id", "reason"),
+    )
+)
+WS_STATE = REGISTRY.register(
+    Gauge(
+        "sense_collector_websocket_state",
+        "1 for the current WebSocket connection state of each monitor, 0 otherwise",
+        ("monitor_id", "state"),
+    )
+)
+WS_STATE_SECONDS = REGISTRY.register(
+    Counter(
+        "sense_collector_websocket_state_seconds_total",
+        "Time spent in each WebSocket connection state",
+        ("monitor_id", "state"),
+    )
+)
+REALTIME_FRAME_GAPS = REGISTRY.register(
+    Counter(
+        "sense_collector_realtime_frame_gaps_total",
+        "Runs of seconds without realtime frames",
+        ("monitor_id",),
+    )
+)
+REALTIME_FRAMES_MISSING = REGISTRY.register(
+    Counter(
+        "sense_collector_realtime_frames_missing_total",
+        "Seconds without realtime frames, before late arrivals are subtracted",
+        ("monitor_id",),
+    )
+)
+REALTIME_FRAMES_DUPLICATE = REGISTRY.register(
+    Counter(
+        "sense_collector_realtime_frames_duplicate_total",
+        "Realtime frames dropped because the other socket of a rotation already delivered them",
+        ("monitor_id",),
+    )
+)
+REALTIME_FRAMES_LATE = REGISTRY.register(
+    Counter(
+        "sense_collector_realtime_frames_late_total",
+        "Realtime frames that arrived after a newer epoch",
+        ("monitor_id",),
+    )
+)
+EVENT_LOOP_LAG = REGISTRY.register(
+    Histogram(
+        "sense_collector_event_loop_lag_seconds",
+        "Delay between when the event loop lag probe should wake and when it does",
+    )
+)
+
+
+async def monitor_event_loop_lag(interval=1.0):
+    loop = asyncio.get_running_loop()
+    while True:
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        EVENT_LOOP_LAG.observe(max(0.0, loop.time() - expected))
+
+
+async def handle_metrics(request):
+    return web.Response(
+        body=REGISTRY.render().encode(),
+        headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"},
+    )
+
+
+async def start_metrics_server(port, host="0.0.0.0"):
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    logger.info(f"Serving metrics on http://{host}:{port}/metrics")
+    return runner
@@ -0,0 +1,135 @@
+import math
+from array import array
+
+# Stands in for a missing number in float columns
+MISSING = float("nan")
+# Stands in for a missing string in index columns
+MISSING_INDEX = -1
+
+
+class Interner:
+    # Maps repeated strings (monitor ids, device ids, names) to small ints, so
+    # columns hold one int per row and each string is stored once
+    __slots__ = ("indexes", "values")
+
+    def __init__(self):
+        self.indexes = {}
+        self.values = []
+
+    def intern(self, value):
+        if value is None:
+            return MISSING_INDEX
+        index = self.indexes.get(value)
+        if index is None:
+            index = self.indexes[value] = len(self.values)
+            self.values.append(value)
+        return index
+
+    def __len__(self):
+        return len(self.values)
+
+
+class DeviceInfo:
+    __slots__ = ("device_id", "name")
+
+    def __init__(self, device_id, name=None):
+        self.device_id = device_id
+        self.name = name
+
+    def __repr__(self):
+        return f"DeviceInfo({self.device_id!r}, {self.name!r})"
+
+
+class DeviceTable:
+    # One DeviceInfo per device id
+    __slots__ = ("records",)
+
+    def __init__(self):
+        self.records = {}
+
+    def get(self, device_id):
+        return self.records.get(device_id)
+
+    def update(self, device_id, name):
+        record = self.records.get(device_id)
+        if record is None:
+            record = self.records[device_id] = DeviceInfo(device_id, name)
+        else:
+            record.name = name
+        return record
+
+    def __contains__(self, device_id):
+        return device_id in self.records
+
+    def __len__(self):
+        return len(self.records)
+
+
+class SampleColumns:
+    # Per-frame samples held column by column in typed arrays, so a row costs
+    # a few machine words instead of a dict or tuple of boxed values
+    __slots__ = ("columns", "rows")
+
+    def __init__(self, spec):
+        # spec is ((name, array typecode), ...)
+        self.columns = {name: array(typecode) for name, typecode in spec}
+        self.rows = 0
+
+
+# Sense's own "Other" bucket, which already is the unattributed remainder
+UNATTRIBUTED_DEVICE_IDS = frozenset(("unknown",))
+
+_NO_SMART_PLUG_DATA = {}
+
+
+class FrameDevices:
+    # The device list of one realtime frame split into columns in a single
+    # pass. Values keep their original types (None where missing) so they
+    # encode exactly as before; the plug mask and the attributed watts are
+    # computed over whole columns instead of device by device.
+    __slots__ = (
+        "rows",
+        "ids",
+        "names",
+        "icons",
+        "watts",
+        "sd_watts",
+        "sd_current",
+        "sd_voltage",
+        "sd_energy",
+        "always_on_watts",
+        "always_on_state",
+    )
+
+    def __init__(self, devices):
+        self.rows = len(devices)
+        self.ids = [device.get("id") for device in devices]
+        self.names = [device.get("name") for device in devices]
+        self.icons = [device.get("icon") for device in devices]
+        self.watts = [device.get("w") for device in devices]
+        self.always_on_watts = [device.get("ao_w") for device in devices]
+        self.always_on_state = [device.get("ao_st") for device in devices]
+        smart_plug_data = [device.get("sd") or _NO_SMART_PLUG_DATA for device in devices]
+        self.sd_watts = [data.get("w") for data in smart_plug_data]
+        self.sd_current = [data.get("i") for data in smart_plug_data]
+        self.sd_voltage = [data.get("v") for data in smart_plug_data]
+        self.sd_energy = [data.get("e") for data in smart_plug_data]
+
+    def is_plug(self):
+        # True where any smart plug reading is present
+        return [
+            w is not None or i is not None or v is not None or e is not None
+            for w, i, v, e in zip(
+                self.sd_watts, self.sd_current, self.sd_voltage, self.sd_energy
+            )
+        ]
+
+    def attributed_watts(self):
+        # Sum of numeric device watts, leaving out Sense's "Other" bucket
+        return math.fsum(
+            value
+            for device_id, value in zip(self.ids, self.watts)
+            if isinstance(value, (int, float))
+            and not isinstance(value, bool)
+            and device_id not in UNATTRIBUTED_DEVICE_IDS
+        )
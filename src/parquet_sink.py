@@ -0,0 +1,377 @@
+import asyncio
+import importlib.util
+import logging
+import os
+import time
+
+# pyarrow is an optional extra (requirements-parquet.txt) and is only
+# imported once a ParquetSink is created
+pyarrow = None
+
+from models import MISSING, MISSING_INDEX, Interner, SampleColumns
+from sinks import StorageSink
+
+storage_logger = logging.getLogger("storage")
+
+PARTITION_FORMATS = {
+    "hour": "date=%Y-%m-%d/hour=%H",
+    "day": "date=%Y-%m-%d",
+}
+
+
+def import_pyarrow():
+    global pyarrow
+    if pyarrow is None:
+        import pyarrow
+        import pyarrow.compute
+        import pyarrow.parquet
+    return pyarrow
+
+
+def pyarrow_available():
+    return importlib.util.find_spec("pyarrow") is not None
+
+
+def leg(values, index):
+    return values[index] if len(values) > index else None
+
+
+def schemas():
+    # Repeated strings are dictionary encoded in memory and in the files
+    label = pyarrow.dictionary(pyarrow.int32(), pyarrow.string())
+    time_column = pyarrow.field("time", pyarrow.timestamp("ms", tz="UTC"))
+    mains = pyarrow.schema(
+        [
+            time_column,
+            ("monitor_id", label),
+            ("hertz", pyarrow.float64()),
+            ("watts", pyarrow.float64()),
+            ("current", pyarrow.float64()),
+            ("l1_watts", pyarrow.float64()),
+            ("l2_watts", pyarrow.float64()),
+            ("l1_voltage", pyarrow.float64()),
+            ("l2_voltage", pyarrow.float64()),
+        ]
+    )
+    devices = pyarrow.schema(
+        [
+            time_column,
+            ("monitor_id", label),
+            ("device_id", label),
+            ("device_name", label),
+            ("watts", pyarrow.float64()),
+            ("always_on_watts", pyarrow.float64()),
+            ("sd_watts", pyarrow.float64()),
+            ("sd_current", pyarrow.float64()),
+            ("sd_voltage", pyarrow.float64()),
+            ("sd_energy", pyarrow.float64()),
+        ]
+    )
+    return {"realtime_mains": mains, "realtime_devices": devices}
+
+
+def column_spec(schema):
+    # Array typecodes buffering each column: epoch milliseconds, dictionary
+    # indices or floats
+    spec = []
+    for field in schema:
+        if pyarrow.types.is_timestamp(field.type):
+            spec.append((field.name, "q"))
+        elif pyarrow.types.is_dictionary(field.type):
+            spec.append((field.name, "i"))
+        else:
+            spec.append((field.name, "d"))
+    return tuple(spec)
+
+
+def as_float(value):
+    if value is None or isinstance(value, bool):
+        return MISSING
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return MISSING
+
+
+def to_arrow(values, field, dictionary):
+    # Wraps a typed array without copying; NaN and -1 placeholders become nulls
+    if field.type.id == pyarrow.float64().id:
+        column = pyarrow.Array.from_buffers(
+            pyarrow.float64(), len(values), [None, pyarrow.py_buffer(values)]
+        )
+        return pyarrow.compute.if_else(pyarrow.compute.is_nan(column), None, column)
+    if pyarrow.types.is_dictionary(field.type):
+        indices = pyarrow.Array.from_buffers(
+            pyarrow.int32(), len(values), [None, pyarrow.py_buffer(values)]
+        )
+        indices = pyarrow.compute.if_else(
+            pyarrow.compute.equal(indices, MISSING_INDEX), None, indices
+        )
+        return pyarrow.DictionaryArray.from_arrays(
+            indices, pyarrow.array(dictionary, pyarrow.string())
+        )
+    return pyarrow.Array.from_buffers(
+        field.type, len(values), [None, pyarrow.py_buffer(values)]
+    )
+
+
+class ParquetSink(StorageSink):
+    # Full-resolution archive of realtime frames as hive-partitioned Parquet:
+    # <folder>/<table>/date=YYYY-MM-DD[/hour=HH]/part-*.parquet, one table for
+    # mains and a long table with one row per device and frame. Each flush
+    # writes one complete file per table and partition, first as .tmp and
+    # renamed once closed, so a crash loses at most the rows still buffered.
+    # Other events are not archived here.
+    def __init__(
+        self,
+        folder,
+        partition="hour",
+        compression="zstd",
+        batch_rows=65536,
+        flush_interval=60.0,
+        max_buffered_rows=1000000,
+    ):
+        try:
+            import_pyarrow()
+        except ImportError as e:
+            raise ValueError(
+                "The Parquet sink needs pyarrow, see requirements-parquet.txt"
+            ) from e
+        if partition not in PARTITION_FORMATS:
+            raise ValueError(f"Unknown Parquet partitioning {partition}")
+        self.folder = folder
+        self.partition_format = PARTITION_FORMATS[partition]
+        self.compression = compression
+        self.batch_rows = batch_rows
+        self.flush_interval = flush_interval
+        self.max_buffered_rows = max_buffered_rows
+        self.schemas = schemas()
+        self.column_specs = {
+            table: column_spec(schema) for table, schema in self.schemas.items()
+        }
+        # Dictionary column -> interned strings, shared by both tables
+        self.labels = {
+            "monitor_id": Interner(),
+            "device_id": Interner(),
+            "device_name": Interner(),
+        }
+
+        # (table, partition) -> SampleColumns
+        self.buffers = {}
+        self.buffered_rows = 0
+        # Newest partition seen, rebuilt only when the hour changes
+        self.current_partition = None
+        self.partition_epoch = None
+        self.file_sequence = 0
+        self.flush_lock = asyncio.Lock()
+        self.wakeup = asyncio.Event()
+        self.closed = False
+        self.flusher_task = asyncio.create_task(self.flusher())
+
+        self.rows_written = 0
+        self.rows_dropped = 0
+        self.files_written = 0
+        self.flush_failures = 0
+        self.orphans_removed = 0
+
+    def partition(self, epoch):
+        # Frames arrive in order, so the partition string is only rebuilt on change
+        bucket = int(epoch) // 3600
+        if bucket != self.partition_epoch:
+            self.partition_epoch = bucket
+            self.current_partition = time.strftime(
+                self.partition_format, time.gmtime(epoch)
+            )
+        return self.current_partition
+
+    def buffer(self, table, partition):
+        key = (table, partition)
+        buffer = self.buffers.get(key)
+        if buffer is None:
+            buffer = self.buffers[key] = SampleColumns(self.column_specs[table])
+        return buffer
+
+    async def persist_realtime_data(
+        self,
+        monitor_id,
+        hertz,
+        total_current,
+        total_watts,
+        epoch,
+        voltage,
+        devices,
+        channels,
+    ):
+        if self.buffered_rows >= self.max_buffered_rows:
+            self.rows_dropped += 1 + len(devices)
+            return
+        partition = self.partition(epoch)
+        timestamp = int(epoch * 1000)
+        monitor_index = self.labels["monitor_id"].intern(monitor_id)
+        device_ids = self.labels["device_id"]
+        device_names = self.labels["device_name"]
+
+        mains = self.buffer("realtime_mains", partition)
+        columns = mains.columns
+        columns["time"].append(timestamp)
+        columns["monitor_id"].append(monitor_index)
+        columns["hertz"].append(as_float(hertz))
+        columns["watts"].append(as_float(total_watts))
+        columns["current"].append(as_float(total_current))
+        columns["l1_watts"].append(as_float(leg(channels, 0)))
+        columns["l2_watts"].append(as_float(leg(channels, 1)))
+        columns["l1_voltage"].append(as_float(leg(voltage, 0)))
+        columns["l2_voltage"].append(as_float(leg(voltage, 1)))
+        mains.rows += 1
+
+        table = self.buffer("realtime_devices", partition)
+        columns = table.columns
+        for device in devices:
+            device_sd = device.get("sd") or {}
+            columns["time"].append(timestamp)
+            columns["monitor_id"].append(monitor_index)
+            columns["device_id"].append(device_ids.intern(device.get("id")))
+            columns["device_name"].append(device_names.intern(device.get("name")))
+            columns["watts"].append(as_float(device.get("w")))
+            columns["always_on_watts"].append(as_float(device.get("ao_w")))
+            columns["sd_watts"].append(as_float(device_sd.get("w")))
+            columns["sd_current"].append(as_float(device_sd.get("i")))
+            columns["sd_voltage"].append(as_float(device_sd.get("v")))
+            columns["sd_energy"].append(as_float(device_sd.get("e")))
+        table.rows += len(devices)
+
+        self.buffered_rows += 1 + len(devices)
+        if self.buffered_rows >= self.batch_rows or len(self.buffers) > 2:
+            # Enough rows for a row group, or a new partition has started
+            self.wakeup.set()
+
+    # Only realtime frames are archived in Parquet
+    async def persist_device_data(self, device_data):
+        pass
+
+    async def persist_timeline_events(self, events):
+        pass
+
+    async def persist_frame_gap(self, monitor_id, start_epoch, end_epoch, missing):
+        pass
+
+    async def persist_hello_event(self, monitor_id, online_status, timestamp):
+        pass
+
+    async def persist_data_change_event(
+        self,
+        monitor_id,
+        device_id,
+        user_version,
+        guid,
+        epoch_timestamp,
+        influxdb_timestamp,
+    ):
+        pass
+
+    async def persist_device_state(
+        self, monitor_id, device_id, mode, device_state, timestamp
+    ):
+        pass
+
+    async def persist_collector_health(self, monitor_id, health):
+        pass
+
+    async def persist_monitor_status(self, monitor_id, monitor_status):
+        pass
+
+    async def flusher(self):
+        # Under the flush lock, so a flush already writing its .tmp parts is
+        # never mistaken for a crashed one
+        async with self.flush_lock:
+            await asyncio.to_thread(self.remove_orphans)
+        while not self.closed:
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self.wakeup.clear()
+            await self.flush()
+
+    def remove_orphans(self):
+        # A .tmp file is a part whose write was cut short (crash, OOM); it has
+        # no footer, so it cannot be finished and is never read
+        for directory, _, file_names in os.walk(self.folder):
+            for file_name in file_names:
+                if file_name.endswith(".parquet.tmp"):
+                    path = os.path.join(directory, file_name)
+                    try:
+                        os.remove(path)
+                        self.orphans_removed += 1
+                        storage_logger.warning(f"Removed unfinished Parquet file {path}")
+                    except OSError as e:
+                        storage_logger.error(f"Could not remove {path}: {e}")
+
+    async def flush(self):
+        async with self.flush_lock:
+            buffers, count = self.buffers, self.buffered_rows
+            self.buffers = {}
+            self.buffered_rows = 0
+            # Every index in the buffers refers to a string interned by now
+            dictionaries = {
+                name: list(interner.values) for name, interner in self.labels.items()
+            }
+            try:
+                await asyncio.to_thread(self.write_buffers, buffers, dictionaries)
+                self.rows_written += count
+            except (OSError, pyarrow.ArrowException) as e:
+                self.flush_failures += 1
+                self.rows_dropped += count
+                storage_logger.error(f"Failed to write {count} rows to Parquet: {e}")
+
+    def write_buffers(self, buffers, dictionaries):
+        for (table, partition), buffer in buffers.items():
+            if not buffer.rows:
+                continue
+            schema = self.schemas[table]
+            batch = pyarrow.record_batch(
+                [
+                    to_arrow(buffer.columns[field.name], field, dictionaries.get(field.name))
+                    for field in schema
+                ],
+                schema=schema,
+            )
+            self.write_part(table, partition, batch)
+
+    def write_part(self, table, partition, batch):
+        # Readers globbing *.parquet only ever see complete files
+        directory = os.path.join(self.folder, table, partition)
+        os.makedirs(directory, exist_ok=True)
+        self.file_sequence += 1
+        path = os.path.join(
+            directory,
+            f"part-{int(time.time())}-{os.getpid()}-{self.file_sequence}.parquet",
+        )
+        temporary_path = f"{path}.tmp"
+        try:
+            with pyarrow.parquet.ParquetWriter(
+                temporary_path, batch.schema, compression=self.compression
+            ) as writer:
+                writer.write_batch(batch)
+            os.replace(temporary_path, path)
+        except BaseException:
+            if os.path.exists(temporary_path):
+                os.remove(temporary_path)
+            raise
+        self.files_written += 1
+
+    def stats(self):
+        return {
+            "parquet_rows_written": self.rows_written,
+            "parquet_rows_buffered": self.buffered_rows,
+            "parquet_rows_dropped": self.rows_dropped,
+            "parquet_files_written": self.files_written,
+            "parquet_flush_failures": self.flush_failures,
+            "parquet_orphans_removed": self.orphans_removed,
+        }
+
+    async def close(self):
+        self.closed = True
+        self.wakeup.set()
+        await self.flusher_task
+        await self.flush()
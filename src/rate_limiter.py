@@ -0,0 +1,143 @@
+import asyncio
+import logging
+import random
+import time
+
+import aiohttp
+
+api_logger = logging.getLogger("api")
+
+# Statuses worth retrying besides 429
+RETRYABLE_STATUSES = {500, 502, 503, 504}
+
+
+class AdaptiveRateLimiter:
+    # Token bucket whose refill rate follows AIMD: it grows additively after
+    # every successful request and is cut multiplicatively on HTTP 429.
+    # Retry-After pauses every caller, not just the one that was throttled.
+    def __init__(
+        self,
+        initial_rate=2.0,
+        min_rate=0.2,
+        max_rate=10.0,
+        burst=4,
+        increase_step=0.05,
+        decrease_factor=0.5,
+        max_retries=5,
+        backoff_base=1.0,
+        backoff_cap=60.0,
+    ):
+        self.rate = initial_rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.burst = burst
+        self.increase_step = increase_step
+        self.decrease_factor = decrease_factor
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+
+        self.tokens = float(burst)
+        self.last_refill = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = asyncio.Lock()
+
+        self.requests = 0
+        self.throttled = 0
+        self.retries = 0
+        self.failures = 0
+
+    async def acquire(self):
+        # Waiters queue on the lock, so tokens are handed out in FIFO order
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                self.tokens = min(
+                    self.burst, self.tokens + (now - self.last_refill) * self.rate
+                )
+                self.last_refill = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def on_success(self):
+        self.rate = min(self.max_rate, self.rate + self.increase_step)
+
+    def on_throttled(self, retry_after):
+        self.throttled += 1
+        self.rate = max(self.min_rate, self.rate * self.decrease_factor)
+        self.tokens = 0.0
+        self.paused_until = max(self.paused_until, time.monotonic() + retry_after)
+        api_logger.warning(
+            f"Rate limited. Pausing requests for {retry_after} seconds, rate lowered to {self.rate:.2f}/s"
+        )
+
+    def backoff_delay(self, attempt):
+        # Full jitter exponential backoff
+        return random.uniform(0, min(self.backoff_cap, self.backoff_base * 2**attempt))
+
+    async def get_json(self, session, url, **kwargs):
+        for attempt in range(self.max_retries + 1):
+            last_attempt = attempt == self.max_retries
+            await self.acquire()
+            self.requests += 1
+            try:
+                async with session.get(url, **kwargs) as response:
+                    if response.status == 429:
+                        retry_after = parse_retry_after(
+                            response.headers.get("Retry-After"),
+                            self.backoff_delay(attempt),
+                        )
+                        self.on_throttled(retry_after)
+                        if not last_attempt:
+                            self.retries += 1
+                            continue
+                    elif response.status in RETRYABLE_STATUSES and not last_attempt:
+                        delay = self.backoff_delay(attempt)
+                        api_logger.warning(
+                            f"HTTP {response.status} from {url}, retrying in {delay:.2f} seconds"
+                        )
+                        self.retries += 1
+                        await asyncio.sleep(delay)
+                        continue
+
+                    response.raise_for_status()
+                    data = await response.json()
+                    self.on_success()
+                    return data
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                if last_attempt:
+                    self.failures += 1
+                    raise
+                delay = self.backoff_delay(attempt)
+                api_logger.warning(
+                    f"Request to {url} failed: {e}, retrying in {delay:.2f} seconds"
+                )
+                self.retries += 1
+                await asyncio.sleep(delay)
+            except aiohttp.ClientError:
+                self.failures += 1
+                raise
+
+    def stats(self):
+        return {
+            "api_rate": self.rate,
+            "api_requests": self.requests,
+            "api_throttled": self.throttled,
+            "api_retries": self.retries,
+            "api_failures": self.failures,
+        }
+
+
+def parse_retry_after(value, default):
+    # Retry-After may be a number of seconds or an HTTP date; fall back to backoff
+    if value is None:
+        return default
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        return default
@@ -0,0 +1,274 @@
+import argparse
+import asyncio
+import importlib.util
+import json
+import logging
+import os
+import re
+import time
+from collections import defaultdict
+
+from capture import COMPRESSION_EXTENSIONS, open_capture
+from parquet_sink import ParquetSink
+from rollup import parse_windows
+from sinks import FanoutSink
+from sqlite_sink import SQLiteSink
+from storage import InfluxDBStorage
+
+replay_logger = logging.getLogger("replay")
+
+
+def load_collector_module():
+    # sense-collector.py is not importable by name, so load it from its path
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sense-collector.py")
+    spec = importlib.util.spec_from_file_location("sense_collector", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def read_capture(capture_path):
+    # Yields raw text frames, as receive_data sees them
+    with open_capture(capture_path) as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield line
+
+
+def load_device_captures(capture_folder):
+    # device_<id>.json files hold appended, indented responses; keep the last one
+    devices = {}
+    if not os.path.isdir(capture_folder):
+        return devices
+    decoder = json.JSONDecoder()
+    for file_name in os.listdir(capture_folder):
+        name = file_name
+        for extension in COMPRESSION_EXTENSIONS.values():
+            if extension and name.endswith(extension):
+                name = name[: -len(extension)]
+        # Rotated files (device_<id>-<date>-<time>.json) hold older responses
+        if not (name.startswith("device_") and name.endswith(".json")) or re.search(
+            r"-\d{8}-\d{6}", name
+        ):
+            continue
+        with open_capture(os.path.join(capture_folder, file_name)) as f:
+            content = f.read()
+        position = 0
+        device_data = None
+        while True:
+            while position < len(content) and content[position].isspace():
+                position += 1
+            if position >= len(content):
+                break
+            try:
+                device_data, position = decoder.raw_decode(content, position)
+            except json.JSONDecodeError:
+                break
+        if device_data is not None:
+            devices[name[len("device_") : -len(".json")]] = device_data
+    return devices
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class MemoryWriteAPI:
+    # Stand-in for the influxdb_client write API that counts (and optionally
+    # keeps) line protocol instead of sending it over HTTP
+    def __init__(self, output_path=None):
+        self.points = 0
+        self.bytes = 0
+        self.output = open(output_path, "ab") if output_path else None
+
+    def write(self, bucket, org, record, write_precision=None):
+        if isinstance(record, bytes):
+            data = record
+        else:
+            lines = [point.to_line_protocol() for point in record]
+            data = "".join(f"{line}\n" for line in lines if line).encode()
+        self.points += data.count(b"\n")
+        self.bytes += len(data)
+        if self.output:
+            self.output.write(data)
+
+    def close(self):
+        if self.output:
+            self.output.close()
+            self.output = None
+
+
+class ReplayStats:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.points = defaultdict(int)
+        self.started = None
+        self.finished = None
+
+    def record(self, data_type, latency, points):
+        self.latencies[data_type].append(latency)
+        self.points[data_type] += points
+
+    def report(self):
+        elapsed = max(self.finished - self.started, 1e-9)
+        frames = sum(len(values) for values in self.latencies.values())
+        points = sum(self.points.values())
+        lines = [
+            f"Replayed {frames} frames in {elapsed:.3f} seconds",
+            f"Throughput: {frames / elapsed:.1f} frames/sec, {points / elapsed:.1f} points/sec",
+            f"{'type':<22}{'frames':>8}{'points':>10}{'p50 ms':>10}{'p99 ms':>10}",
+        ]
+        for data_type in sorted(self.latencies):
+            values = sorted(self.latencies[data_type])
+            lines.append(
+                f"{data_type:<22}{len(values):>8}{self.points[data_type]:>10}"
+                f"{percentile(values, 0.50) * 1000:>10.3f}"
+                f"{percentile(values, 0.99) * 1000:>10.3f}"
+            )
+        return "\n".join(lines)
+
+
+async def replay(
+    capture_path,
+    realtime=False,
+    output_path=None,
+    device_folder=None,
+    rollup_windows=None,
+    rollup_raw=True,
+    change_only=False,
+    sqlite_path=None,
+    parquet_folder=None,
+    derived_fields=False,
+):
+    collector_module = load_collector_module()
+
+    write_api = MemoryWriteAPI(output_path)
+    influxdb_params = {
+        "url": "http://localhost:8086",
+        "token": "replay",
+        "org": "replay",
+        "bucket": "replay",
+        "rollup_windows": rollup_windows,
+        "rollup_raw": rollup_raw,
+        "change_only": change_only,
+        "derived_fields": derived_fields,
+    }
+    storage = InfluxDBStorage(influxdb_params, write_api=write_api)
+    archives = []
+    if sqlite_path:
+        archives.append(SQLiteSink(sqlite_path))
+    if parquet_folder:
+        archives.append(ParquetSink(parquet_folder))
+    sink = FanoutSink(storage, archives) if archives else storage
+    account = collector_module.SenseAccount("replay", "replay")
+    collector = collector_module.SenseCollector("replay", account, sink)
+
+    # Serve device lookups from captured device_<id>.json responses only
+    devices = load_device_captures(
+        device_folder or os.path.dirname(os.path.abspath(capture_path))
+    )
+
+    async def offline_lookup(device_id):
+        return devices.get(str(device_id))
+
+    collector.lookup_device_data = offline_lookup
+
+    stats = ReplayStats()
+    stats.started = time.perf_counter()
+    previous_epoch = None
+    previous_sent = None
+
+    for raw in read_capture(capture_path):
+        if realtime and '"realtime_update"' in raw:
+            epoch = json.loads(raw).get("payload", {}).get("epoch")
+            if epoch is not None and previous_epoch is not None:
+                delay = (epoch - previous_epoch) - (time.perf_counter() - previous_sent)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            previous_epoch = epoch
+            previous_sent = time.perf_counter()
+
+        points_before = storage.write_pipeline.points_enqueued
+        frame_start = time.perf_counter()
+        data_type = await collector.process_raw_frame(raw)
+        stats.record(
+            data_type or "invalid",
+            time.perf_counter() - frame_start,
+            storage.write_pipeline.points_enqueued - points_before,
+        )
+
+    # Include draining the write pipeline in the measured run
+    await collector.timeline.close()
+    await sink.close()
+    stats.finished = time.perf_counter()
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Replay a SENSE_COLLECTOR_OUTPUT_RECEIVED_DATA capture"
+    )
+    parser.add_argument("capture", help="Path to a received_data.json capture file")
+    parser.add_argument(
+        "--realtime",
+        action="store_true",
+        help="Pace realtime_update frames by their epoch instead of as fast as possible",
+    )
+    parser.add_argument(
+        "--output", help="Append the produced line protocol to this file"
+    )
+    parser.add_argument(
+        "--device-folder",
+        help="Folder with captured device_<id>.json responses (defaults to the capture folder)",
+    )
+    parser.add_argument(
+        "--rollup",
+        default="",
+        help="Comma-separated rollup windows in seconds, e.g. 1,10,60",
+    )
+    parser.add_argument(
+        "--no-raw",
+        action="store_true",
+        help="With --rollup, write only the rollups instead of raw realtime points",
+    )
+    parser.add_argument(
+        "--change-only",
+        action="store_true",
+        help="Skip unchanged device and status fields",
+    )
+    parser.add_argument(
+        "--derived-fields",
+        action="store_true",
+        help="Add unattributed_watts and leg_imbalance_watts to mains points",
+    )
+    parser.add_argument(
+        "--sqlite", help="Also archive the replay into this SQLite database"
+    )
+    parser.add_argument(
+        "--parquet", help="Also archive realtime frames as Parquet in this folder"
+    )
+    args = parser.parse_args()
+
+    stats = asyncio.run(
+        replay(
+            args.capture,
+            args.realtime,
+            args.output,
+            args.device_folder,
+            parse_windows(args.rollup),
+            not args.no_raw,
+            args.change_only,
+            args.sqlite,
+            args.parquet,
+            args.derived_fields,
+        )
+    )
+    print(stats.report())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,269 @@
+from line_protocol import MAX_CACHED_PREFIXES, encode_fields, encode_prefix
+
+# Numeric realtime device fields that are rolled up
+DEVICE_FIELDS = (
+    ("always_on_watts", "ao_w"),
+    ("watts", "w"),
+)
+DEVICE_SD_FIELDS = (
+    ("sd_current", "i"),
+    ("sd_energy", "e"),
+    ("sd_voltage", "v"),
+    ("sd_watts", "w"),
+)
+
+
+def window_label(seconds):
+    if seconds % 3600 == 0:
+        return f"{seconds // 3600}h"
+    if seconds % 60 == 0:
+        return f"{seconds // 60}m"
+    return f"{seconds}s"
+
+
+def parse_windows(value):
+    # "1,10,60" -> [1, 10, 60]; an empty string disables rollups
+    return [int(window) for window in value.split(",") if window.strip()]
+
+
+class Accumulator:
+    __slots__ = ("minimum", "maximum", "total", "count", "last")
+
+    def __init__(self, value):
+        self.minimum = value
+        self.maximum = value
+        self.total = value
+        self.count = 1
+        self.last = value
+
+    def add(self, value):
+        if value < self.minimum:
+            self.minimum = value
+        elif value > self.maximum:
+            self.maximum = value
+        self.total += value
+        self.count += 1
+        self.last = value
+
+    def merge(self, other):
+        if other.minimum < self.minimum:
+            self.minimum = other.minimum
+        if other.maximum > self.maximum:
+            self.maximum = other.maximum
+        self.total += other.total
+        self.count += other.count
+        self.last = other.last
+
+
+class RollupWindow:
+    __slots__ = ("seconds", "label", "start", "series")
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.label = window_label(seconds)
+        # Start epoch of the open window, None until the first frame
+        self.start = None
+        # series key -> {field: Accumulator}
+        self.series = {}
+
+
+class RollupStage:
+    # Aggregates realtime frames into min, max, mean and last per window.
+    # Frames only update the finest window; each closed window is merged into
+    # the next coarser one, so per-frame cost does not grow with the number of
+    # windows. Frames older than the open window are folded into it.
+    def __init__(
+        self,
+        windows=(1, 10, 60),
+        measurement_suffix="_rollup",
+        max_cached_prefixes=MAX_CACHED_PREFIXES,
+    ):
+        windows = sorted(set(windows))
+        if not windows or windows[0] <= 0:
+            raise ValueError(f"Invalid rollup windows {windows}")
+        # Each window is built from closed windows of the next finer one, so
+        # every window must be a whole number of the one before it
+        for finer, seconds in zip(windows, windows[1:]):
+            if seconds % finer:
+                raise ValueError(
+                    f"Rollup window {seconds}s is not a multiple of {finer}s; "
+                    f"each window must divide the next coarser one"
+                )
+        self.windows = windows
+        self.measurement_suffix = measurement_suffix
+        self.max_cached_prefixes = max_cached_prefixes
+
+        # monitor_id -> [RollupWindow, ...] from finest to coarsest
+        self.monitors = {}
+        # (series key, window label, partial) -> escaped "measurement,tags " prefix
+        self.prefix_cache = {}
+        self.buffer = bytearray()
+
+    def add_frame(
+        self,
+        monitor_id,
+        hertz,
+        total_current,
+        total_watts,
+        epoch,
+        voltage,
+        devices,
+        channels,
+    ):
+        # Returns (line protocol bytes, number of lines) for windows this frame closed
+        levels = self.monitors.get(monitor_id)
+        if levels is None:
+            levels = self.monitors[monitor_id] = [
+                RollupWindow(seconds) for seconds in self.windows
+            ]
+
+        self.buffer.clear()
+        count = 0
+        finest = levels[0]
+        window_start = epoch - epoch % finest.seconds
+        if finest.start is None:
+            for level in levels:
+                level.start = epoch - epoch % level.seconds
+        elif window_start > finest.start:
+            count = self.close_window(levels, 0, epoch)
+
+        series = finest.series
+        self.add(series, ("mains", monitor_id, None), "current", total_current)
+        self.add(series, ("mains", monitor_id, None), "hertz", hertz)
+        self.add(series, ("mains", monitor_id, None), "watts", total_watts)
+        if len(channels) >= 2:
+            self.add(series, ("mains", monitor_id, "L1"), "watts", channels[0])
+            self.add(series, ("mains", monitor_id, "L2"), "watts", channels[1])
+        if len(voltage) >= 2:
+            self.add(series, ("mains", monitor_id, "L1"), "voltage", voltage[0])
+            self.add(series, ("mains", monitor_id, "L2"), "voltage", voltage[1])
+
+        for device in devices:
+            device_sd = device.get("sd") or {}
+            is_plug = any(
+                device_sd.get(source) is not None for _, source in DEVICE_SD_FIELDS
+            )
+            key = ("device", monitor_id, device.get("id"), device.get("name"), is_plug)
+            for field, source in DEVICE_FIELDS:
+                self.add(series, key, field, device.get(source))
+            if is_plug:
+                for field, source in DEVICE_SD_FIELDS:
+                    self.add(series, key, field, device_sd.get(source))
+
+        return bytes(self.buffer), count
+
+    def buffered_series(self):
+        # Series in open windows, each written as one line when its window closes
+        return sum(
+            len(level.series) for levels in self.monitors.values() for level in levels
+        )
+
+    @staticmethod
+    def add(series, key, field, value):
+        # Only numbers are rolled up; ints are widened so field types never change
+        if value is None or isinstance(value, bool):
+            return
+        try:
+            value = float(value)
+        except (TypeError, ValueError):
+            return
+        fields = series.get(key)
+        if fields is None:
+            fields = series[key] = {}
+        accumulator = fields.get(field)
+        if accumulator is None:
+            fields[field] = Accumulator(value)
+        else:
+            accumulator.add(value)
+
+    def close_window(self, levels, index, epoch):
+        level = levels[index]
+        count = self.emit(level)
+        if index + 1 < len(levels):
+            coarser = levels[index + 1]
+            self.merge(level, coarser)
+            if epoch - epoch % coarser.seconds > coarser.start:
+                count += self.close_window(levels, index + 1, epoch)
+        level.series = {}
+        level.start = epoch - epoch % level.seconds
+        return count
+
+    @staticmethod
+    def merge(level, coarser):
+        # Hands the accumulators of a closed window to the next coarser one
+        for key, fields in level.series.items():
+            coarser_fields = coarser.series.get(key)
+            if coarser_fields is None:
+                coarser.series[key] = fields
+                continue
+            for field, accumulator in fields.items():
+                coarser_accumulator = coarser_fields.get(field)
+                if coarser_accumulator is None:
+                    coarser_fields[field] = accumulator
+                else:
+                    coarser_accumulator.merge(accumulator)
+
+    def emit(self, level, partial=False):
+        count = 0
+        for key, fields in level.series.items():
+            pairs = []
+            for field in sorted(fields):
+                accumulator = fields[field]
+                pairs.append((f"{field}_last", accumulator.last))
+                pairs.append((f"{field}_max", accumulator.maximum))
+                pairs.append((f"{field}_mean", accumulator.total / accumulator.count))
+                pairs.append((f"{field}_min", accumulator.minimum))
+            encoded_fields = encode_fields(pairs)
+            if encoded_fields:
+                prefix = self.prefix(key, level.label, partial)
+                self.buffer += f"{prefix}{encoded_fields} {level.start}\n".encode()
+                count += 1
+        return count
+
+    def prefix(self, key, label, partial=False):
+        cache_key = (key, label, partial)
+        prefix = self.prefix_cache.get(cache_key)
+        if prefix is None:
+            if len(self.prefix_cache) >= self.max_cached_prefixes:
+                self.prefix_cache.clear()
+            if key[0] == "mains":
+                _, monitor_id, leg = key
+                prefix = encode_prefix(
+                    "sense_mains" + self.measurement_suffix,
+                    {
+                        "monitor_id": monitor_id,
+                        "leg": leg,
+                        "window": label,
+                        "partial": "true" if partial else None,
+                    },
+                )
+            else:
+                _, monitor_id, device_id, device_name, is_plug = key
+                prefix = encode_prefix(
+                    "sense_devices" + self.measurement_suffix,
+                    {
+                        "monitor_id": monitor_id,
+                        "device_id": device_id,
+                        "device_name": device_name,
+                        "is_plug": "true" if is_plug else "false",
+                        "window": label,
+                        "partial": "true" if partial else None,
+                    },
+                )
+            self.prefix_cache[cache_key] = prefix
+        return prefix
+
+    def flush(self):
+        # Emits every open window, e.g. on shutdown. These windows are cut
+        # short and get a partial=true tag: after a restart the next run
+        # writes its own point for the same window start, which would
+        # otherwise overwrite the data from before the restart.
+        self.buffer.clear()
+        count = 0
+        for levels in self.monitors.values():
+            for index, level in enumerate(levels):
+                count += self.emit(level, partial=True)
+                if index + 1 < len(levels):
+                    self.merge(level, levels[index + 1])
+                level.series = {}
+        return bytes(self.buffer), count
@@ -7,7 +7,28 @@ from datetime import datetime, timezone, timedelta
 import aiohttp
 from aiohttp import ClientError, ClientConnectionError, WSMsgType
 
+import metrics
+from capture import CaptureWriter, zstandard
+from connection_state import (
+    BACKOFF,
+    CONNECTING,
+    DEGRADED,
+    STREAMING,
+    ConnectionStateMachine,
+    DecorrelatedJitterBackoff,
+)
+from decoder import FrameDecodeError, FrameDecoder, realtime_from_dict
+from device_cache import DeviceCache
+from frame_tracker import DUPLICATE, FrameTracker
+from logging_utils import PayloadSampler, configure_logging
+from parquet_sink import ParquetSink, pyarrow_available
+from rate_limiter import AdaptiveRateLimiter
+from rollup import parse_windows
+from sinks import FanoutSink
+from sqlite_sink import SQLiteSink
 from storage import InfluxDBStorage
+from timeline import TimelineIngester
+from work_queue import KeyedWorkQueue, PRIORITY_EVENT, PRIORITY_SWEEP
 import logging
 
 # Set defaults for heartbeat interval, timeout, and reconnect delay
@@ -26,36 +47,92 @@ reconnect_delay_initial = int(
 # Maximum delay in seconds between reconnection attempts
 reconnect_delay_cap = int(os.getenv("SENSE_COLLECTOR_WS_RECONNECT_DELAY_CAP", 60))
 
-# Maximum number of retries for reconnecting the WebSocket connection
-max_retries = int(os.getenv("SENSE_COLLECTOR_WS_MAX_RETRIES", 3))
-
-# Factor to increase the delay between reconnection attempts
-backoff_factor = int(os.getenv("SENSE_COLLECTOR_WS_BACKOFF_FACTOR", 1))
+# Seconds a connection has to stream before the reconnect backoff starts over
+backoff_reset_seconds = int(
+    os.getenv("SENSE_COLLECTOR_WS_BACKOFF_RESET_SECONDS", 60)
+)
 
-# Interval in seconds after which the WebSocket connection will be forcefully reconnected
+# Interval in seconds after which the WebSocket connection is replaced by a new one
 reconnect_interval = int(os.getenv("SENSE_COLLECTOR_WS_RECONNECT_INTERVAL", 840))
 
+# Seconds a replacement WebSocket has to start streaming before the rotation is abandoned
+rotation_timeout = int(os.getenv("SENSE_COLLECTOR_WS_ROTATION_TIMEOUT", 30))
+
 
 # Time in seconds before cached device data expires and needs to be fetched again
 device_cache_expiry_seconds = int(
     os.getenv("SENSE_COLLECTOR_DEVICE_CACHE_EXPIRY_SECONDS", 120)
 )
 
+# Time in seconds after expiry during which cached device data is still served while it is refreshed
+device_cache_stale_seconds = int(
+    os.getenv("SENSE_COLLECTOR_DEVICE_CACHE_STALE_SECONDS", 600)
+)
+
+# Maximum number of devices kept in the device data cache
+device_cache_max_entries = int(
+    os.getenv("SENSE_COLLECTOR_DEVICE_CACHE_MAX_ENTRIES", 1024)
+)
+
 # Maximum number of concurrent device data lookups to perform at any given time
 device_max_concurrent_lookups = int(
     os.getenv("SENSE_COLLECTOR_DEVICE_MAX_CONCURRENT_LOOKUPS", 4)
 )
 
-# Delay in seconds between consecutive device data lookups to prevent overloading the server
+# Number of workers draining the device lookup queue for each monitor
+device_lookup_workers = int(
+    os.getenv("SENSE_COLLECTOR_DEVICE_LOOKUP_WORKERS", device_max_concurrent_lookups)
+)
+
+# Initial spacing in seconds between Sense API requests; the rate limiter adapts from there
 device_lookup_delay_seconds = float(
     os.getenv("SENSE_COLLECTOR_DEVICE_LOOKUP_DELAY_SECONDS", 0.5)
 )
 
+# Upper bound in requests per second the adaptive rate limiter may reach
+api_rate_max = float(os.getenv("SENSE_COLLECTOR_API_RATE_MAX", 10))
+
+# Lower bound in requests per second the adaptive rate limiter may drop to
+api_rate_min = float(os.getenv("SENSE_COLLECTOR_API_RATE_MIN", 0.2))
+
+# Maximum number of retries for a throttled or failed Sense API request
+api_max_retries = int(os.getenv("SENSE_COLLECTOR_API_MAX_RETRIES", 5))
+
 # Token renewal interval in seconds (default is 12 hours)
 token_renew_interval = int(
     os.getenv("SENSE_COLLECTOR_API_TOKEN_RENEW", 43200)
 )  # 43200 seconds = 12 hours
 
+# Maximum number of pending writes held between the collector and InfluxDB
+write_queue_size = int(os.getenv("SENSE_COLLECTOR_WRITE_QUEUE_SIZE", 1000))
+
+# Number of queued points that triggers an immediate write to InfluxDB
+write_batch_size = int(os.getenv("SENSE_COLLECTOR_WRITE_BATCH_SIZE", 5000))
+
+# Maximum time in seconds a point waits in the write queue before being flushed
+write_flush_interval = float(os.getenv("SENSE_COLLECTOR_WRITE_FLUSH_INTERVAL", 1.0))
+
+# What to do when the write queue is full: block, drop_oldest or spill (to disk)
+write_overflow_policy = os.getenv(
+    "SENSE_COLLECTOR_WRITE_OVERFLOW_POLICY", "block"
+).lower()
+
+# Maximum disk space in megabytes for spooled writes during InfluxDB outages (0 disables the spool)
+spool_max_mb = int(os.getenv("SENSE_COLLECTOR_SPOOL_MAX_MB", 512))
+
+# Size in megabytes of each spool segment, which is also the size of a drain batch
+spool_segment_mb = int(os.getenv("SENSE_COLLECTOR_SPOOL_SEGMENT_MB", 8))
+
+# Minimum interval in seconds between fsync calls on the active spool segment
+spool_fsync_interval = float(os.getenv("SENSE_COLLECTOR_SPOOL_FSYNC_INTERVAL", 1.0))
+
+# Delay in seconds after a failed write before InfluxDB is tried again
+spool_retry_interval = float(os.getenv("SENSE_COLLECTOR_SPOOL_RETRY_INTERVAL", 10))
+
+
+# Port for the Prometheus metrics endpoint (0 disables it)
+metrics_port = int(os.getenv("SENSE_COLLECTOR_METRICS_PORT", 0))
+
 
 # Configure logging based on environment variables
 
@@ -73,11 +150,104 @@ output_received_data = (
     os.getenv("SENSE_COLLECTOR_OUTPUT_RECEIVED_DATA", "false").lower() == "true"
 )
 
-logging.basicConfig(
-    format="%(asctime)s %(levelname)s:%(name)s:%(message)s",
-    handlers=[logging.StreamHandler()],
+# Rotate capture files once they reach this size in megabytes
+capture_max_mb = int(os.getenv("SENSE_COLLECTOR_CAPTURE_MAX_MB", 100))
+
+# Rotate capture files after this many seconds
+capture_rotate_interval = int(os.getenv("SENSE_COLLECTOR_CAPTURE_ROTATE_INTERVAL", 86400))
+
+# Number of rotated capture files kept per stream
+capture_max_files = int(os.getenv("SENSE_COLLECTOR_CAPTURE_MAX_FILES", 10))
+
+# Capture file compression: none, gzip or zstd
+capture_compression = os.getenv("SENSE_COLLECTOR_CAPTURE_COMPRESSION", "none").lower()
+
+# Seconds between capture buffer flushes
+capture_flush_interval = float(
+    os.getenv("SENSE_COLLECTOR_CAPTURE_FLUSH_INTERVAL", 1.0)
+)
+
+# Comma-separated realtime rollup windows in seconds (e.g. 1,10,60); empty disables
+rollup_windows = parse_windows(os.getenv("SENSE_COLLECTOR_ROLLUP_WINDOWS", ""))
+
+# Whether to keep writing raw realtime points alongside the rollups
+rollup_raw = os.getenv("SENSE_COLLECTOR_ROLLUP_RAW", "true").lower() == "true"
+
+# Bucket for rollups (defaults to SENSE_COLLECTOR_INFLUXDB_BUCKET)
+rollup_bucket = os.getenv("SENSE_COLLECTOR_ROLLUP_BUCKET", "")
+
+# Whether to skip rarely changing status and string fields that have not changed
+change_only = os.getenv("SENSE_COLLECTOR_CHANGE_ONLY", "false").lower() == "true"
+
+# Numeric status fields within this absolute difference count as unchanged
+change_deadband = float(os.getenv("SENSE_COLLECTOR_CHANGE_DEADBAND", 0))
+
+# Seconds after which an unchanged field is written again
+change_keepalive = float(os.getenv("SENSE_COLLECTOR_CHANGE_KEEPALIVE", 900))
+
+# Whether mains points also get unattributed_watts and leg_imbalance_watts
+derived_fields = (
+    os.getenv("SENSE_COLLECTOR_DERIVED_FIELDS", "false").lower() == "true"
+)
+
+# Whether to poll the account timeline and record its events
+timeline_enabled = (
+    os.getenv("SENSE_COLLECTOR_TIMELINE_ENABLED", "false").lower() == "true"
+)
+
+# Seconds between timeline polls
+timeline_interval = int(os.getenv("SENSE_COLLECTOR_TIMELINE_INTERVAL", 60))
+
+# Maximum concurrent device lookups while resolving timeline device names
+timeline_concurrency = int(os.getenv("SENSE_COLLECTOR_TIMELINE_CONCURRENCY", 4))
+
+# Seconds an always_on sample waits for its device name before it is dropped
+pending_device_ttl = int(os.getenv("SENSE_COLLECTOR_PENDING_DEVICE_TTL", 3600))
+
+# Maximum number of devices with always_on samples waiting for a name
+pending_device_max = int(os.getenv("SENSE_COLLECTOR_PENDING_DEVICE_MAX", 1000))
+
+# Comma-separated storage sinks: influxdb, sqlite, parquet. The first one is primary; the rest are fed from their own queues
+storage_sinks = [
+    sink.strip().lower()
+    for sink in os.getenv("SENSE_COLLECTOR_STORAGE_SINKS", "influxdb").split(",")
+    if sink.strip()
+]
+
+# Path of the SQLite archive (defaults to sense_archive.db in the export folder)
+sqlite_path = os.getenv("SENSE_COLLECTOR_SQLITE_PATH", "")
+
+# Folder of the Parquet realtime archive (defaults to parquet in the export folder)
+parquet_folder = os.getenv("SENSE_COLLECTOR_PARQUET_FOLDER", "")
+
+# Parquet archive partitioning: hour or day
+parquet_partition = os.getenv("SENSE_COLLECTOR_PARQUET_PARTITION", "hour").lower()
+
+# Parquet compression codec: zstd, snappy, gzip or none
+parquet_compression = os.getenv("SENSE_COLLECTOR_PARQUET_COMPRESSION", "zstd").lower()
+
+# Maximum number of pending calls queued for each secondary storage sink
+sink_queue_size = int(os.getenv("SENSE_COLLECTOR_SINK_QUEUE_SIZE", 10000))
+
+# Log output format: text or json (one JSON object per line)
+log_format = os.getenv("SENSE_COLLECTOR_LOG_FORMAT", "text").lower()
+
+# Minimum interval in seconds between full payload dumps for the same error
+log_payload_sample_interval = float(
+    os.getenv("SENSE_COLLECTOR_LOG_PAYLOAD_SAMPLE_INTERVAL", 60)
 )
 
+# JSON decoder for WebSocket frames: auto, msgspec, orjson or json
+json_decoder = os.getenv("SENSE_COLLECTOR_JSON_DECODER", "auto").lower()
+
+configure_logging(log_format)
+
+# Rate-limited payload dumps for error paths
+payload_sampler = PayloadSampler(interval=log_payload_sample_interval)
+
+# Shared, stateless frame decoder
+frame_decoder = FrameDecoder(json_decoder)
+
 # Create loggers
 logger = logging.getLogger("general")
 logger.setLevel(log_level_general)
@@ -117,27 +287,32 @@ async def authenticate_with_sense(username, password):
             return await response.json()
 
 
-class SenseCollector:
-    def __init__(self, monitor_id, token, influxdb_storage, user_id):
-        self.monitor_id = monitor_id
+class SenseAccount:
+    # Credentials, headers and HTTP session shared by every monitor collector
+    def __init__(self, token, user_id):
         self.token = token
         self.user_id = user_id
-        self.ws_url = (
-            f"wss://clientrt.sense.com/monitors/{self.monitor_id}/realtimefeed"
-        )
         self.headers = {
             "Authorization": f"bearer {self.token}",
             "Sense-Collector-Client-Version": "2.0.0",
             "X-Sense-Protocol": "3",
             "User-Agent": "okhttp/3.8.0",
         }
-        self.influxdb_storage = influxdb_storage
-        self.api_call_queue = asyncio.Queue()
-        self.device_cache = {}
-
-        self.semaphore = asyncio.Semaphore(device_max_concurrent_lookups)
         self.session = None
 
+        # Shared by every REST call so throttling applies account-wide
+        self.rate_limiter = AdaptiveRateLimiter(
+            initial_rate=1 / max(device_lookup_delay_seconds, 0.001),
+            min_rate=api_rate_min,
+            max_rate=api_rate_max,
+            max_retries=api_max_retries,
+        )
+
+    async def get_json(self, url, params=None):
+        return await self.rate_limiter.get_json(
+            self.session, url, headers=self.headers, params=params
+        )
+
     async def renew_token(self):
         url = SenseAPIEndpoints.AUTHENTICATE
         headers = {"Content-Type": "application/x-www-form-urlencoded"}
@@ -150,6 +325,7 @@ class SenseCollector:
                 if resp.status == 200:
                     data = await resp.json()
                     self.token = data["access_token"]
+                    # Collectors hold a reference to this dict, so they all pick it up
                     self.headers["Authorization"] = f"bearer {self.token}"
                     api_logger.info("Token renewed successfully.")
                 else:
@@ -180,16 +356,109 @@ class SenseCollector:
         if self.session:
             await self.session.close()
 
+
+class SenseCollector:
+    def __init__(
+        self,
+        monitor_id,
+        account,
+        storage,
+        device_cache=None,
+        capture_writer=None,
+        timeline=None,
+    ):
+        self.monitor_id = monitor_id
+        self.account = account
+        self.user_id = account.user_id
+        self.ws_url = (
+            f"wss://clientrt.sense.com/monitors/{self.monitor_id}/realtimefeed"
+        )
+        self.headers = account.headers
+        # Any StorageSink: InfluxDB, an archive, or a fan-out of several
+        self.storage = storage
+        # Pending device lookups, deduplicated by device_id
+        self.api_call_queue = KeyedWorkQueue()
+
+        # Device metadata cache keyed by (monitor_id, device_id), shared across monitors
+        if device_cache is None:
+            device_cache = DeviceCache(
+                ttl_seconds=device_cache_expiry_seconds,
+                stale_seconds=device_cache_stale_seconds,
+                max_entries=device_cache_max_entries,
+            )
+        self.device_cache = device_cache
+
+        # Receives raw frames and device responses when capture is enabled
+        self.capture_writer = capture_writer
+
+        # Timeline ingestion, shared by every monitor of the account
+        if timeline is None:
+            timeline = TimelineIngester(storage)
+        self.timeline = timeline
+        self.timeline.add_collector(self)
+
+        self.semaphore = asyncio.Semaphore(device_max_concurrent_lookups)
+        self.ws = None
+        # WebSocket -> task forwarding its messages to receive_data
+        self.socket_readers = {}
+        # Replacement socket while it overlaps the current one during a rotation
+        self.incoming = None
+        self.connection_state = ConnectionStateMachine(self.monitor_id)
+        # When the current connection delivered its first frame
+        self.streaming_since = None
+        # Gaps, duplicates and late frames in the realtime feed
+        self.frame_tracker = FrameTracker(self.monitor_id)
+
+        # Message type -> handler
+        self.handlers = {
+            "realtime_update": self.handle_realtime_update,
+            "new_timeline_event": self.handle_new_timeline_event,
+            "hello": self.handle_hello_event,
+            "data_change": self.handle_data_change_event,
+            "device_states": self.handle_device_states_event,
+            "monitor_info": self.handle_monitor_info_event,
+            "monitor_connection": self.handle_monitor_connection_event,
+            "device_reactivated": self.handle_device_reactivated_event,
+            "device_deactivated": self.handle_device_deactivated_event,
+        }
+
+        # always_on samples for devices without a cached name trigger a lookup
+        storage.register_device_lookup(
+            self.monitor_id, self.request_device_lookup
+        )
+
+        metrics.API_QUEUE_DEPTH.set_function(self.api_call_queue.qsize, self.monitor_id)
+        metrics.DEVICE_CACHE_HIT_RATIO.set_function(
+            lambda: self.device_cache.stats()["device_cache_hit_ratio"]
+        )
+
+        # Per-monitor health counters, persisted periodically by report_health
+        self.health = {
+            "frames_received": 0,
+            "reconnects": 0,
+            "rotations": 0,
+            "connected": False,
+            "last_frame_time": 0.0,
+        }
+
+    @property
+    def session(self):
+        return self.account.session
+
+    def request_device_lookup(self, device_id):
+        self.api_call_queue.put_nowait(
+            device_id, {"device_id": device_id}, PRIORITY_EVENT
+        )
+
     async def api_worker(self):
         while True:
-            queue_item = await self.api_call_queue.get()
-            device_id = queue_item.get("device_id")
+            device_id, queue_item = await self.api_call_queue.get()
 
             api_logger.debug(f"Starting lookup for device_id: {device_id}")
             try:
                 device_data = await self.lookup_device_data(device_id)
                 if device_data:
-                    await self.influxdb_storage.persist_device_data(device_data)
+                    await self.storage.persist_device_data(device_data)
             except Exception as e:
                 api_logger.error(f"Error processing device {device_id}: {e}")
             finally:
@@ -197,314 +466,398 @@ class SenseCollector:
                 api_logger.debug(f"Finished processing for device_id: {device_id}")
 
     async def create_connection(self):
+        # A single attempt; retries and backoff are driven by receive_data
         ws_url = SenseAPIEndpoints.REALTIME_FEED.format(monitor_id=self.monitor_id)
-        for attempt in range(max_retries):
-            try:
-                self.ws = await self.session.ws_connect(ws_url, headers=self.headers)
-                api_logger.info("Created WebSocket connection")
-                return
-            except (
-                aiohttp.ClientError,
-                asyncio.TimeoutError,
-            ) as e:
-                api_logger.warning(f"Retry {attempt + 1} for WebSocket connection: {e}")
-                if attempt < max_retries - 1:
-                    sleep_time = backoff_factor * (2**attempt)
-                    await asyncio.sleep(sleep_time)
-                else:
-                    raise  # Re-raise the last exception if all retries fail
+        self.ws = await self.session.ws_connect(ws_url, headers=self.headers)
+        self.health["connected"] = True
+        api_logger.info(f"Created WebSocket connection for {self.monitor_id}")
 
     async def close_connection(self):
         if self.ws:
-            await self.ws.close()
-            api_logger.info("Closed WebSocket connection")
+            await self.close_socket(self.ws)
+            self.health["connected"] = False
+            api_logger.info(f"Closed WebSocket connection for {self.monitor_id}")
+
+    async def close_socket(self, ws):
+        reader = self.socket_readers.pop(ws, None)
+        if reader is not None:
+            reader.cancel()
+        await ws.close()
+
+    def start_reader(self, ws, frames):
+        self.socket_readers[ws] = asyncio.create_task(self.read_socket(ws, frames))
+
+    async def read_socket(self, ws, frames):
+        # Forwards the messages of one socket to the shared queue until it closes
+        while True:
+            try:
+                msg = await ws.receive()
+            except Exception as e:
+                await frames.put((ws, e))
+                return
+            await frames.put((ws, msg))
+            if msg.type in (
+                WSMsgType.CLOSE,
+                WSMsgType.CLOSING,
+                WSMsgType.CLOSED,
+                WSMsgType.ERROR,
+            ):
+                return
+
+    async def start_rotation(self, frames):
+        # Make before break: the replacement streams alongside the current socket
+        ws_url = SenseAPIEndpoints.REALTIME_FEED.format(monitor_id=self.monitor_id)
+        try:
+            self.incoming = await self.session.ws_connect(ws_url, headers=self.headers)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            api_logger.warning(
+                f"Could not open replacement WebSocket, keeping the current one: {e}"
+            )
+            return False
+        self.start_reader(self.incoming, frames)
+        api_logger.info(f"Opened replacement WebSocket for {self.monitor_id}")
+        return True
+
+    async def abort_rotation(self, reason):
+        api_logger.warning(f"Abandoning WebSocket rotation: {reason}")
+        incoming, self.incoming = self.incoming, None
+        await self.close_socket(incoming)
+
+    async def complete_rotation(self):
+        retired, self.ws = self.ws, self.incoming
+        self.incoming = None
+        await self.close_socket(retired)
+        self.health["rotations"] += 1
+        metrics.WS_RECONNECTS.inc(self.monitor_id, "rotated")
+        api_logger.info(f"Rotated WebSocket connection for {self.monitor_id}")
+
+    async def ping_socket(self):
+        # Pings on its own timer, whether or not frames are arriving
+        while True:
+            await asyncio.sleep(heartbeat_interval)
+            ws = self.ws
+            if ws is None or ws.closed:
+                continue
+            try:
+                await ws.send_json({"type": "ping"})
+                api_logger.debug("Ping sent. Next ping in %s seconds", heartbeat_interval)
+            except (ClientError, ConnectionResetError) as e:
+                api_logger.warning(f"Failed to send ping: {e}")
 
     async def receive_data(self):
         api_logger.info("Starting data reception")
+        backoff = DecorrelatedJitterBackoff(reconnect_delay_initial, reconnect_delay_cap)
+        pinger = asyncio.create_task(self.ping_socket())
+
+        try:
+            while True:
+                self.connection_state.transition(CONNECTING)
+                disconnect_reason = "connect_failed"
+                # (socket, message or exception) from every open socket
+                frames = asyncio.Queue()
+                self.streaming_since = None
+                try:
+                    await self.create_connection()
+                    self.start_reader(self.ws, frames)
+                    disconnect_reason = await self.stream(frames)
+                except (ClientError, asyncio.TimeoutError, OSError) as e:
+                    api_logger.error(f"Failed to connect WebSocket: {e}")
+                finally:
+                    if self.incoming is not None:
+                        await self.close_socket(self.incoming)
+                        self.incoming = None
+                    await self.close_connection()
+                    self.health["reconnects"] += 1
+                    metrics.WS_RECONNECTS.inc(self.monitor_id, disconnect_reason)
+                    api_logger.info(f"Stopped data reception for {self.monitor_id}")
+
+                # Backoff keeps growing across attempts until a connection has
+                # streamed for a while, so a flapping feed is not hammered
+                if (
+                    self.streaming_since is not None
+                    and time.monotonic() - self.streaming_since >= backoff_reset_seconds
+                ):
+                    backoff.reset()
+                reconnect_delay = backoff.next()
+                self.connection_state.transition(
+                    BACKOFF,
+                    f"{disconnect_reason}, retrying in {reconnect_delay:.1f} seconds",
+                )
+                await asyncio.sleep(reconnect_delay)
+        finally:
+            pinger.cancel()
+
+    async def stream(self, frames):
+        # Processes frames until the connection is lost; returns the reason
+        last_frame_time = time.monotonic()
+        reconnect_time = last_frame_time + reconnect_interval
+        rotation_deadline = None
+        next_reconnect_time = datetime.now() + timedelta(seconds=reconnect_interval)
+        api_logger.info(
+            f"Next scheduled rotation at {next_reconnect_time.strftime('%Y-%m-%d %H:%M:%S')}"
+        )
 
         while True:
+            # Idle timer: DEGRADED after heartbeat_interval without frames,
+            # reconnect after heartbeat_timeout
+            degraded = self.connection_state.state == DEGRADED
+            idle_limit = heartbeat_timeout if degraded else heartbeat_interval
             try:
-                await self.create_connection()
-                last_heartbeat_time = time.time()
-                reconnect_time = last_heartbeat_time + reconnect_interval
-                next_reconnect_time = datetime.now() + timedelta(
-                    seconds=reconnect_interval
+                ws, msg = await asyncio.wait_for(
+                    frames.get(),
+                    timeout=max(last_frame_time + idle_limit - time.monotonic(), 0),
                 )
-                api_logger.info(
-                    f"Next forced reconnect attempt at {next_reconnect_time.strftime('%Y-%m-%d %H:%M:%S')}"
+            except asyncio.TimeoutError:
+                if degraded:
+                    api_logger.error(
+                        "No data received within heartbeat timeout. Reconnecting..."
+                    )
+                    return "heartbeat_timeout"
+                self.connection_state.transition(
+                    DEGRADED, f"no data for {heartbeat_interval} seconds"
                 )
+                continue
 
-                while True:
-                    try:
-                        msg = await asyncio.wait_for(
-                            self.ws.receive(), timeout=heartbeat_interval
-                        )
-                        if msg.type == WSMsgType.TEXT:
-                            data = json.loads(msg.data)
-                            if output_received_data:
-                                export_file_path = os.path.join(
-                                    export_folder, "received_data.json"
-                                )
-                                with open(export_file_path, "a") as f:
-                                    f.write(json.dumps(data) + "\n")
-                            await self.process_and_send_data(data)
-                            last_heartbeat_time = (
-                                time.time()
-                            )  # Reset the heartbeat timer on valid data
-                            api_logger.debug(
-                                f"Data received and processed. Resetting heartbeat timer. Last heartbeat time: {last_heartbeat_time}"
-                            )
-                        elif msg.type == WSMsgType.CLOSED:
-                            api_logger.warning(
-                                "WebSocket connection closed. Reconnecting..."
-                            )
-                            break
-                        elif msg.type == WSMsgType.ERROR:
-                            api_logger.error(
-                                f"WebSocket error: {msg.data}. Reconnecting..."
-                            )
-                            break
-
-                        # Check if it's time to send a heartbeat
-                        current_time = time.time()
-                        if current_time - last_heartbeat_time > heartbeat_interval:
-                            api_logger.info("Sending ping")
-                            await self.ws.send_json({"type": "ping"})
-                            last_heartbeat_time = current_time
-                            api_logger.info(
-                                f"Ping sent. Next ping in {heartbeat_interval} seconds"
-                            )
-
-                        # Check if it's time to reconnect based on the interval
-                        if current_time > reconnect_time:
-                            api_logger.info(
-                                f"Reconnecting after {reconnect_interval} seconds interval"
-                            )
-                            break
-
-                    except asyncio.TimeoutError:
-                        # No message received within the heartbeat interval, check the heartbeat timeout
-                        current_time = time.time()
-                        if current_time - last_heartbeat_time > heartbeat_timeout:
-                            api_logger.error(
-                                "No data received within heartbeat timeout. Reconnecting..."
-                            )
-                            break
-                    except ClientError as e:
-                        api_logger.error(
-                            f"Client error in WebSocket connection: {e}. Reconnecting..."
-                        )
-                        break
-                    except ClientConnectionError as e:
-                        api_logger.error(
-                            f"Client connection error in WebSocket connection: {e}. Reconnecting..."
-                        )
-                        break
-                    except Exception as e:
-                        api_logger.error(
-                            f"Unexpected error in WebSocket connection: {e}. Reconnecting..."
+            try:
+                if ws is not self.ws and ws is not self.incoming:
+                    continue  # Left over from a socket already closed
+                if isinstance(msg, Exception):
+                    if ws is self.incoming:
+                        await self.abort_rotation(str(msg))
+                        continue
+                    if self.incoming is not None:
+                        # The current socket failed mid-rotation; switch now
+                        await self.complete_rotation()
+                        continue
+                    raise msg
+
+                if msg.type == WSMsgType.TEXT:
+                    if self.capture_writer is not None:
+                        self.capture_writer.write("received_data.json", msg.data)
+                    data_type = await self.process_raw_frame(msg.data)
+                    self.health["frames_received"] += 1
+                    self.health["last_frame_time"] = time.time()
+                    last_frame_time = time.monotonic()
+                    if self.connection_state.state != STREAMING:
+                        self.connection_state.transition(STREAMING)
+                    if self.streaming_since is None:
+                        self.streaming_since = last_frame_time
+                    # The replacement is streaming, so the old socket can go
+                    if ws is self.incoming and data_type == "realtime_update":
+                        await self.complete_rotation()
+                elif msg.type in (
+                    WSMsgType.CLOSE,
+                    WSMsgType.CLOSING,
+                    WSMsgType.CLOSED,
+                    WSMsgType.ERROR,
+                ):
+                    if ws is self.incoming:
+                        await self.abort_rotation(
+                            f"replacement closed ({msg.type.name})"
                         )
-                        break
-            finally:
-                await self.close_connection()
-                api_logger.info("Stopped data reception")
+                    elif self.incoming is not None:
+                        # The current socket dropped mid-rotation; switch now
+                        await self.complete_rotation()
+                    elif msg.type == WSMsgType.ERROR:
+                        api_logger.error(f"WebSocket error: {msg.data}. Reconnecting...")
+                        return "websocket_error"
+                    else:
+                        api_logger.warning("WebSocket connection closed. Reconnecting...")
+                        return "closed"
+
+                # Rotate the connection once the interval has passed
+                current_time = time.monotonic()
+                if self.incoming is None and current_time > reconnect_time:
+                    api_logger.info(
+                        f"Rotating WebSocket after {reconnect_interval} seconds interval"
+                    )
+                    if await self.start_rotation(frames):
+                        reconnect_time = current_time + reconnect_interval
+                        rotation_deadline = current_time + rotation_timeout
+                    else:
+                        reconnect_time = current_time + rotation_timeout
+                elif self.incoming is not None and current_time > rotation_deadline:
+                    await self.abort_rotation(
+                        f"no realtime data within {rotation_timeout} seconds"
+                    )
 
-            # Reconnect immediately if forced by our timeline
-            if time.time() > reconnect_time:
-                api_logger.info("Immediate reconnect due to forced interval.")
-                continue
+            except ClientConnectionError as e:
+                api_logger.error(
+                    f"Client connection error in WebSocket connection: {e}. Reconnecting..."
+                )
+                return "connection_error"
+            except ClientError as e:
+                api_logger.error(
+                    f"Client error in WebSocket connection: {e}. Reconnecting..."
+                )
+                return "client_error"
+            except Exception as e:
+                api_logger.error(
+                    f"Unexpected error in WebSocket connection: {e}. Reconnecting..."
+                )
+                return "unexpected_error"
 
-            # Reconnect after a brief delay with exponential backoff for other cases
-            reconnect_delay = reconnect_delay_initial
-            next_reconnect_time = datetime.now() + timedelta(seconds=reconnect_delay)
-            api_logger.info(f"Attempting to reconnect in {reconnect_delay} seconds...")
-            api_logger.info(
-                f"Next reconnect attempt at {next_reconnect_time.strftime('%Y-%m-%d %H:%M:%S')}"
-            )
-            await asyncio.sleep(reconnect_delay)
-            reconnect_delay = min(reconnect_delay * 2, reconnect_delay_cap)
-            api_logger.debug(
-                f"Reconnect delay set to: {reconnect_delay} seconds. Reconnect delay capped at: {reconnect_delay_cap} seconds"
+    async def process_raw_frame(self, raw):
+        # Decode a WebSocket text frame and dispatch it; returns the message type
+        try:
+            data_type, payload = frame_decoder.decode(raw)
+        except FrameDecodeError as e:
+            payload_sampler.log(
+                api_logger,
+                logging.ERROR,
+                "decode",
+                "Error decoding frame: %s",
+                raw,
+                e,
             )
+            return None
+        await self.dispatch(data_type, payload, raw)
+        return data_type
 
     async def process_and_send_data(self, data):
-        api_logger.debug("Starting to process and send data")
+        await self.dispatch(data.get("type"), data.get("payload"), data)
+
+    async def dispatch(self, data_type, payload, frame):
+        start_time = time.perf_counter()
 
         try:
-            data_type = data.get("type")
-            api_logger.debug(f"Data type: {data_type}")
-
-            if data_type == "realtime_update":
-                api_logger.debug("Processing realtime update")
-                await self.handle_realtime_update(data["payload"])
-            elif data_type == "new_timeline_event":
-                api_logger.debug("Processing new timeline event")
-                await self.handle_new_timeline_event(data["payload"])
-            elif data_type == "hello":
-                api_logger.debug("Processing hello event")
-                await self.handle_hello_event(data["payload"])
-            elif data_type == "data_change":
-                api_logger.debug("Processing data change event")
-                await self.handle_data_change_event(data["payload"])
-            elif data_type == "device_states":
-                api_logger.debug("Processing device states event")
-                await self.handle_device_states_event(data["payload"])
-            elif data_type == "monitor_info":
-                api_logger.debug("Processing monitor monitor_info event")
-                await self.handle_monitor_info_event(data["payload"])
-            elif data_type == "monitor_connection":
-                api_logger.debug("Processing monitor connection event")
-                await self.handle_monitor_connection_event(data["payload"])
-            elif data_type == "device_reactivated":
-                api_logger.debug("Processing device reactivated event")
-                await self.handle_device_reactivated_event(data["payload"])
-            elif data_type == "device_deactivated":
-                api_logger.debug("Processing device deactivated event")
-                await self.handle_device_deactivated_event(data["payload"])
-            else:
-                api_logger.warning(
-                    f"Unknown data type received: {data_type} - Payload: {json.dumps(data, indent=2)}"
+            api_logger.debug("Processing %s event", data_type)
+            metrics.FRAMES_RECEIVED.inc(self.monitor_id, data_type)
+
+            handler = self.handlers.get(data_type)
+            if handler is None:
+                payload_sampler.log(
+                    api_logger,
+                    logging.WARNING,
+                    f"unknown:{data_type}",
+                    "Unknown data type received: %s",
+                    frame,
+                    data_type,
                 )
+                return
+
+            handler_start_time = time.perf_counter()
+            # Everything one frame produces is queued as a single write
+            async with self.storage.unit_of_work():
+                await handler(payload)
+            metrics.HANDLER_SECONDS.observe(
+                time.perf_counter() - handler_start_time, handler.__name__
+            )
 
         except Exception as e:
-            api_logger.error(
-                f"Error processing data: {e}. Payload: {json.dumps(data, indent=2)}"
+            payload_sampler.log(
+                api_logger,
+                logging.ERROR,
+                f"process:{type(e).__name__}",
+                "Error processing data: %s",
+                frame,
+                e,
             )
         finally:
-            api_logger.debug("Finished processing and sending data")
+            metrics.HANDLER_SECONDS.observe(
+                time.perf_counter() - start_time, "process_and_send_data"
+            )
 
     async def handle_monitor_info_event(self, payload):
-        api_logger.debug(
-            f"Data type received: monitor_info - Payload: {json.dumps(payload, indent=2)}"
-        )
+        if api_logger.isEnabledFor(logging.DEBUG):
+            api_logger.debug(
+                "Data type received: monitor_info - Payload: %s",
+                json.dumps(payload, indent=2),
+            )
 
     async def handle_monitor_connection_event(self, payload):
-        api_logger.debug(
-            f"Data type received: monitor_connection - Payload: {json.dumps(payload, indent=2)}"
-        )
+        if api_logger.isEnabledFor(logging.DEBUG):
+            api_logger.debug(
+                "Data type received: monitor_connection - Payload: %s",
+                json.dumps(payload, indent=2),
+            )
 
     async def handle_device_reactivated_event(self, payload):
-        api_logger.debug(
-            f"Data type received: device_reactivated - Payload: {json.dumps(payload, indent=2)}"
-        )
+        if api_logger.isEnabledFor(logging.DEBUG):
+            api_logger.debug(
+                "Data type received: device_reactivated - Payload: %s",
+                json.dumps(payload, indent=2),
+            )
 
     async def handle_device_deactivated_event(self, payload):
-        api_logger.debug(
-            f"Data type received: device_deactivated - Payload: {json.dumps(payload, indent=2)}"
-        )
+        if api_logger.isEnabledFor(logging.DEBUG):
+            api_logger.debug(
+                "Data type received: device_deactivated - Payload: %s",
+                json.dumps(payload, indent=2),
+            )
 
     async def handle_realtime_update(self, payload):
-        api_logger.debug("Starting to handle realtime update")
-
-        required_keys = ["hz", "c", "w", "epoch"]
-        missing_keys = [key for key in required_keys if key not in payload]
-
-        if missing_keys:
-            api_logger.error(f"Missing required keys in payload: {missing_keys}")
-            api_logger.debug(f"Incomplete payload: {json.dumps(payload, indent=2)}")
-            return  # Do not process further if any required key is missing
-
-        try:
-            hertz = float(payload["hz"])
-            total_current = float(payload["c"])
-            total_watts = float(payload["w"])
-            epoch = int(payload["epoch"])  # Use epoch time in seconds directly
-
-            voltage = payload.get("voltage", [])
-            devices = payload.get("devices", [])
-            channels = payload.get("channels", [])
-
-            await self.influxdb_storage.persist_realtime_data(
-                self.monitor_id,
-                hertz,
-                total_current,
-                total_watts,
-                epoch,
-                voltage,
-                devices,
-                channels,
-            )
+        # Decoded frames arrive typed; dicts come from process_and_send_data
+        if isinstance(payload, dict):
+            try:
+                payload = realtime_from_dict(payload)
+            except FrameDecodeError as e:
+                payload_sampler.log(
+                    api_logger,
+                    logging.ERROR,
+                    "realtime_invalid",
+                    "%s",
+                    payload,
+                    e,
+                )
+                return  # Do not process further if any required key is missing
 
+        # Frames seen twice, e.g. while two sockets overlap during a rotation
+        # or resent after a reconnect, are dropped; seconds without any frame
+        # are recorded as a gap
+        outcome, gap = self.frame_tracker.observe(
+            payload.epoch, (payload.epoch, payload.w, payload.c, payload.hz)
+        )
+        if outcome == DUPLICATE:
+            return
+        if gap is not None:
             api_logger.debug(
-                "Data processed and sent to InfluxDB in 'handle_realtime_update' method"
+                "Realtime gap of %d seconds for %s before epoch %s",
+                gap[2],
+                self.monitor_id,
+                payload.epoch,
             )
+            await self.storage.persist_frame_gap(self.monitor_id, *gap)
 
-        except KeyError as e:
-            api_logger.error(
-                f"KeyError in handle_realtime_update: {e}. Payload: {json.dumps(payload, indent=2)}"
+        try:
+            await self.storage.persist_realtime_data(
+                self.monitor_id,
+                payload.hz,
+                payload.c,
+                payload.w,
+                int(payload.epoch),  # Use epoch time in seconds directly
+                payload.voltage,
+                payload.devices,
+                payload.channels,
             )
         except Exception as e:
-            api_logger.error(
-                f"Error in handle_realtime_update: {e}. Payload: {json.dumps(payload, indent=2)}"
+            payload_sampler.log(
+                api_logger,
+                logging.ERROR,
+                f"realtime:{type(e).__name__}",
+                "Error in handle_realtime_update: %s",
+                payload,
+                e,
             )
-        finally:
-            api_logger.debug("Finished handling realtime update")
 
     async def handle_new_timeline_event(self, payload):
         items_added = payload.get("items_added", [])
+        # Pushed items do not move the poll cursor, see TimelineIngester.
+        # Their device lookups run in the background so frames keep flowing.
+        self.timeline.ingest_in_background(items_added)
         for item in items_added:
             device_id = item.get("device_id")
             if device_id:
-                await self.process_timeline_item(item)
-                queue_item = {
-                    "device_id": device_id,
-                }
-                await self.api_call_queue.put(queue_item)
-            else:
-                api_logger.warning(f"Missing device_id in item: {item}")
-
-    async def process_timeline_item(self, item):
-        api_logger.debug("Starting to process timeline item")
-        api_logger.debug(f"Timeline item: {item}")
-
-        try:
-            time = item.get("time")
-            event_type = item.get("type")
-            icon = item.get("icon")
-            body = item.get("body")
-            device_id = item.get("device_id")
-            device_state = item.get("device_state")
-            user_device_type = item.get("user_device_type")
-            device_transition_from_state = item.get("device_transition_from_state")
-
-            api_logger.debug(f"Fetching device data for device_id: {device_id}")
-            device_data = await self.lookup_device_data(device_id)
-            api_logger.debug(f"Device data: {device_data}")
-
-            if device_data and "device" in device_data:
-                device_name = device_data["device"]["name"]
-                api_logger.debug(f"Device name: {device_name}")
-            else:
-                device_name = "Unknown"
-                api_logger.warning(
-                    f"Device data for device_id {device_id} is missing 'device' key or is None"
+                self.api_call_queue.put_nowait(
+                    device_id, {"device_id": device_id}, PRIORITY_EVENT
                 )
 
-            await self.influxdb_storage.persist_timeline_data(
-                device_id,
-                device_name,
-                time,
-                event_type,
-                icon,
-                body,
-                device_state,
-                user_device_type,
-                device_transition_from_state,
-            )
-
-            api_logger.debug("Timeline item processed and sent to InfluxDB")
-
-        except KeyError as e:
-            api_logger.error(f"KeyError in process_timeline_item: {e}")
-        except Exception as e:
-            api_logger.error(f"Error in process_timeline_item: {e}")
-
     async def handle_hello_event(self, payload):
         online_status = payload.get("online", False)
         influxdb_timestamp = int(
             datetime.now(timezone.utc).timestamp()
         )  # Convert to epoch seconds
-        await self.influxdb_storage.persist_hello_event(
+        await self.storage.persist_hello_event(
             self.monitor_id, online_status, influxdb_timestamp
         )
 
@@ -532,7 +885,7 @@ class SenseCollector:
                 self.convert_to_epoch(json_timestamp) if json_timestamp else None
             )
 
-            await self.influxdb_storage.persist_data_change_event(
+            await self.storage.persist_data_change_event(
                 self.monitor_id,
                 device_id,
                 user_version,
@@ -555,39 +908,26 @@ class SenseCollector:
                 datetime.now(timezone.utc).timestamp()
             )  # Convert to epoch seconds
 
-            queue_item = {
-                "device_id": device_id,
-            }
-            await self.api_call_queue.put(queue_item)
+            self.api_call_queue.put_nowait(
+                device_id, {"device_id": device_id}, PRIORITY_EVENT
+            )
 
-            await self.influxdb_storage.persist_device_state(
+            await self.storage.persist_device_state(
                 self.monitor_id, device_id, mode, device_state, influxdb_timestamp
             )
 
     async def lookup_device_data(self, device_id):
+        # Cache hits and coalesced lookups never touch the semaphore or the delay
+        return await self.device_cache.get(
+            (self.monitor_id, device_id),
+            lambda: self.fetch_device_data(device_id),
+        )
+
+    async def fetch_device_data(self, device_id):
         api_logger.debug(f"Attempting to acquire semaphore for device_id: {device_id}")
         async with self.semaphore:
             start_time = time.time()
             api_logger.debug(f"Semaphore acquired for device_id: {device_id}")
-            current_time = time.time()
-
-            # Check if the device data is in cache and not expired
-            if device_id in self.device_cache:
-                cached_data, timestamp = self.device_cache[device_id]
-                time_since_cached = current_time - timestamp
-                time_until_expiry = device_cache_expiry_seconds - time_since_cached
-                if time_until_expiry > 0:
-                    api_logger.debug(
-                        f"Cache hit for device_id: {device_id}, time until expiry: {time_until_expiry:.2f} seconds"
-                    )
-                    api_logger.debug(
-                        f"Finished lookup for device_id: {device_id} (cached) in {time.time() - start_time:.2f} seconds"
-                    )
-                    return cached_data
-                else:
-                    api_logger.debug(
-                        f"Cache expired for device_id: {device_id}, fetching new data"
-                    )
 
             url = SenseAPIEndpoints.DEVICE_DATA.format(
                 monitor_id=self.monitor_id, device_id=device_id
@@ -596,42 +936,20 @@ class SenseCollector:
                 f"Sending request to fetch device data for device_id: {device_id}"
             )
             try:
-                async with self.session.get(url, headers=self.headers) as response:
-                    if response.status == 429:  # Handle rate limiting
-                        retry_after = int(response.headers.get("Retry-After", 1))
-                        api_logger.warning(
-                            f"Rate limited. Retrying after {retry_after} seconds"
-                        )
-                        await asyncio.sleep(retry_after)
-                        return await self.lookup_device_data(
-                            device_id
-                        )  # Retry after delay
-
-                    response.raise_for_status()
-                    device_data = await response.json()
-
-                    # Log the response payload to a file if enabled
-                    if output_received_data:
-                        file_name = f"device_{device_id}.json"
-                        file_path = os.path.join(export_folder, file_name)
-                        with open(file_path, "a") as file:
-                            file.write(json.dumps(device_data, indent=2) + "\n")
-                        api_logger.debug(f"Response payload appended to {file_path}")
-
-                    # Cache the fetched data
-                    self.device_cache[device_id] = (device_data, current_time)
-                    api_logger.debug(
-                        f"Fetched and cached data for device_id: {device_id}"
+                device_data = await self.account.get_json(url)
+
+                # Log the response payload to a file if enabled
+                if self.capture_writer is not None:
+                    self.capture_writer.write(
+                        f"device_{device_id}.json", json.dumps(device_data)
                     )
-                    return device_data
+
+                api_logger.debug(f"Fetched data for device_id: {device_id}")
+                return device_data
             except aiohttp.ClientError as e:
                 api_logger.error(f"Error fetching device data for {device_id}: {e}")
                 return None
             finally:
-                api_logger.debug(
-                    f"Completed request for device_id: {device_id}, waiting for {device_lookup_delay_seconds} seconds before next request"
-                )
-                await asyncio.sleep(device_lookup_delay_seconds)
                 api_logger.debug(
                     f"Finished lookup for device_id: {device_id} in {time.time() - start_time:.2f} seconds"
                 )
@@ -641,15 +959,11 @@ class SenseCollector:
         while True:
             start_time = time.time()
             try:
-                async with self.session.get(url, headers=self.headers) as response:
-                    response.raise_for_status()
-                    monitor_status = await response.json()
-                    await self.influxdb_storage.persist_monitor_status(
-                        self.monitor_id, monitor_status
-                    )
-                    api_logger.debug(
-                        "Successfully fetched and persisted monitor status"
-                    )
+                monitor_status = await self.account.get_json(url)
+                await self.storage.persist_monitor_status(
+                    self.monitor_id, monitor_status
+                )
+                api_logger.debug("Successfully fetched and persisted monitor status")
             except aiohttp.ClientError as e:
                 api_logger.error(f"Failed to fetch monitor status: {e}")
 
@@ -657,72 +971,39 @@ class SenseCollector:
             sleep_time = max(60 - elapsed_time, 0)
             await asyncio.sleep(sleep_time)
 
-    async def poll_timeline(self):
-        url = SenseAPIEndpoints.TIMELINE.format(user_id=self.user_id)
-        while True:
-            start_time = time.time()
-            human_start_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            try:
-                async with self.session.get(url, headers=self.headers) as response:
-                    response.raise_for_status()
-                    timeline_data = await response.json()
-                    await self.process_timeline_data(timeline_data)
-                    api_logger.debug(
-                        f"Successfully fetched and processed timeline data at {human_start_time}"
-                    )
-                    logger.debug(
-                        f"Timeline response: {json.dumps(timeline_data, indent=2)}"
-                    )
-            except aiohttp.ClientError as e:
-                api_logger.error(
-                    f"Failed to fetch timeline data at {human_start_time}: {e}"
-                )
-
-            elapsed_time = time.time() - start_time
-            sleep_time = max(60 - elapsed_time, 0)
-            human_sleep_time = datetime.now() + timedelta(seconds=sleep_time)
-            human_sleep_time = human_sleep_time.strftime("%Y-%m-%d %H:%M:%S")
-            api_logger.debug(
-                f"Timeline polling completed at {human_start_time}. Next run at {human_sleep_time} after sleeping for {sleep_time:.2f} seconds"
-            )
-            await asyncio.sleep(sleep_time)
-
-    async def process_timeline_data(self, data):
-        for item in data.get("items", []):
-            await self.process_timeline_item(item)
-
     async def fetch_devices(self):
         url = SenseAPIEndpoints.BASE_URL + f"/app/monitors/{self.monitor_id}/devices"
         while True:
             start_time = time.time()
             try:
-                async with self.session.get(url, headers=self.headers) as response:
-                    api_logger.debug(f"HTTP GET {url} status: {response.status}")
-                    response.raise_for_status()
-                    devices_response = await response.json()
+                devices_response = await self.account.get_json(url)
 
-                    # Output the JSON response for debugging
+                # Output the JSON response for debugging
+                if api_logger.isEnabledFor(logging.DEBUG):
                     api_logger.debug(
-                        f"Fetched devices response: {json.dumps(devices_response, indent=4)}"
+                        "Fetched devices response: %s",
+                        json.dumps(devices_response, indent=4),
                     )
 
-                    if isinstance(devices_response, list):
-                        for device in devices_response:
-                            device_id = device.get("id")
-                            if device_id:
-                                api_logger.debug(
-                                    f"Queueing device for processing: {device_id}"
-                                )
-                                await self.api_call_queue.put({"device_id": device_id})
-                            else:
-                                api_logger.warning(
-                                    f"Device without ID found: {json.dumps(device, indent=4)}"
-                                )
-                        api_logger.debug("Successfully fetched and queued devices")
-                    else:
-                        api_logger.warning(
-                            f"Unexpected response format: {devices_response}"
-                        )
+                if isinstance(devices_response, list):
+                    for device in devices_response:
+                        device_id = device.get("id")
+                        if device_id:
+                            api_logger.debug(
+                                f"Queueing device for processing: {device_id}"
+                            )
+                            self.api_call_queue.put_nowait(
+                                device_id, {"device_id": device_id}, PRIORITY_SWEEP
+                            )
+                        else:
+                            api_logger.warning(
+                                f"Device without ID found: {json.dumps(device, indent=4)}"
+                            )
+                    api_logger.debug("Successfully fetched and queued devices")
+                else:
+                    api_logger.warning(
+                        f"Unexpected response format: {devices_response}"
+                    )
 
             except aiohttp.ClientResponseError as e:
                 api_logger.error(f"Client response error: {e.status} {e.message}")
@@ -745,6 +1026,23 @@ class SenseCollector:
             )
             await asyncio.sleep(max(3600 - elapsed_time, 0))
 
+    async def report_health(self):
+        while True:
+            await asyncio.sleep(60)
+            health = dict(self.health)
+            health.update(self.device_cache.stats())
+            health.update(self.api_call_queue.stats())
+            health.update(self.account.rate_limiter.stats())
+            health.update(self.timeline.stats())
+            if self.capture_writer is not None:
+                health.update(self.capture_writer.stats())
+            health.update(self.storage.stats())
+            health.update(self.connection_state.stats())
+            health.update(self.frame_tracker.stats())
+            await self.storage.persist_collector_health(
+                self.monitor_id, health
+            )
+
     def convert_to_epoch(self, timestamp_str):
         timestamp_format = "%Y-%m-%dT%H:%M:%S.%fZ"
         try:
@@ -761,6 +1059,59 @@ def obfuscate_sensitive_data(data, visible_chars=4):
     return data[:visible_chars] + "*" * (len(data) - visible_chars)
 
 
+def influxdb_params_from_env():
+    return {
+        "url": os.environ.get("SENSE_COLLECTOR_INFLUXDB_URL"),
+        "token": os.environ.get("SENSE_COLLECTOR_INFLUXDB_TOKEN"),
+        "org": os.environ.get("SENSE_COLLECTOR_INFLUXDB_ORG"),
+        "bucket": os.environ.get("SENSE_COLLECTOR_INFLUXDB_BUCKET"),
+        "write_queue_size": write_queue_size,
+        "write_batch_size": write_batch_size,
+        "write_flush_interval": write_flush_interval,
+        "write_overflow_policy": write_overflow_policy,
+        "spool_folder": os.path.join(export_folder, "spool"),
+        "spool_max_bytes": spool_max_mb * 1024 * 1024,
+        "spool_segment_bytes": spool_segment_mb * 1024 * 1024,
+        "spool_fsync_interval": spool_fsync_interval,
+        "spool_retry_interval": spool_retry_interval,
+        "rollup_windows": rollup_windows,
+        "rollup_raw": rollup_raw,
+        "rollup_bucket": rollup_bucket,
+        "change_only": change_only,
+        "change_deadband": change_deadband,
+        "change_keepalive": change_keepalive,
+        "derived_fields": derived_fields,
+        "pending_device_ttl": pending_device_ttl,
+        "pending_device_max": pending_device_max,
+    }
+
+
+def create_storage(influxdb_params):
+    sinks = []
+    for sink in storage_sinks:
+        if sink == "influxdb":
+            sinks.append(InfluxDBStorage(influxdb_params))
+        elif sink == "sqlite":
+            sinks.append(
+                SQLiteSink(sqlite_path or os.path.join(export_folder, "sense_archive.db"))
+            )
+        elif sink == "parquet":
+            sinks.append(
+                ParquetSink(
+                    parquet_folder or os.path.join(export_folder, "parquet"),
+                    partition=parquet_partition,
+                    compression=parquet_compression,
+                )
+            )
+        else:
+            raise ValueError(f"Unknown storage sink {sink}")
+    if not sinks:
+        raise ValueError("No storage sinks configured")
+    if len(sinks) == 1:
+        return sinks[0]
+    return FanoutSink(sinks[0], sinks[1:], max_queue_size=sink_queue_size)
+
+
 async def main():
     logger.info("Starting main function.")
     current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
@@ -780,14 +1131,55 @@ async def main():
         "SENSE_COLLECTOR_WS_HEARTBEAT_TIMEOUT": "30",
         "SENSE_COLLECTOR_WS_RECONNECT_DELAY_INITIAL": "5",
         "SENSE_COLLECTOR_WS_RECONNECT_DELAY_CAP": "60",
-        "SENSE_COLLECTOR_WS_MAX_RETRIES": "3",
-        "SENSE_COLLECTOR_WS_BACKOFF_FACTOR": "1",
+        "SENSE_COLLECTOR_WS_BACKOFF_RESET_SECONDS": "60",
         "SENSE_COLLECTOR_WS_RECONNECT_INTERVAL": "840",
+        "SENSE_COLLECTOR_WS_ROTATION_TIMEOUT": "30",
         "SENSE_COLLECTOR_OUTPUT_RECEIVED_DATA": "false",
         "SENSE_COLLECTOR_CACHE_EXPIRY_SECONDS": "120",
+        "SENSE_COLLECTOR_DEVICE_CACHE_STALE_SECONDS": "600",
+        "SENSE_COLLECTOR_DEVICE_CACHE_MAX_ENTRIES": "1024",
         "SENSE_COLLECTOR_MAX_CONCURRENT_LOOKUPS": "4",
         "SENSE_COLLECTOR_LOOKUP_DELAY_SECONDS": "0.5",
+        "SENSE_COLLECTOR_DEVICE_LOOKUP_WORKERS": str(device_max_concurrent_lookups),
+        "SENSE_COLLECTOR_API_RATE_MAX": "10",
+        "SENSE_COLLECTOR_API_RATE_MIN": "0.2",
+        "SENSE_COLLECTOR_API_MAX_RETRIES": "5",
+        "SENSE_COLLECTOR_METRICS_PORT": "0",
+        "SENSE_COLLECTOR_LOG_FORMAT": "text",
+        "SENSE_COLLECTOR_LOG_PAYLOAD_SAMPLE_INTERVAL": "60",
+        "SENSE_COLLECTOR_JSON_DECODER": "auto",
+        "SENSE_COLLECTOR_CAPTURE_MAX_MB": "100",
+        "SENSE_COLLECTOR_CAPTURE_ROTATE_INTERVAL": "86400",
+        "SENSE_COLLECTOR_CAPTURE_MAX_FILES": "10",
+        "SENSE_COLLECTOR_CAPTURE_COMPRESSION": "none",
+        "SENSE_COLLECTOR_CAPTURE_FLUSH_INTERVAL": "1.0",
+        "SENSE_COLLECTOR_ROLLUP_WINDOWS": "",
+        "SENSE_COLLECTOR_ROLLUP_RAW": "true",
+        "SENSE_COLLECTOR_ROLLUP_BUCKET": "",
+        "SENSE_COLLECTOR_CHANGE_ONLY": "false",
+        "SENSE_COLLECTOR_CHANGE_DEADBAND": "0",
+        "SENSE_COLLECTOR_CHANGE_KEEPALIVE": "900",
+        "SENSE_COLLECTOR_DERIVED_FIELDS": "false",
+        "SENSE_COLLECTOR_TIMELINE_ENABLED": "false",
+        "SENSE_COLLECTOR_TIMELINE_INTERVAL": "60",
+        "SENSE_COLLECTOR_TIMELINE_CONCURRENCY": "4",
+        "SENSE_COLLECTOR_PENDING_DEVICE_TTL": "3600",
+        "SENSE_COLLECTOR_PENDING_DEVICE_MAX": "1000",
+        "SENSE_COLLECTOR_STORAGE_SINKS": "influxdb",
+        "SENSE_COLLECTOR_SQLITE_PATH": "",
+        "SENSE_COLLECTOR_PARQUET_FOLDER": "",
+        "SENSE_COLLECTOR_PARQUET_PARTITION": "hour",
+        "SENSE_COLLECTOR_PARQUET_COMPRESSION": "zstd",
+        "SENSE_COLLECTOR_SINK_QUEUE_SIZE": "10000",
         "SENSE_COLLECTOR_API_TOKEN_RENEW": "43200",
+        "SENSE_COLLECTOR_WRITE_QUEUE_SIZE": "1000",
+        "SENSE_COLLECTOR_WRITE_BATCH_SIZE": "5000",
+        "SENSE_COLLECTOR_WRITE_FLUSH_INTERVAL": "1.0",
+        "SENSE_COLLECTOR_WRITE_OVERFLOW_POLICY": "block",
+        "SENSE_COLLECTOR_SPOOL_MAX_MB": "512",
+        "SENSE_COLLECTOR_SPOOL_SEGMENT_MB": "8",
+        "SENSE_COLLECTOR_SPOOL_FSYNC_INTERVAL": "1.0",
+        "SENSE_COLLECTOR_SPOOL_RETRY_INTERVAL": "10",
     }
 
     def obscure_value(value):
@@ -811,7 +1203,11 @@ async def main():
         else:
             value_to_print = bold(value) if not is_default else value
         logger.info(f"{var}: {value_to_print} {default_indicator}")
-        if value is None:
+        # InfluxDB settings are only required when InfluxDB is a sink
+        if value is None and (
+            "influxdb" in storage_sinks
+            or not var.startswith("SENSE_COLLECTOR_INFLUXDB_")
+        ):
             missing_env_vars.append(var)
 
     if missing_env_vars:
@@ -820,6 +1216,22 @@ async def main():
         )
         sys.exit(1)
 
+    # Optional packages are checked before connecting, not when first used
+    configuration_errors = []
+    if "parquet" in storage_sinks and not pyarrow_available():
+        configuration_errors.append(
+            "SENSE_COLLECTOR_STORAGE_SINKS includes parquet, which needs pyarrow "
+            "from requirements-parquet.txt (build the image with INSTALL_PARQUET=true)"
+        )
+    if output_received_data and capture_compression == "zstd" and zstandard is None:
+        configuration_errors.append(
+            "SENSE_COLLECTOR_CAPTURE_COMPRESSION=zstd needs zstandard"
+        )
+    if configuration_errors:
+        for error in configuration_errors:
+            logger.error(f"Invalid configuration: {error} (pip install it or change the setting)")
+        sys.exit(1)
+
     try:
         logger.info("Attempting to authenticate with Sense API.")
         auth_response = await authenticate_with_sense(
@@ -827,42 +1239,100 @@ async def main():
             os.environ["SENSE_COLLECTOR_API_PASSWORD"],
         )
         logger.debug(f"Authentication response: {auth_response}")
-        monitor_id = str(auth_response["monitors"][0]["id"])
+        monitor_ids = [str(monitor["id"]) for monitor in auth_response["monitors"]]
         token = auth_response["access_token"]
         user_id = auth_response["user_id"]
         logger.info(
-            f"Successfully authenticated. Monitor ID: {monitor_id}, User ID: {user_id}"
+            f"Successfully authenticated. Monitor IDs: {', '.join(monitor_ids)}, User ID: {user_id}"
         )
     except Exception as e:
         logger.error(f"Authentication failed: {e}")
         sys.exit(1)
 
-    influxdb_params = {
-        "url": os.environ.get("SENSE_COLLECTOR_INFLUXDB_URL"),
-        "token": os.environ.get("SENSE_COLLECTOR_INFLUXDB_TOKEN"),
-        "org": os.environ.get("SENSE_COLLECTOR_INFLUXDB_ORG"),
-        "bucket": os.environ.get("SENSE_COLLECTOR_INFLUXDB_BUCKET"),
-    }
+    influxdb_params = influxdb_params_from_env()
     logger.debug(f"InfluxDB parameters: {influxdb_params}")
 
-    influxdb_storage = InfluxDBStorage(influxdb_params)
-
-    collector = SenseCollector(monitor_id, token, influxdb_storage, user_id)
+    storage = create_storage(influxdb_params)
+
+    # One collector per monitor, sharing the session, token and device cache
+    account = SenseAccount(token, user_id)
+    device_cache = DeviceCache(
+        ttl_seconds=device_cache_expiry_seconds,
+        stale_seconds=device_cache_stale_seconds,
+        max_entries=device_cache_max_entries,
+    )
+    capture_writer = None
+    if output_received_data:
+        capture_writer = CaptureWriter(
+            export_folder,
+            max_bytes=capture_max_mb * 1024 * 1024,
+            rotate_interval=capture_rotate_interval,
+            max_files=capture_max_files,
+            compression=capture_compression,
+            flush_interval=capture_flush_interval,
+        )
+    timeline = TimelineIngester(
+        storage,
+        cursor_path=os.path.join(export_folder, "timeline_cursor.json"),
+        concurrency=timeline_concurrency,
+    )
+    collectors = [
+        SenseCollector(
+            monitor_id,
+            account,
+            storage,
+            device_cache,
+            capture_writer,
+            timeline,
+        )
+        for monitor_id in monitor_ids
+    ]
     logger.info("Starting session for SenseCollector.")
-    await collector.start_session()
+    await account.start_session()
+
+    metrics_runner = None
+    if metrics_port:
+        metrics_runner = await metrics.start_metrics_server(metrics_port)
 
     try:
-        logger.info("Starting all Sense Collector tasks.")
-        await asyncio.gather(
-            collector.api_worker(),
-            collector.receive_data(),
-            collector.fetch_monitor_status(),
-            collector.fetch_devices(),
-            collector.periodic_token_renewal(),
+        logger.info(
+            f"Starting all Sense Collector tasks for {len(collectors)} monitor(s)."
         )
+        tasks = [account.periodic_token_renewal()]
+        if metrics_runner is not None:
+            tasks.append(metrics.monitor_event_loop_lag())
+        if capture_writer is not None:
+            tasks.append(capture_writer.run())
+        if timeline_enabled:
+            # The timeline belongs to the account, so it is polled once
+            tasks.append(
+                timeline.poll(
+                    account,
+                    SenseAPIEndpoints.TIMELINE.format(user_id=user_id),
+                    timeline_interval,
+                )
+            )
+        for collector in collectors:
+            tasks.extend(collector.api_worker() for _ in range(device_lookup_workers))
+            tasks.extend(
+                [
+                    collector.receive_data(),
+                    collector.fetch_monitor_status(),
+                    collector.fetch_devices(),
+                    collector.report_health(),
+                ]
+            )
+        await asyncio.gather(*tasks)
     finally:
+        await timeline.close()
         logger.info("Closing session for SenseCollector.")
-        await collector.close_session()
+        await account.close_session()
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        if capture_writer is not None:
+            await capture_writer.close()
+        logger.info("Flushing pending writes to storage.")
+        await storage.close()
 
 
 if __name__ == "__main__":
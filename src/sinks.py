@@ -0,0 +1,244 @@
+import abc
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+
+storage_logger = logging.getLogger("storage")
+
+
+class StorageSink(abc.ABC):
+    # Everything the collectors, the timeline and health reporting persist.
+    # Sinks batch on their own; persist_* calls should return quickly.
+    @abc.abstractmethod
+    async def persist_realtime_data(
+        self,
+        monitor_id,
+        hertz,
+        total_current,
+        total_watts,
+        epoch,
+        voltage,
+        devices,
+        channels,
+    ):
+        pass
+
+    @abc.abstractmethod
+    async def persist_device_data(self, device_data):
+        pass
+
+    @abc.abstractmethod
+    async def persist_timeline_events(self, events):
+        # events are (device_id, device_name, time, type, icon, body,
+        # device_state, user_device_type, device_transition_from_state) tuples
+        pass
+
+    async def persist_timeline_data(self, *event):
+        await self.persist_timeline_events([event])
+
+    @abc.abstractmethod
+    async def persist_frame_gap(self, monitor_id, start_epoch, end_epoch, missing):
+        # A run of seconds without any realtime frame, both ends inclusive
+        pass
+
+    @abc.abstractmethod
+    async def persist_hello_event(self, monitor_id, online_status, timestamp):
+        pass
+
+    @abc.abstractmethod
+    async def persist_data_change_event(
+        self,
+        monitor_id,
+        device_id,
+        user_version,
+        guid,
+        epoch_timestamp,
+        influxdb_timestamp,
+    ):
+        pass
+
+    @abc.abstractmethod
+    async def persist_device_state(
+        self, monitor_id, device_id, mode, device_state, timestamp
+    ):
+        pass
+
+    @abc.abstractmethod
+    async def persist_collector_health(self, monitor_id, health):
+        pass
+
+    @abc.abstractmethod
+    async def persist_monitor_status(self, monitor_id, monitor_status):
+        pass
+
+    def register_device_lookup(self, monitor_id, callback):
+        # Sinks that need device names they have not seen yet can ask for them
+        pass
+
+    @asynccontextmanager
+    async def unit_of_work(self):
+        # Sinks that can group the writes of one event override this
+        yield
+
+    def stats(self):
+        return {}
+
+    async def close(self):
+        pass
+
+
+class SinkForwarder:
+    # Feeds one sink from its own bounded queue and task. When the sink falls
+    # behind, the oldest calls are dropped rather than stalling the caller.
+    def __init__(self, sink, max_queue_size=10000):
+        self.sink = sink
+        self.name = type(sink).__name__
+        self.queue = asyncio.Queue(maxsize=max_queue_size)
+        self.task = asyncio.create_task(self.run())
+        self.dropped = 0
+        self.failed = 0
+
+    def put(self, method, args):
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+            if self.dropped % 1000 == 1:
+                storage_logger.warning(
+                    f"{self.name} is falling behind, {self.dropped} calls dropped"
+                )
+        self.queue.put_nowait((method, args))
+
+    async def run(self):
+        while True:
+            call = await self.queue.get()
+            if call is None:
+                return
+            # Whatever queued up meanwhile is written as one unit of work
+            calls = [call]
+            while not self.queue.empty():
+                call = self.queue.get_nowait()
+                if call is None:
+                    break
+                calls.append(call)
+            async with self.sink.unit_of_work():
+                for method, args in calls:
+                    try:
+                        await getattr(self.sink, method)(*args)
+                    except Exception as e:
+                        self.failed += 1
+                        storage_logger.error(f"{self.name}.{method} failed: {e}")
+            if call is None:
+                return
+
+    async def close(self):
+        await self.queue.put(None)
+        await self.task
+        await self.sink.close()
+
+
+class FanoutSink(StorageSink):
+    # Writes to several sinks at once. The primary sink is awaited directly so
+    # its own backpressure and spooling still apply; every other sink is fed
+    # through a SinkForwarder, so a slow archive never holds up the primary.
+    def __init__(self, primary, secondaries, max_queue_size=10000):
+        self.primary = primary
+        self.forwarders = [
+            SinkForwarder(sink, max_queue_size) for sink in secondaries
+        ]
+
+    async def fan_out(self, method, *args):
+        for forwarder in self.forwarders:
+            forwarder.put(method, args)
+        await getattr(self.primary, method)(*args)
+
+    async def persist_realtime_data(
+        self,
+        monitor_id,
+        hertz,
+        total_current,
+        total_watts,
+        epoch,
+        voltage,
+        devices,
+        channels,
+    ):
+        await self.fan_out(
+            "persist_realtime_data",
+            monitor_id,
+            hertz,
+            total_current,
+            total_watts,
+            epoch,
+            voltage,
+            devices,
+            channels,
+        )
+
+    async def persist_device_data(self, device_data):
+        await self.fan_out("persist_device_data", device_data)
+
+    async def persist_timeline_events(self, events):
+        await self.fan_out("persist_timeline_events", events)
+
+    async def persist_frame_gap(self, monitor_id, start_epoch, end_epoch, missing):
+        await self.fan_out(
+            "persist_frame_gap", monitor_id, start_epoch, end_epoch, missing
+        )
+
+    async def persist_hello_event(self, monitor_id, online_status, timestamp):
+        await self.fan_out("persist_hello_event", monitor_id, online_status, timestamp)
+
+    async def persist_data_change_event(
+        self,
+        monitor_id,
+        device_id,
+        user_version,
+        guid,
+        epoch_timestamp,
+        influxdb_timestamp,
+    ):
+        await self.fan_out(
+            "persist_data_change_event",
+            monitor_id,
+            device_id,
+            user_version,
+            guid,
+            epoch_timestamp,
+            influxdb_timestamp,
+        )
+
+    async def persist_device_state(
+        self, monitor_id, device_id, mode, device_state, timestamp
+    ):
+        await self.fan_out(
+            "persist_device_state", monitor_id, device_id, mode, device_state, timestamp
+        )
+
+    async def persist_collector_health(self, monitor_id, health):
+        await self.fan_out("persist_collector_health", monitor_id, health)
+
+    async def persist_monitor_status(self, monitor_id, monitor_status):
+        await self.fan_out("persist_monitor_status", monitor_id, monitor_status)
+
+    def register_device_lookup(self, monitor_id, callback):
+        self.primary.register_device_lookup(monitor_id, callback)
+        for forwarder in self.forwarders:
+            forwarder.sink.register_device_lookup(monitor_id, callback)
+
+    def unit_of_work(self):
+        return self.primary.unit_of_work()
+
+    def stats(self):
+        stats = dict(self.primary.stats())
+        for forwarder in self.forwarders:
+            stats.update(forwarder.sink.stats())
+            prefix = f"sink_{forwarder.name.lower()}"
+            stats[f"{prefix}_queue_depth"] = forwarder.queue.qsize()
+            stats[f"{prefix}_dropped"] = forwarder.dropped
+            stats[f"{prefix}_failed"] = forwarder.failed
+        return stats
+
+    async def close(self):
+        for forwarder in self.forwarders:
+            await forwarder.close()
+        await self.primary.close()
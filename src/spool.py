@@ -0,0 +1,187 @@
+import logging
+import os
+import threading
+import time
+
+storage_logger = logging.getLogger("storage")
+
+SEGMENT_PREFIX = "segment-"
+SEGMENT_SUFFIX = ".lp"
+# Unreadable segments are renamed with this suffix and no longer drained
+QUARANTINE_SUFFIX = ".bad"
+
+
+class Spool:
+    # Append-only, segment-rotated store of line protocol that could not be
+    # written to InfluxDB. Segments are drained oldest first.
+    def __init__(
+        self,
+        folder,
+        segment_bytes=8 * 1024 * 1024,
+        max_bytes=512 * 1024 * 1024,
+        fsync_interval=1.0,
+    ):
+        self.folder = folder
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+        self.fsync_interval = fsync_interval
+
+        # Appends come from the flusher and from overflowing producers
+        self.lock = threading.Lock()
+
+        os.makedirs(self.folder, exist_ok=True)
+
+        # Pick up segments left behind by a previous run
+        self.closed_segments = sorted(
+            file_name
+            for file_name in os.listdir(self.folder)
+            if file_name.startswith(SEGMENT_PREFIX)
+            and file_name.endswith(SEGMENT_SUFFIX)
+        )
+        self.total_bytes = sum(
+            os.path.getsize(self.segment_path(file_name))
+            for file_name in self.closed_segments
+        )
+        self.next_sequence = (
+            int(self.closed_segments[-1][len(SEGMENT_PREFIX) : -len(SEGMENT_SUFFIX)])
+            + 1
+            if self.closed_segments
+            else 0
+        )
+
+        self.current_segment = None
+        self.current_file = None
+        self.current_bytes = 0
+        self.last_fsync = time.monotonic()
+
+        self.bytes_spooled = 0
+        self.bytes_drained = 0
+        self.bytes_discarded = 0
+        self.segments_quarantined = 0
+
+        if self.closed_segments:
+            storage_logger.info(
+                f"Found {len(self.closed_segments)} spool segments ({self.total_bytes} bytes) to drain"
+            )
+
+    def segment_path(self, file_name):
+        return os.path.join(self.folder, file_name)
+
+    def has_data(self):
+        with self.lock:
+            return self.total_bytes > 0
+
+    def append(self, data):
+        with self.lock:
+            if self.current_file is None:
+                self.current_segment = (
+                    f"{SEGMENT_PREFIX}{self.next_sequence:012d}{SEGMENT_SUFFIX}"
+                )
+                self.next_sequence += 1
+                self.current_file = open(self.segment_path(self.current_segment), "ab")
+                self.current_bytes = 0
+
+            self.current_file.write(data)
+            self.current_bytes += len(data)
+            self.total_bytes += len(data)
+            self.bytes_spooled += len(data)
+
+            # fsync at most once per interval instead of once per append
+            now = time.monotonic()
+            if now - self.last_fsync >= self.fsync_interval:
+                self.sync_current()
+                self.last_fsync = now
+
+            if self.current_bytes >= self.segment_bytes:
+                self.close_current()
+
+            self.enforce_limit()
+
+    def sync_current(self):
+        if self.current_file is not None:
+            self.current_file.flush()
+            os.fsync(self.current_file.fileno())
+
+    def close_current(self):
+        if self.current_file is None:
+            return
+        self.sync_current()
+        self.current_file.close()
+        self.closed_segments.append(self.current_segment)
+        self.current_file = None
+        self.current_segment = None
+        self.current_bytes = 0
+
+    def enforce_limit(self):
+        # Discard the oldest closed segments once the disk cap is exceeded
+        while self.total_bytes > self.max_bytes and self.closed_segments:
+            file_name = self.closed_segments.pop(0)
+            path = self.segment_path(file_name)
+            size = os.path.getsize(path)
+            os.remove(path)
+            self.total_bytes -= size
+            self.bytes_discarded += size
+            storage_logger.warning(
+                f"Spool exceeded {self.max_bytes} bytes, discarded {file_name} ({size} bytes)"
+            )
+
+    def oldest_segment(self):
+        # Rotates the active segment so that everything spooled becomes drainable
+        with self.lock:
+            if not self.closed_segments:
+                self.close_current()
+            return self.closed_segments[0] if self.closed_segments else None
+
+    def read_segment(self, file_name):
+        # Returns None when the segment was discarded by enforce_limit meanwhile
+        with self.lock:
+            if file_name not in self.closed_segments:
+                return None
+            with open(self.segment_path(file_name), "rb") as f:
+                return f.read()
+
+    def remove_segment(self, file_name):
+        with self.lock:
+            if file_name not in self.closed_segments:
+                return
+            path = self.segment_path(file_name)
+            self.closed_segments.remove(file_name)
+            try:
+                size = os.path.getsize(path)
+                os.remove(path)
+            except FileNotFoundError:
+                size = 0
+            self.total_bytes -= size
+            self.bytes_drained += size
+
+    def quarantine_segment(self, file_name):
+        # Moves an unreadable segment out of the drain order; if it cannot be
+        # renamed either, it is only forgotten so draining never gets stuck
+        with self.lock:
+            if file_name not in self.closed_segments:
+                return
+            self.closed_segments.remove(file_name)
+            path = self.segment_path(file_name)
+            try:
+                size = os.path.getsize(path)
+                os.replace(path, path + QUARANTINE_SUFFIX)
+            except OSError as e:
+                size = 0
+                storage_logger.error(f"Could not quarantine spool segment {file_name}: {e}")
+            self.total_bytes = max(self.total_bytes - size, 0)
+            self.segments_quarantined += 1
+
+    def close(self):
+        with self.lock:
+            self.close_current()
+
+    def stats(self):
+        return {
+            "spool_bytes": self.total_bytes,
+            "spool_segments": len(self.closed_segments)
+            + (1 if self.current_file is not None else 0),
+            "spool_bytes_spooled": self.bytes_spooled,
+            "spool_bytes_drained": self.bytes_drained,
+            "spool_bytes_discarded": self.bytes_discarded,
+            "spool_segments_quarantined": self.segments_quarantined,
+        }
@@ -0,0 +1,268 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import time
+
+from sinks import StorageSink
+from timeline import item_time
+
+storage_logger = logging.getLogger("storage")
+
+SCHEMA = (
+    """CREATE TABLE IF NOT EXISTS realtime_mains (
+        monitor_id TEXT, epoch REAL, hertz REAL, watts REAL, current REAL,
+        l1_watts REAL, l2_watts REAL, l1_voltage REAL, l2_voltage REAL)""",
+    """CREATE TABLE IF NOT EXISTS realtime_devices (
+        monitor_id TEXT, epoch REAL, device_id TEXT, device_name TEXT,
+        watts REAL, always_on_watts REAL, sd_watts REAL, sd_current REAL,
+        sd_voltage REAL, sd_energy REAL)""",
+    """CREATE TABLE IF NOT EXISTS events (
+        measurement TEXT, monitor_id TEXT, device_id TEXT, time REAL, data TEXT)""",
+    "CREATE INDEX IF NOT EXISTS realtime_mains_time ON realtime_mains (monitor_id, epoch)",
+    "CREATE INDEX IF NOT EXISTS realtime_devices_time ON realtime_devices (monitor_id, device_id, epoch)",
+    "CREATE INDEX IF NOT EXISTS events_time ON events (measurement, time)",
+)
+
+INSERTS = {
+    "realtime_mains": "INSERT INTO realtime_mains VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+    "realtime_devices": "INSERT INTO realtime_devices VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+    "events": "INSERT INTO events VALUES (?, ?, ?, ?, ?)",
+}
+
+
+def leg(values, index):
+    return values[index] if len(values) > index else None
+
+
+class SQLiteSink(StorageSink):
+    # Local long-term archive in a single SQLite file. Realtime frames go to
+    # two narrow tables; every other event is kept as JSON in `events`. Rows
+    # are buffered and inserted in one transaction per flush on a worker thread.
+    def __init__(
+        self,
+        path,
+        batch_size=5000,
+        flush_interval=5.0,
+        max_buffered_rows=200000,
+    ):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Only ever used by one flush at a time, from whichever worker thread
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        for statement in SCHEMA:
+            self.connection.execute(statement)
+        self.connection.commit()
+
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_buffered_rows = max_buffered_rows
+        # table -> pending rows
+        self.rows = {table: [] for table in INSERTS}
+        self.buffered_rows = 0
+        self.flush_lock = asyncio.Lock()
+        self.wakeup = asyncio.Event()
+        self.closed = False
+        self.flusher_task = asyncio.create_task(self.flusher())
+
+        self.rows_written = 0
+        self.rows_dropped = 0
+        self.flush_failures = 0
+
+    def add(self, table, row):
+        # Never blocks: when the buffer is full the row is dropped
+        if self.buffered_rows >= self.max_buffered_rows:
+            self.rows_dropped += 1
+            return
+        self.rows[table].append(row)
+        self.buffered_rows += 1
+        if self.buffered_rows >= self.batch_size:
+            self.wakeup.set()
+
+    def add_event(self, measurement, monitor_id, device_id, timestamp, data):
+        self.add(
+            "events",
+            (measurement, monitor_id, device_id, timestamp, json.dumps(data, default=str)),
+        )
+
+    async def persist_realtime_data(
+        self,
+        monitor_id,
+        hertz,
+        total_current,
+        total_watts,
+        epoch,
+        voltage,
+        devices,
+        channels,
+    ):
+        self.add(
+            "realtime_mains",
+            (
+                monitor_id,
+                epoch,
+                hertz,
+                total_watts,
+                total_current,
+                leg(channels, 0),
+                leg(channels, 1),
+                leg(voltage, 0),
+                leg(voltage, 1),
+            ),
+        )
+        for device in devices:
+            device_sd = device.get("sd") or {}
+            self.add(
+                "realtime_devices",
+                (
+                    monitor_id,
+                    epoch,
+                    device.get("id"),
+                    device.get("name"),
+                    device.get("w"),
+                    device.get("ao_w"),
+                    device_sd.get("w"),
+                    device_sd.get("i"),
+                    device_sd.get("v"),
+                    device_sd.get("e"),
+                ),
+            )
+
+    async def persist_device_data(self, device_data):
+        device_info = device_data.get("device", {})
+        self.add_event(
+            "device_data",
+            device_info.get("monitor_id"),
+            device_info.get("id"),
+            time.time(),
+            device_data,
+        )
+
+    async def persist_timeline_events(self, events):
+        for event in events:
+            (
+                device_id,
+                device_name,
+                event_time,
+                event_type,
+                icon,
+                body,
+                device_state,
+                user_device_type,
+                device_transition_from_state,
+            ) = event
+            self.add_event(
+                "timeline",
+                None,
+                device_id,
+                item_time({"time": event_time}),
+                {
+                    "device_name": device_name,
+                    "time": event_time,
+                    "type": event_type,
+                    "icon": icon,
+                    "body": body,
+                    "device_state": device_state,
+                    "user_device_type": user_device_type,
+                    "device_transition_from_state": device_transition_from_state,
+                },
+            )
+
+    async def persist_frame_gap(self, monitor_id, start_epoch, end_epoch, missing):
+        self.add_event(
+            "frame_gap",
+            monitor_id,
+            None,
+            start_epoch,
+            {"end_epoch": end_epoch, "missing_frames": missing},
+        )
+
+    async def persist_hello_event(self, monitor_id, online_status, timestamp):
+        self.add_event("hello", monitor_id, None, timestamp, {"online": online_status})
+
+    async def persist_data_change_event(
+        self,
+        monitor_id,
+        device_id,
+        user_version,
+        guid,
+        epoch_timestamp,
+        influxdb_timestamp,
+    ):
+        self.add_event(
+            "data_change",
+            monitor_id,
+            device_id,
+            influxdb_timestamp,
+            {
+                "user_version": user_version,
+                "guid": guid,
+                "json_timestamp": epoch_timestamp,
+            },
+        )
+
+    async def persist_device_state(
+        self, monitor_id, device_id, mode, device_state, timestamp
+    ):
+        self.add_event(
+            "device_state",
+            monitor_id,
+            device_id,
+            timestamp,
+            {"mode": mode, "state": device_state},
+        )
+
+    async def persist_collector_health(self, monitor_id, health):
+        self.add_event("collector_health", monitor_id, None, time.time(), health)
+
+    async def persist_monitor_status(self, monitor_id, monitor_status):
+        self.add_event("monitor_status", monitor_id, None, time.time(), monitor_status)
+
+    async def flusher(self):
+        while not self.closed:
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self.wakeup.clear()
+            await self.flush()
+
+    async def flush(self):
+        async with self.flush_lock:
+            if not self.buffered_rows:
+                return
+            rows, count = self.rows, self.buffered_rows
+            self.rows = {table: [] for table in INSERTS}
+            self.buffered_rows = 0
+            try:
+                await asyncio.to_thread(self.write_rows, rows)
+                self.rows_written += count
+            except sqlite3.Error as e:
+                self.flush_failures += 1
+                self.rows_dropped += count
+                storage_logger.error(f"Failed to write {count} rows to SQLite: {e}")
+
+    def write_rows(self, rows):
+        with self.connection:
+            for table, table_rows in rows.items():
+                if table_rows:
+                    self.connection.executemany(INSERTS[table], table_rows)
+
+    def stats(self):
+        return {
+            "sqlite_rows_written": self.rows_written,
+            "sqlite_rows_buffered": self.buffered_rows,
+            "sqlite_rows_dropped": self.rows_dropped,
+            "sqlite_flush_failures": self.flush_failures,
+        }
+
+    async def close(self):
+        self.closed = True
+        self.wakeup.set()
+        await self.flusher_task
+        await self.flush()
+        self.connection.close()
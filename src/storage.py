@@ -1,19 +1,45 @@
 import asyncio
+import contextvars
+import os
+import time
+from contextlib import asynccontextmanager
 import aiohttp
 from datetime import datetime, timezone
-from influxdb_client import InfluxDBClient, Point, WriteOptions
-from influxdb_client.client.write_api import ASYNCHRONOUS
+from influxdb_client import InfluxDBClient, Point
+from influxdb_client.client.write_api import SYNCHRONOUS
 import logging
 from dateutil import parser
 import pytz
-from collections import defaultdict
+
+import metrics
+from change_filter import ChangeFilter, PassthroughFilter
+from line_protocol import RealtimeEncoder
+from models import DeviceTable
+from rollup import RollupStage
+from sinks import StorageSink
+from spool import Spool
+from write_pipeline import WritePipeline
 
 # Configure logging
 storage_logger = logging.getLogger("storage")
 
+# The unit of work collecting writes for the current task, if any
+current_unit_of_work = contextvars.ContextVar("current_unit_of_work", default=None)
+
+
+class UnitOfWork:
+    __slots__ = ("records", "count", "open")
 
-class InfluxDBStorage:
-    def __init__(self, influxdb_params):
+    def __init__(self):
+        self.records = []
+        self.count = 0
+        # Tasks started inside the block inherit the context variable, but
+        # must not add to a unit that has already been written
+        self.open = True
+
+
+class InfluxDBStorage(StorageSink):
+    def __init__(self, influxdb_params, write_api=None):
         self.influxdb_client = InfluxDBClient(
             url=influxdb_params["url"],
             token=influxdb_params["token"],
@@ -21,21 +47,130 @@ class InfluxDBStorage:
         )
         self.bucket = influxdb_params["bucket"]
 
-        write_options = WriteOptions(
-            write_type=ASYNCHRONOUS,
-            batch_size=10000,
-            flush_interval=10000,
+        # A replacement write API (e.g. for offline replay) skips the HTTP writer.
+        # Writes are synchronous because they only ever run on the pipeline's
+        # flusher thread, which does its own batching.
+        # Spool segments are drained through a gzip-enabled client in bulk.
+        self.bulk_influxdb_client = None
+        if write_api is None:
+            write_api = self.influxdb_client.write_api(write_options=SYNCHRONOUS)
+            self.bulk_influxdb_client = InfluxDBClient(
+                url=influxdb_params["url"],
+                token=influxdb_params["token"],
+                org=influxdb_params["org"],
+                enable_gzip=True,
+            )
+            self.bulk_write_api = self.bulk_influxdb_client.write_api(
+                write_options=SYNCHRONOUS
+            )
+        else:
+            self.bulk_write_api = write_api
+        self.write_api = write_api
+
+        # Durable on-disk spool for writes that fail or overflow the queue
+        self.spool = None
+        if influxdb_params.get("spool_folder") and influxdb_params.get(
+            "spool_max_bytes"
+        ):
+            self.spool = Spool(
+                influxdb_params["spool_folder"],
+                segment_bytes=influxdb_params.get("spool_segment_bytes", 8388608),
+                max_bytes=influxdb_params["spool_max_bytes"],
+                fsync_interval=influxdb_params.get("spool_fsync_interval", 1.0),
+            )
+
+        # Bounded queue and single flusher between the collector and InfluxDB
+        self.write_pipeline = WritePipeline(
+            self.write_line_protocol,
+            max_queue_size=influxdb_params.get("write_queue_size", 1000),
+            batch_size=influxdb_params.get("write_batch_size", 5000),
+            flush_interval=influxdb_params.get("write_flush_interval", 1.0),
+            overflow_policy=influxdb_params.get("write_overflow_policy", "block"),
+            spool=self.spool,
+            bulk_write_function=self.bulk_write_line_protocol,
+            retry_interval=influxdb_params.get("spool_retry_interval", 10.0),
+        )
+        self.write_pipeline.start()
+        metrics.WRITE_QUEUE_DEPTH.set_function(self.write_pipeline.queue.qsize, "main")
+        self.write_stats_interval = influxdb_params.get("write_stats_interval", 60)
+
+        # Change-only emission of rarely changing string and status fields
+        if influxdb_params.get("change_only"):
+            self.change_filter = ChangeFilter(
+                deadband=influxdb_params.get("change_deadband", 0.0),
+                keepalive=influxdb_params.get("change_keepalive", 900.0),
+            )
+            encoder_change_filter = self.change_filter
+        else:
+            self.change_filter = PassthroughFilter()
+            encoder_change_filter = None
+
+        # Precompiled line protocol encoder for realtime frames
+        self.realtime_encoder = RealtimeEncoder(
+            change_filter=encoder_change_filter,
+            derived_fields=influxdb_params.get("derived_fields", False),
         )
-        self.write_api = self.influxdb_client.write_api(write_options=write_options)
 
-        # Initialize a local cache for device names
-        self.device_name_cache = {}
+        # Optional min/max/mean/last rollups of realtime frames. Raw points are
+        # still written unless rollup_raw is false. Rollups for another bucket
+        # get their own pipeline (and spool) so the main one stays single-bucket.
+        self.rollup = None
+        self.rollup_raw = influxdb_params.get("rollup_raw", True)
+        self.rollup_pipeline = self.write_pipeline
+        self.rollup_spool = None
+        if influxdb_params.get("rollup_windows"):
+            self.rollup = RollupStage(influxdb_params["rollup_windows"])
+            self.rollup_bucket = influxdb_params.get("rollup_bucket") or self.bucket
+            if self.rollup_bucket != self.bucket:
+                if self.spool is not None:
+                    self.rollup_spool = Spool(
+                        os.path.join(influxdb_params["spool_folder"], "rollup"),
+                        segment_bytes=influxdb_params.get(
+                            "spool_segment_bytes", 8388608
+                        ),
+                        max_bytes=influxdb_params["spool_max_bytes"],
+                        fsync_interval=influxdb_params.get("spool_fsync_interval", 1.0),
+                    )
+                self.rollup_pipeline = WritePipeline(
+                    self.write_rollup_line_protocol,
+                    max_queue_size=influxdb_params.get("write_queue_size", 1000),
+                    batch_size=influxdb_params.get("write_batch_size", 5000),
+                    flush_interval=influxdb_params.get("write_flush_interval", 1.0),
+                    overflow_policy=influxdb_params.get(
+                        "write_overflow_policy", "block"
+                    ),
+                    spool=self.rollup_spool,
+                    bulk_write_function=self.bulk_write_rollup_line_protocol,
+                    retry_interval=influxdb_params.get("spool_retry_interval", 10.0),
+                )
+                self.rollup_pipeline.start()
+                metrics.WRITE_QUEUE_DEPTH.set_function(
+                    self.rollup_pipeline.queue.qsize, "rollup"
+                )
+            metrics.BUFFERED_RECORDS.set_function(self.rollup.buffered_series, "rollup")
+
+        # Device names known from persist_device_data, one record per device
+        self.device_table = DeviceTable()
+
+        # always_on device samples waiting for a device name, flushed as soon as
+        # persist_device_data caches it:
+        # device_id -> [(monitor_id, watts, timestamp, queued_at), ...]
+        self.pending_device_samples = {}
+        self.pending_device_ttl = influxdb_params.get("pending_device_ttl", 3600)
+        self.pending_device_max = influxdb_params.get("pending_device_max", 1000)
+        self.pending_device_max_samples = influxdb_params.get(
+            "pending_device_max_samples", 100
+        )
+        self.pending_device_samples_dropped = 0
+        metrics.BUFFERED_RECORDS.set_function(
+            self.pending_device_sample_count, "pending_always_on"
+        )
 
-        # Queue for device data awaiting names
-        self.device_data_queue = defaultdict(list)
+        # monitor_id -> callable that queues a device lookup for that monitor
+        self.device_lookup_callbacks = {}
 
-        # Start the task to process the device data queue
-        asyncio.create_task(self.process_device_queue())
+        # Start the task that records write pipeline metrics; close() stops it
+        self.stats_task = asyncio.create_task(self.persist_write_pipeline_stats())
 
     async def persist_realtime_data(
         self,
@@ -48,113 +183,53 @@ class InfluxDBStorage:
         devices,
         channels,
     ):
-        storage_logger.debug("Persisting realtime data")
-
         current_time = datetime.now(timezone.utc)
         epoch_time = datetime.fromtimestamp(epoch, timezone.utc)
         time_difference = (current_time - epoch_time).total_seconds()
 
-        storage_logger.debug(f"Time difference: {time_difference}")
+        storage_logger.debug("Time difference: %s", time_difference)
+
+        if self.rollup is not None:
+            try:
+                record, count = self.rollup.add_frame(
+                    monitor_id,
+                    hertz,
+                    total_current,
+                    total_watts,
+                    epoch,
+                    voltage,
+                    devices,
+                    channels,
+                )
+                await self.write_rollup(record, count)
+            except Exception as e:
+                storage_logger.error(f"Error preparing rollups for InfluxDB: {e}")
+            if not self.rollup_raw:
+                return
 
         try:
-            main_point = (
-                Point("sense_mains")
-                .tag("monitor_id", monitor_id)
-                .field("hertz", hertz)
-                .field("current", total_current)
-                .field("watts", total_watts)
-                .time(epoch, write_precision="s")
+            record, count = self.realtime_encoder.encode_realtime(
+                monitor_id,
+                hertz,
+                total_current,
+                total_watts,
+                epoch,
+                voltage,
+                devices,
+                channels,
+                time_difference,
             )
+            storage_logger.debug("Encoded %d realtime lines for %s", count, monitor_id)
 
-            channel_point_1 = (
-                Point("sense_mains")
-                .tag("monitor_id", monitor_id)
-                .tag("leg", "L1")
-                .field("watts", channels[0])
-                .time(epoch, write_precision="s")
-            )
-
-            channel_point_2 = (
-                Point("sense_mains")
-                .tag("monitor_id", monitor_id)
-                .tag("leg", "L2")
-                .field("watts", channels[1])
-                .time(epoch, write_precision="s")
-            )
-
-            voltage_point_1 = (
-                Point("sense_mains")
-                .tag("monitor_id", monitor_id)
-                .tag("leg", "L1")
-                .field("voltage", voltage[0])
-                .time(epoch, write_precision="s")
-            )
-
-            voltage_point_2 = (
-                Point("sense_mains")
-                .tag("monitor_id", monitor_id)
-                .tag("leg", "L2")
-                .field("voltage", voltage[1])
-                .time(epoch, write_precision="s")
-            )
-
-            o11y_point = (
-                Point("sense_o11y")
-                .tag("monitor_id", monitor_id)
-                .field("time_difference", time_difference)
-                .time(epoch, write_precision="s")
-            )
-
-            points = [
-                main_point,
-                channel_point_1,
-                channel_point_2,
-                voltage_point_1,
-                voltage_point_2,
-                o11y_point,
-            ]
-
-            for device in devices:
-                device_id = device.get("id")
-                device_watts = device.get("w")
-                device_name = device.get("name")
-                device_icon = device.get("icon")
-                device_sd = device.get("sd", {})
-                is_plug = any(
-                    device_sd.get(key) is not None for key in ["w", "i", "v", "e"]
-                )
-
-                # Add detailed debug logging
-                storage_logger.debug(f"Processing device {device_id} - {device_name}")
-                storage_logger.debug(f"Device Watts: {device_watts}")
-                storage_logger.debug(f"Always On Watts (ao_w): {device.get('ao_w')}")
-                storage_logger.debug(f"Always On State (ao_st): {device.get('ao_st')}")
-                storage_logger.debug(f"Device SD: {device_sd}")
-
-                device_point = (
-                    Point("sense_devices")
-                    .tag("monitor_id", monitor_id)
-                    .tag("device_id", device_id)
-                    .tag("device_name", device_name)
-                    .tag("is_plug", str(is_plug).lower())
-                    .field("icon", device_icon)
-                    .field("watts", device_watts)
-                    .field("sd_watts", device_sd.get("w"))
-                    .field("sd_current", device_sd.get("i"))
-                    .field("sd_voltage", device_sd.get("v"))
-                    .field("sd_energy", device_sd.get("e"))
-                    .field("always_on_watts", device.get("ao_w"))
-                    .field("always_on_state", device.get("ao_st"))
-                    .time(epoch, write_precision="s")
-                )
-
-                points.append(device_point)
-
-            await self.write_points(points)
+            await self.write_points(record, count)
         except Exception as e:
             storage_logger.error(f"Error preparing points for InfluxDB: {e}")
 
     async def persist_device_data(self, device_data):
+        async with self.unit_of_work():
+            await self.persist_device_data_points(device_data)
+
+    async def persist_device_data_points(self, device_data):
         storage_logger.debug("Persisting device data")
         storage_logger.debug(f"Device data: {device_data}")
 
@@ -165,8 +240,8 @@ class InfluxDBStorage:
             icon = device_info.get("icon")
             monitor_id = device_info.get("monitor_id")
 
-            # Cache the device name
-            self.device_name_cache[device_id] = device_name
+            # Cache the device name and write samples that were waiting for it
+            await self.cache_device_name(device_id, device_name)
 
             last_state_timestamp_seconds = None
             if "last_state_time" in device_info:
@@ -271,97 +346,122 @@ class InfluxDBStorage:
 
         await self.write_points([device_detail_point])
 
-        # Persist comparison data as a related metric
-        comparison_point = (
-            Point("sense_always_on_comparison")
-            .tag("device_id", device_id)
-            .tag("monitor_id", monitor_id)
-            .field("comparison_text", comparison.get("comparison_text"))
-            .field("comparison_summary_text", comparison.get("comparison_summary_text"))
-            .field("title", comparison.get("title"))
-            .field("count", comparison.get("count"))
-            .field("display_count", comparison.get("display_count"))
-            .field("cohort_marker", comparison.get("cohort_marker"))
-            .field("cohort_avg_w", comparison.get("cohort_avg_w"))
-            .time(timestamp, write_precision="s")
-        )
+        # Persist comparison data as a related metric, skipping unchanged fields
+        comparison_fields = {
+            "comparison_text": comparison.get("comparison_text"),
+            "comparison_summary_text": comparison.get("comparison_summary_text"),
+            "title": comparison.get("title"),
+            "count": comparison.get("count"),
+            "display_count": comparison.get("display_count"),
+            "cohort_marker": comparison.get("cohort_marker"),
+            "cohort_avg_w": comparison.get("cohort_avg_w"),
+        }
 
         cohort = comparison.get("cohort", {})
         if cohort:
-            comparison_point.field("cohort_id", cohort.get("id"))
-            comparison_point.field("cohort_area_code", cohort.get("area_code"))
-            comparison_point.field("cohort_state", cohort.get("state"))
-            comparison_point.field("cohort_home_size", cohort.get("home_size"))
-
-        await self.write_points([comparison_point])
+            comparison_fields["cohort_id"] = cohort.get("id")
+            comparison_fields["cohort_area_code"] = cohort.get("area_code")
+            comparison_fields["cohort_state"] = cohort.get("state")
+            comparison_fields["cohort_home_size"] = cohort.get("home_size")
+
+        comparison_point = self.change_filter.point(
+            "sense_always_on_comparison",
+            {"device_id": device_id, "monitor_id": monitor_id},
+            comparison_fields,
+            timestamp,
+        )
+        if comparison_point is not None:
+            await self.write_points([comparison_point])
 
         # Handle devices within "always_on"
         for device in always_on.get("devices", []):
             device_id = device.get("id")
             device_watts = device.get("w")
 
-            # Check if the device name is cached
-            if device_id not in self.device_name_cache:
-                # If not cached, add to queue for later processing
+            if device_id not in self.device_table:
                 storage_logger.debug(
-                    f"Device name for {device_id} not in cache. Queuing for later."
-                )
-                self.device_data_queue[device_id].append(
-                    (monitor_id, device_watts, timestamp)
+                    "Device name for %s not in cache. Queuing for later.", device_id
                 )
+                self.queue_device_sample(monitor_id, device_id, device_watts, timestamp)
             else:
-                device_name = self.device_name_cache[device_id]
-                storage_logger.debug(f"Device {device_id} - {device_name}")
-
-                device_point = (
-                    Point("sense_always_on_devices")
-                    .tag("monitor_id", monitor_id)
-                    .tag("parent_device_id", "always_on")
-                    .tag("device_id", device_id)
-                    .tag("device_name", device_name)  # Include device_name tag
-                    .field("watts", device_watts)
-                    .time(timestamp, write_precision="s")
+                device_name = self.device_table.get(device_id).name
+                storage_logger.debug("Device %s - %s", device_id, device_name)
+                await self.write_points(
+                    [
+                        self.always_on_device_point(
+                            monitor_id, device_id, device_name, device_watts, timestamp
+                        )
+                    ]
                 )
 
-                await self.write_points([device_point])
-
-    async def process_device_queue(self):
-        while True:
-            for device_id, data_list in list(self.device_data_queue.items()):
-                if device_id in self.device_name_cache:
-                    device_name = self.device_name_cache[device_id]
-                    for monitor_id, device_watts, timestamp in data_list:
-                        storage_logger.debug(
-                            f"Processing queued data for device {device_id} - {device_name}"
-                        )
-                        device_point = (
-                            Point("sense_always_on_devices")
-                            .tag("monitor_id", monitor_id)
-                            .tag("parent_device_id", "always_on")
-                            .tag("device_id", device_id)
-                            .tag("device_name", device_name)  # Include device_name tag
-                            .field("watts", device_watts)
-                            .time(timestamp, write_precision="s")
-                        )
-                        await self.write_points([device_point])
-                    del self.device_data_queue[device_id]
-            await asyncio.sleep(1)  # Sleep briefly to avoid busy waiting
+    def always_on_device_point(
+        self, monitor_id, device_id, device_name, device_watts, timestamp
+    ):
+        return (
+            Point("sense_always_on_devices")
+            .tag("monitor_id", monitor_id)
+            .tag("parent_device_id", "always_on")
+            .tag("device_id", device_id)
+            .tag("device_name", device_name)  # Include device_name tag
+            .field("watts", device_watts)
+            .time(timestamp, write_precision="s")
+        )
 
-    async def write_points(self, points):
-        storage_logger.debug("Writing points to InfluxDB")
-        try:
-            self.write_api.write(
-                bucket=self.bucket,
-                org=self.influxdb_client.org,
-                record=points,
-                write_precision="s",
+    def register_device_lookup(self, monitor_id, callback):
+        self.device_lookup_callbacks[monitor_id] = callback
+
+    def queue_device_sample(self, monitor_id, device_id, device_watts, timestamp):
+        now = time.monotonic()
+        samples = self.pending_device_samples.get(device_id)
+        if samples is None:
+            if len(self.pending_device_samples) >= self.pending_device_max:
+                self.expire_device_samples(now)
+            if len(self.pending_device_samples) >= self.pending_device_max:
+                # Still full: give up on the device that has waited longest
+                oldest_device_id = next(iter(self.pending_device_samples))
+                dropped = self.pending_device_samples.pop(oldest_device_id)
+                self.pending_device_samples_dropped += len(dropped)
+            samples = self.pending_device_samples[device_id] = []
+
+            # Resolve the name now instead of waiting for the next device sweep
+            callback = self.device_lookup_callbacks.get(monitor_id)
+            if callback is not None:
+                callback(device_id)
+
+        samples.append((monitor_id, device_watts, timestamp, now))
+        if len(samples) > self.pending_device_max_samples:
+            del samples[0]
+            self.pending_device_samples_dropped += 1
+
+    def expire_device_samples(self, now):
+        for device_id, samples in list(self.pending_device_samples.items()):
+            if now - samples[-1][3] >= self.pending_device_ttl:
+                del self.pending_device_samples[device_id]
+                self.pending_device_samples_dropped += len(samples)
+
+    async def cache_device_name(self, device_id, device_name):
+        self.device_table.update(device_id, device_name)
+        samples = self.pending_device_samples.pop(device_id, None)
+        if not samples:
+            return
+        now = time.monotonic()
+        points = [
+            self.always_on_device_point(
+                monitor_id, device_id, device_name, device_watts, timestamp
             )
-        except Exception as e:
-            storage_logger.error(f"Error writing points to InfluxDB: {e}")
-            for point in points:
-                storage_logger.error(f"Point: {point.to_line_protocol()}")
+            for monitor_id, device_watts, timestamp, queued_at in samples
+            if now - queued_at < self.pending_device_ttl
+        ]
+        self.pending_device_samples_dropped += len(samples) - len(points)
+        storage_logger.debug(
+            "Writing %d queued samples for device %s - %s",
+            len(points),
+            device_id,
+            device_name,
+        )
+        await self.write_points(points)
 
-    async def persist_timeline_data(
+    def timeline_point(
         self,
         device_id,
         device_name,
@@ -373,7 +473,7 @@ class InfluxDBStorage:
         user_device_type,
         device_transition_from_state,
     ):
-        timeline_point = (
+        return (
             Point("sense_event")
             .tag("device_id", device_id)
             .tag("device_name", device_name)
@@ -386,7 +486,22 @@ class InfluxDBStorage:
             .field("device_transition_from_state", device_transition_from_state)
             .time(time, write_precision="s")
         )
-        await self.write_points([timeline_point])
+
+    async def persist_timeline_events(self, events):
+        # Written as one batch
+        await self.write_points([self.timeline_point(*event) for event in events])
+
+    async def persist_frame_gap(self, monitor_id, start_epoch, end_epoch, missing):
+        gap_point = (
+            Point("sense_frame_gaps")
+            .tag("monitor_id", monitor_id)
+            .field("start_epoch", start_epoch)
+            .field("end_epoch", end_epoch)
+            .field("missing_frames", missing)
+            .field("seconds", end_epoch - start_epoch + 1)
+            .time(int(start_epoch), write_precision="s")
+        )
+        await self.write_points([gap_point])
 
     async def persist_hello_event(self, monitor_id, online_status, timestamp):
         hello_point = (
@@ -430,7 +545,22 @@ class InfluxDBStorage:
         )
         await self.write_points([device_state_point])
 
+    async def persist_collector_health(self, monitor_id, health):
+        timestamp = int(datetime.now(timezone.utc).timestamp())
+        health_point = (
+            Point("sense_collector_health")
+            .tag("monitor_id", monitor_id)
+            .time(timestamp, write_precision="s")
+        )
+        for field, value in health.items():
+            health_point.field(field, value)
+        await self.write_points([health_point])
+
     async def persist_monitor_status(self, monitor_id, monitor_status):
+        async with self.unit_of_work():
+            await self.persist_monitor_status_points(monitor_id, monitor_status)
+
+    async def persist_monitor_status_points(self, monitor_id, monitor_status):
         storage_logger.debug(f"Persisting monitor status for monitor_id: {monitor_id}")
         storage_logger.debug(f"Monitor status data: {monitor_status}")
 
@@ -440,39 +570,50 @@ class InfluxDBStorage:
             monitor_info = monitor_status.get("monitor_info", {})
             wifi_strength = float(monitor_info.get("wifi_strength", 0))
 
-            monitor_info_point = (
-                Point("sense_monitor_status")
-                .tag("monitor_id", monitor_id)
-                .field("ethernet", monitor_info.get("ethernet"))
-                .field("online", monitor_info.get("online"))
-                .field("ip_address", monitor_info.get("ip_address"))
-                .field("version", monitor_info.get("version"))
-                .field("ssid", monitor_info.get("ssid"))
-                .field("ndt_enabled", monitor_info.get("ndt_enabled"))
-                .field("mac", monitor_info.get("mac"))
-                .field("progress", float(signals.get("progress")))
-                .field("status", signals.get("status"))
-                .time(timestamp, write_precision="s")
-            )
+            monitor_info_fields = {
+                "ethernet": monitor_info.get("ethernet"),
+                "online": monitor_info.get("online"),
+                "ip_address": monitor_info.get("ip_address"),
+                "version": monitor_info.get("version"),
+                "ssid": monitor_info.get("ssid"),
+                "ndt_enabled": monitor_info.get("ndt_enabled"),
+                "mac": monitor_info.get("mac"),
+                "progress": float(signals.get("progress")),
+                "status": signals.get("status"),
+            }
 
             if wifi_strength != 0:
-                monitor_info_point.field("wifi_strength", wifi_strength)
-
-            await self.write_points([monitor_info_point])
+                monitor_info_fields["wifi_strength"] = wifi_strength
+
+            # Unchanged fields are skipped when change-only emission is enabled
+            monitor_info_point = self.change_filter.point(
+                "sense_monitor_status",
+                {"monitor_id": monitor_id},
+                monitor_info_fields,
+                timestamp,
+            )
+            if monitor_info_point is not None:
+                await self.write_points([monitor_info_point])
 
             device_detection = monitor_status.get("device_detection", {})
             points = []
             for status in ["in_progress", "found"]:
                 for device in device_detection.get(status, []):
-                    points.append(
-                        Point("sense_device_detection")
-                        .tag("monitor_id", monitor_id)
-                        .tag("status", status)
-                        .field("icon", device.get("icon"))
-                        .tag("name", device.get("name"))
-                        .field("progress", float(device.get("progress", 0)))
-                        .time(timestamp, write_precision="s")
+                    point = self.change_filter.point(
+                        "sense_device_detection",
+                        {
+                            "monitor_id": monitor_id,
+                            "status": status,
+                            "name": device.get("name"),
+                        },
+                        {
+                            "icon": device.get("icon"),
+                            "progress": float(device.get("progress", 0)),
+                        },
+                        timestamp,
                     )
+                    if point is not None:
+                        points.append(point)
 
             await self.write_points(points)
             storage_logger.debug(f"Persisted monitor status for {monitor_id}")
@@ -486,16 +627,122 @@ class InfluxDBStorage:
                 f"Error in persist_monitor_status: {e}, monitor_status: {monitor_status}"
             )
 
-    async def write_points(self, points):
-        storage_logger.debug("Writing points to InfluxDB")
+    @asynccontextmanager
+    async def unit_of_work(self):
+        # Collects every write_points call made by this task inside the block
+        # and queues them as a single entry when it exits. Nested blocks join
+        # the outer one.
+        outer = current_unit_of_work.get()
+        if outer is not None and outer.open:
+            yield
+            return
+        unit = UnitOfWork()
+        token = current_unit_of_work.set(unit)
         try:
-            self.write_api.write(
-                bucket=self.bucket,
-                org=self.influxdb_client.org,
-                record=points,
-                write_precision="s",
+            yield
+        finally:
+            current_unit_of_work.reset(token)
+            unit.open = False
+            records = unit.records
+            if len(records) == 1 and isinstance(records[0], bytes):
+                records = records[0]
+            await self.write_points(records, unit.count)
+
+    async def write_points(self, points, count=None):
+        # Accepts either a list of Points or pre-encoded line protocol bytes
+        if count is None:
+            count = points.count(b"\n") if isinstance(points, bytes) else len(points)
+        if not count:
+            return
+        unit = current_unit_of_work.get()
+        if unit is not None and unit.open:
+            if isinstance(points, bytes):
+                unit.records.append(points)
+            else:
+                unit.records.extend(points)
+            unit.count += count
+            return
+        storage_logger.debug("Queueing %d points for InfluxDB", count)
+        start_time = time.perf_counter()
+        await self.write_pipeline.put(points, count)
+        metrics.POINTS_QUEUED.inc(amount=count)
+        metrics.WRITE_POINTS_SECONDS.observe(time.perf_counter() - start_time)
+
+    async def write_rollup(self, record, count):
+        if not count:
+            return
+        storage_logger.debug("Queueing %d rollup points for InfluxDB", count)
+        await self.rollup_pipeline.put(record, count)
+        metrics.POINTS_QUEUED.inc(amount=count)
+
+    def write_line_protocol(self, data):
+        # Runs on the write pipeline's flusher thread
+        self.write_api.write(
+            bucket=self.bucket,
+            org=self.influxdb_client.org,
+            record=data,
+            write_precision="s",
+        )
+
+    def bulk_write_line_protocol(self, data):
+        # Runs on the write pipeline's flusher thread while draining the spool
+        self.bulk_write_api.write(
+            bucket=self.bucket,
+            org=self.influxdb_client.org,
+            record=data,
+            write_precision="s",
+        )
+
+    def write_rollup_line_protocol(self, data):
+        self.write_api.write(
+            bucket=self.rollup_bucket,
+            org=self.influxdb_client.org,
+            record=data,
+            write_precision="s",
+        )
+
+    def bulk_write_rollup_line_protocol(self, data):
+        self.bulk_write_api.write(
+            bucket=self.rollup_bucket,
+            org=self.influxdb_client.org,
+            record=data,
+            write_precision="s",
+        )
+
+    def pending_device_sample_count(self):
+        return sum(len(samples) for samples in self.pending_device_samples.values())
+
+    async def persist_write_pipeline_stats(self):
+        while True:
+            await asyncio.sleep(self.write_stats_interval)
+            stats = self.write_pipeline.stats()
+            stats.update(self.change_filter.stats())
+            stats["pending_device_samples"] = self.pending_device_sample_count()
+            stats["pending_device_samples_dropped"] = self.pending_device_samples_dropped
+            storage_logger.debug(f"Write pipeline stats: {stats}")
+            stats_point = Point("sense_write_pipeline").time(
+                int(datetime.now(timezone.utc).timestamp()), write_precision="s"
             )
-        except Exception as e:
-            storage_logger.error(f"Error writing points to InfluxDB: {e}")
-            for point in points:
-                storage_logger.error(f"Point: {point.to_line_protocol()}")
+            for field, value in stats.items():
+                stats_point.field(field, value)
+            await self.write_points([stats_point])
+
+    async def close(self):
+        # Stop recording stats before draining so nothing is queued behind close
+        self.stats_task.cancel()
+        try:
+            await self.stats_task
+        except asyncio.CancelledError:
+            pass
+        if self.rollup is not None:
+            # Partial windows are written rather than lost
+            record, count = self.rollup.flush()
+            await self.write_rollup(record, count)
+            if self.rollup_pipeline is not self.write_pipeline:
+                await self.rollup_pipeline.close()
+        await self.write_pipeline.close()
+        self.write_api.close()
+        self.influxdb_client.close()
+        if self.bulk_influxdb_client is not None:
+            self.bulk_write_api.close()
+            self.bulk_influxdb_client.close()
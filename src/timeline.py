@@ -0,0 +1,246 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+
+import aiohttp
+from dateutil import parser
+
+api_logger = logging.getLogger("api")
+
+
+def item_time(item):
+    # Epoch seconds of a timeline item, or None if it has no usable time
+    value = item.get("time")
+    if value is None:
+        return None
+    try:
+        return parser.isoparse(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
+def item_key(item):
+    return item.get("guid") or "|".join(
+        str(item.get(key)) for key in ("device_id", "type", "time", "body")
+    )
+
+
+class TimelineIngester:
+    # Writes timeline items once, in batches. A high-water-mark cursor (the
+    # newest polled item time plus the keys seen at exactly that time) is
+    # persisted to cursor_path so restarts and repeated polls skip items
+    # already written. Items pushed over the WebSocket only go into a bounded
+    # set of recent keys, so a poll still picks up anything missed while
+    # disconnected. Device names are resolved through the collector owning
+    # the item's monitor, with at most `concurrency` lookups in flight, and
+    # never while the cursor lock is held.
+    def __init__(
+        self,
+        storage,
+        cursor_path=None,
+        concurrency=4,
+        max_recent_keys=4096,
+    ):
+        self.storage = storage
+        self.cursor_path = cursor_path
+        self.concurrency = concurrency
+        # monitor_id -> SenseCollector
+        self.collectors = {}
+        self.lock = asyncio.Lock()
+        # Ingests of pushed items still running
+        self.pending_tasks = set()
+
+        self.cursor_time = None
+        self.cursor_keys = set()
+        self.load_cursor()
+        self.recent_keys = OrderedDict()
+        self.max_recent_keys = max_recent_keys
+
+        self.items_written = 0
+        self.items_skipped = 0
+
+    def add_collector(self, collector):
+        self.collectors[collector.monitor_id] = collector
+
+    def load_cursor(self):
+        if not self.cursor_path or not os.path.exists(self.cursor_path):
+            return
+        try:
+            with open(self.cursor_path) as f:
+                cursor = json.load(f)
+            self.cursor_time = cursor["time"]
+            self.cursor_keys = set(cursor.get("keys", []))
+            api_logger.info(f"Resuming timeline after {self.cursor_time}")
+        except (OSError, ValueError, KeyError) as e:
+            api_logger.warning(f"Ignoring unreadable timeline cursor: {e}")
+
+    def save_cursor(self):
+        # Runs in a worker thread; replaced atomically so a crash never truncates it
+        temporary_path = f"{self.cursor_path}.tmp"
+        with open(temporary_path, "w") as f:
+            json.dump(
+                {"time": self.cursor_time, "keys": sorted(self.cursor_keys)}, f
+            )
+        os.replace(temporary_path, self.cursor_path)
+
+    def is_new(self, item_epoch, key):
+        if key in self.recent_keys:
+            return False
+        if self.cursor_time is None or item_epoch > self.cursor_time:
+            return True
+        return item_epoch == self.cursor_time and key not in self.cursor_keys
+
+    def collector_for(self, item):
+        collector = self.collectors.get(item.get("monitor_id"))
+        if collector is None and self.collectors:
+            collector = next(iter(self.collectors.values()))
+        return collector
+
+    async def ingest(self, items, advance_cursor=True):
+        # The lock only covers the cursor checks and updates. New keys are
+        # claimed in recent_keys before it is released, so a concurrent ingest
+        # skips them while their device names are looked up and written.
+        async with self.lock:
+            seen = []
+            new_items = []
+            for item in items:
+                device_id = item.get("device_id")
+                if not device_id:
+                    api_logger.warning(f"Missing device_id in item: {item}")
+                    continue
+                item_epoch = item_time(item)
+                if item_epoch is None:
+                    api_logger.warning(f"Missing or invalid time in item: {item}")
+                    continue
+                key = item_key(item)
+                seen.append((item_epoch, key))
+                if self.is_new(item_epoch, key):
+                    new_items.append((key, item))
+                    self.recent_keys[key] = None
+                else:
+                    self.items_skipped += 1
+
+        if new_items:
+            try:
+                await self.write_items(new_items)
+            except BaseException:
+                # Not written, so a later poll may pick these up again
+                for key, _ in new_items:
+                    self.recent_keys.pop(key, None)
+                raise
+        while len(self.recent_keys) > self.max_recent_keys:
+            self.recent_keys.popitem(last=False)
+
+        if advance_cursor and seen:
+            async with self.lock:
+                await self.advance_cursor(seen)
+        return len(new_items)
+
+    def ingest_in_background(self, items):
+        # For items pushed over the WebSocket: device lookups must not hold up
+        # reading the socket
+        task = asyncio.create_task(self.ingest(items, advance_cursor=False))
+        self.pending_tasks.add(task)
+        task.add_done_callback(self.finish_background_ingest)
+
+    def finish_background_ingest(self, task):
+        self.pending_tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            api_logger.error(f"Error ingesting pushed timeline items: {task.exception()}")
+
+    async def write_items(self, new_items):
+        items = [item for _, item in new_items]
+        device_names = await self.resolve_device_names(items)
+
+        events = []
+        for item in items:
+            collector = self.collector_for(item)
+            monitor_id = collector.monitor_id if collector is not None else None
+            device_id = item.get("device_id")
+            events.append(
+                (
+                    device_id,
+                    device_names.get((monitor_id, device_id), "Unknown"),
+                    item.get("time"),
+                    item.get("type"),
+                    item.get("icon"),
+                    item.get("body"),
+                    item.get("device_state"),
+                    item.get("user_device_type"),
+                    item.get("device_transition_from_state"),
+                )
+            )
+        await self.storage.persist_timeline_events(events)
+        self.items_written += len(events)
+
+    async def advance_cursor(self, seen):
+        newest = max(item_epoch for item_epoch, _ in seen)
+        if self.cursor_time is not None and newest < self.cursor_time:
+            return
+        if self.cursor_time is None or newest > self.cursor_time:
+            self.cursor_time = newest
+            self.cursor_keys = set()
+        self.cursor_keys.update(key for item_epoch, key in seen if item_epoch == newest)
+        if self.cursor_path:
+            try:
+                await asyncio.to_thread(self.save_cursor)
+            except OSError as e:
+                api_logger.error(f"Failed to save timeline cursor: {e}")
+
+    async def resolve_device_names(self, items):
+        # (monitor_id, device_id) -> name, one lookup per distinct device
+        semaphore = asyncio.Semaphore(self.concurrency)
+        lookups = {}
+        for item in items:
+            collector = self.collector_for(item)
+            if collector is not None:
+                lookups[(collector.monitor_id, item["device_id"])] = collector
+
+        async def lookup(key, collector):
+            async with semaphore:
+                device_data = await collector.lookup_device_data(key[1])
+            if device_data and "device" in device_data:
+                return key, device_data["device"].get("name", "Unknown")
+            api_logger.warning(
+                f"Device data for device_id {key[1]} is missing 'device' key or is None"
+            )
+            return key, "Unknown"
+
+        results = await asyncio.gather(
+            *(lookup(key, collector) for key, collector in lookups.items()),
+            return_exceptions=True,
+        )
+        names = {}
+        for result in results:
+            if isinstance(result, Exception):
+                api_logger.error(f"Error resolving timeline device name: {result}")
+            else:
+                names[result[0]] = result[1]
+        return names
+
+    async def poll(self, account, url, interval=60):
+        while True:
+            start_time = time.time()
+            try:
+                timeline_data = await account.get_json(url)
+                written = await self.ingest(timeline_data.get("items", []))
+                api_logger.debug(f"Timeline poll wrote {written} new items")
+            except aiohttp.ClientError as e:
+                api_logger.error(f"Failed to fetch timeline data: {e}")
+            except Exception as e:
+                api_logger.error(f"Error processing timeline data: {e}")
+            await asyncio.sleep(max(interval - (time.time() - start_time), 0))
+
+    async def close(self):
+        # Lets pushed items still being looked up reach storage
+        if self.pending_tasks:
+            await asyncio.gather(*self.pending_tasks, return_exceptions=True)
+
+    def stats(self):
+        return {
+            "timeline_items_written": self.items_written,
+            "timeline_items_skipped": self.items_skipped,
+        }
@@ -0,0 +1,89 @@
+import asyncio
+import heapq
+import itertools
+import time
+
+# Lower values are served first
+PRIORITY_EVENT = 0
+PRIORITY_SWEEP = 1
+
+
+class KeyedWorkQueue:
+    # Priority queue that holds at most one pending entry per key. Putting a
+    # key that is already pending is collapsed into the existing entry, which
+    # is promoted if the new priority is higher.
+    def __init__(self):
+        # (priority, sequence, key); entries superseded by a promotion are
+        # skipped when popped
+        self.heap = []
+        # key -> (priority, sequence, enqueued_at, item)
+        self.pending = {}
+        self.sequence = itertools.count()
+        self.not_empty = asyncio.Event()
+
+        self.enqueued = 0
+        self.deduplicated = 0
+        self.dequeued = 0
+        self.processed = 0
+        self.total_wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def qsize(self):
+        return len(self.pending)
+
+    def put_nowait(self, key, item, priority=PRIORITY_EVENT):
+        # Returns False when the key was already pending
+        existing = self.pending.get(key)
+        if existing is not None:
+            self.deduplicated += 1
+            existing_priority, _, enqueued_at, _ = existing
+            if priority < existing_priority:
+                sequence = next(self.sequence)
+                self.pending[key] = (priority, sequence, enqueued_at, item)
+                heapq.heappush(self.heap, (priority, sequence, key))
+            return False
+
+        sequence = next(self.sequence)
+        self.pending[key] = (priority, sequence, time.monotonic(), item)
+        heapq.heappush(self.heap, (priority, sequence, key))
+        self.enqueued += 1
+        self.not_empty.set()
+        return True
+
+    async def put(self, key, item, priority=PRIORITY_EVENT):
+        return self.put_nowait(key, item, priority)
+
+    async def get(self):
+        while not self.pending:
+            self.not_empty.clear()
+            await self.not_empty.wait()
+
+        while True:
+            _, sequence, key = heapq.heappop(self.heap)
+            entry = self.pending.get(key)
+            if entry is not None and entry[1] == sequence:
+                break
+
+        del self.pending[key]
+        self.dequeued += 1
+        wait_seconds = time.monotonic() - entry[2]
+        self.total_wait_seconds += wait_seconds
+        self.max_wait_seconds = max(self.max_wait_seconds, wait_seconds)
+        return key, entry[3]
+
+    def task_done(self):
+        self.processed += 1
+
+    def stats(self):
+        puts = self.enqueued + self.deduplicated
+        return {
+            "lookup_queue_depth": len(self.pending),
+            "lookup_queue_enqueued": self.enqueued,
+            "lookup_queue_deduplicated": self.deduplicated,
+            "lookup_queue_dedup_rate": self.deduplicated / puts if puts else 0.0,
+            "lookup_queue_processed": self.processed,
+            "lookup_queue_avg_wait_seconds": (
+                self.total_wait_seconds / self.dequeued if self.dequeued else 0.0
+            ),
+            "lookup_queue_max_wait_seconds": self.max_wait_seconds,
+        }
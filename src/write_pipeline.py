@@ -0,0 +1,296 @@
+import asyncio
+import logging
+import time
+
+from influxdb_client.rest import ApiException
+
+import metrics
+
+storage_logger = logging.getLogger("storage")
+
+OVERFLOW_BLOCK = "block"
+OVERFLOW_DROP_OLDEST = "drop_oldest"
+OVERFLOW_SPILL = "spill"
+OVERFLOW_POLICIES = (OVERFLOW_BLOCK, OVERFLOW_DROP_OLDEST, OVERFLOW_SPILL)
+
+# InfluxDB answers these for data it will never accept (bad line protocol,
+# field type conflicts, oversized requests); retrying them only blocks the rest
+PERMANENT_STATUSES = (400, 413, 422)
+
+
+def is_permanent(error):
+    return isinstance(error, ApiException) and error.status in PERMANENT_STATUSES
+
+
+def retry_after(error, default):
+    # Seconds from a 429 or 503 Retry-After header, else the default
+    if isinstance(error, ApiException) and error.headers:
+        try:
+            return max(float(error.headers.get("Retry-After", default)), 0.0)
+        except (TypeError, ValueError):
+            pass
+    return default
+
+
+def to_line_protocol(record):
+    # Queue entries are either encoded bytes or a list of Points, which may
+    # also hold encoded bytes when it comes from a unit of work
+    if isinstance(record, bytes):
+        return record
+    parts = []
+    for item in record:
+        if isinstance(item, bytes):
+            parts.append(item)
+        else:
+            line = item.to_line_protocol()
+            if line:
+                parts.append(f"{line}\n".encode())
+    return b"".join(parts)
+
+
+class WritePipeline:
+    def __init__(
+        self,
+        write_function,
+        max_queue_size=1000,
+        batch_size=5000,
+        flush_interval=1.0,
+        overflow_policy=OVERFLOW_BLOCK,
+        spool=None,
+        bulk_write_function=None,
+        retry_interval=10.0,
+    ):
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(
+                f"Unknown overflow policy {overflow_policy}, expected one of {OVERFLOW_POLICIES}"
+            )
+        if overflow_policy == OVERFLOW_SPILL and spool is None:
+            raise ValueError("The spill overflow policy requires a spool")
+
+        # Blocking callables that write one bytes payload of line protocol; the
+        # bulk variant is used to drain large spool segments
+        self.write_function = write_function
+        self.bulk_write_function = bulk_write_function or write_function
+        self.max_queue_size = max_queue_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.overflow_policy = overflow_policy
+
+        # Durable spool for failed or overflowing writes. After a failed write,
+        # batches go straight to the spool until retry_interval has passed.
+        self.spool = spool
+        self.retry_interval = retry_interval
+        self.retry_at = 0.0
+
+        self.queue = asyncio.Queue(maxsize=max_queue_size)
+        self.flusher_task = None
+
+        # Counters exposed through stats()
+        self.points_enqueued = 0
+        self.points_written = 0
+        self.points_failed = 0
+        self.points_dropped = 0
+        self.points_spilled = 0
+        self.points_rejected = 0
+        self.batches_written = 0
+        self.last_flush_seconds = 0.0
+        self.max_flush_seconds = 0.0
+
+    def start(self):
+        if self.flusher_task is None:
+            self.flusher_task = asyncio.create_task(self.flusher())
+
+    async def put(self, record, count):
+        self.points_enqueued += count
+        if self.overflow_policy == OVERFLOW_BLOCK:
+            await self.queue.put((record, count))
+            return
+
+        if self.queue.full():
+            if self.overflow_policy == OVERFLOW_DROP_OLDEST:
+                _, dropped = self.queue.get_nowait()
+                self.points_dropped += dropped
+                storage_logger.warning(
+                    f"Write queue full, dropped {dropped} oldest points"
+                )
+            else:
+                if await self.spill_or_drop([record], count):
+                    storage_logger.warning(
+                        f"Write queue full, spilled {count} points to disk"
+                    )
+                return
+        self.queue.put_nowait((record, count))
+
+    def spill(self, batch, count):
+        self.spool.append(b"".join(to_line_protocol(record) for record in batch))
+        self.points_spilled += count
+
+    async def spill_or_drop(self, batch, count):
+        # Returns True when the batch reached the spool; a full or unwritable
+        # disk drops and counts it instead of stopping the caller
+        try:
+            await asyncio.to_thread(self.spill, batch, count)
+            return True
+        except OSError as e:
+            self.points_dropped += count
+            storage_logger.error(f"Could not spool {count} points, dropped them: {e}")
+            return False
+
+    async def flusher(self):
+        loop = asyncio.get_running_loop()
+        closing = False
+        while not closing:
+            entry = await self.queue.get()
+            if entry is None:
+                break
+            record, points = entry
+            batch = [record]
+            deadline = loop.time() + self.flush_interval
+
+            # Keep collecting until the batch is big enough or old enough
+            while points < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    entry = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if entry is None:
+                    closing = True
+                    break
+                batch.append(entry[0])
+                points += entry[1]
+
+            # Whatever goes wrong, this task must keep draining the queue
+            try:
+                if await self.write_batch(batch, points) and self.spool is not None:
+                    await self.drain_spool()
+            except Exception as e:
+                storage_logger.exception(f"Unexpected error in the write flusher: {e}")
+
+    def encode_and_write(self, batch):
+        self.write_function(b"".join(to_line_protocol(record) for record in batch))
+
+    def reject(self, points, error):
+        self.points_rejected += points
+        metrics.POINTS_REJECTED.inc(amount=points)
+        storage_logger.error(f"InfluxDB rejected {points} points, dropping them: {error}")
+
+    def defer(self, error):
+        # Sends batches to the spool until InfluxDB is expected to be back
+        delay = retry_after(error, self.retry_interval)
+        self.retry_at = time.monotonic() + delay
+        return delay
+
+    async def write_batch(self, batch, points):
+        # Returns True when InfluxDB answered, so the spool can be drained
+        if self.spool is not None and time.monotonic() < self.retry_at:
+            await self.spill_or_drop(batch, points)
+            return False
+
+        start_time = time.perf_counter()
+        try:
+            await asyncio.to_thread(self.encode_and_write, batch)
+            self.points_written += points
+            self.batches_written += 1
+            metrics.POINTS_WRITTEN.inc(amount=points)
+            return True
+        except Exception as e:
+            if is_permanent(e):
+                # Spooling it would only leave a segment that never drains
+                self.reject(points, e)
+                return True
+            storage_logger.error(f"Error writing {points} points to InfluxDB: {e}")
+            if self.spool is None:
+                self.points_failed += points
+                return False
+            delay = self.defer(e)
+            storage_logger.warning(
+                f"Spooling writes to disk, retrying InfluxDB in {delay} seconds"
+            )
+            await self.spill_or_drop(batch, points)
+            return False
+        finally:
+            self.last_flush_seconds = time.perf_counter() - start_time
+            metrics.FLUSH_SECONDS.observe(self.last_flush_seconds)
+            self.max_flush_seconds = max(self.max_flush_seconds, self.last_flush_seconds)
+            storage_logger.debug(
+                "Flushed %d points in %.3f seconds", points, self.last_flush_seconds
+            )
+
+    async def drain_spool(self):
+        # Drain one segment per successful flush so live data keeps flowing
+        if not self.spool.has_data():
+            return
+        try:
+            segment = await asyncio.to_thread(self.spool.oldest_segment)
+        except OSError as e:
+            storage_logger.error(f"Could not rotate the spool for draining: {e}")
+            return
+        if segment is None:
+            return
+        try:
+            data = await asyncio.to_thread(self.spool.read_segment, segment)
+        except FileNotFoundError:
+            # Removed behind the spool's back; forget it and move on
+            storage_logger.warning(f"Spool segment {segment} disappeared, skipping it")
+            await asyncio.to_thread(self.spool.remove_segment, segment)
+            return
+        except OSError as e:
+            storage_logger.error(f"Could not read spool segment {segment}, quarantining it: {e}")
+            await asyncio.to_thread(self.spool.quarantine_segment, segment)
+            return
+        if data is None:
+            return  # Discarded by the disk cap meanwhile
+        points = data.count(b"\n")
+        start_time = time.perf_counter()
+        try:
+            await asyncio.to_thread(self.bulk_write_function, data)
+        except Exception as e:
+            if is_permanent(e):
+                self.reject(points, e)
+                await asyncio.to_thread(self.spool.quarantine_segment, segment)
+                return
+            self.defer(e)
+            storage_logger.error(f"Error draining spool segment {segment}: {e}")
+            return
+        try:
+            await asyncio.to_thread(self.spool.remove_segment, segment)
+        except OSError as e:
+            # It is out of the drain order already, so it is not written twice
+            storage_logger.error(f"Could not remove drained spool segment {segment}: {e}")
+        self.points_written += points
+        self.batches_written += 1
+        metrics.POINTS_WRITTEN.inc(amount=points)
+        storage_logger.info(
+            f"Drained {points} spooled points from {segment} in {time.perf_counter() - start_time:.3f} seconds"
+        )
+
+    async def close(self):
+        # Queue a sentinel behind everything pending so the flusher writes it all out
+        if self.flusher_task is None:
+            return
+        await self.queue.put(None)
+        await self.flusher_task
+        self.flusher_task = None
+        if self.spool is not None:
+            self.spool.close()
+
+    def stats(self):
+        stats = {
+            "queue_depth": self.queue.qsize(),
+            "queue_max": self.max_queue_size,
+            "points_enqueued": self.points_enqueued,
+            "points_written": self.points_written,
+            "points_failed": self.points_failed,
+            "points_dropped": self.points_dropped,
+            "points_spilled": self.points_spilled,
+            "points_rejected": self.points_rejected,
+            "batches_written": self.batches_written,
+            "last_flush_seconds": self.last_flush_seconds,
+            "max_flush_seconds": self.max_flush_seconds,
+        }
+        if self.spool is not None:
+            stats.update(self.spool.stats())
+        return stats
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The collector modules live flat in src/, as they are copied into the image
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
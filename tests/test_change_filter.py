@@ -0,0 +1,87 @@
+from change_filter import ChangeFilter, PassthroughFilter, is_number
+
+SERIES = ("sense_devices", ("device_id", "a"))
+
+
+def test_values_within_the_deadband_are_suppressed():
+    change_filter = ChangeFilter(deadband=0.5, keepalive=900)
+    assert change_filter.changed(SERIES, "watts", 100.0, 0)
+    assert not change_filter.changed(SERIES, "watts", 100.5, 1)
+    assert not change_filter.changed(SERIES, "watts", 99.5, 2)
+    assert change_filter.changed(SERIES, "watts", 100.6, 3)
+    # Compared with the last written value, not the last seen one
+    assert not change_filter.changed(SERIES, "watts", 101.0, 4)
+    assert change_filter.changed(SERIES, "watts", 99.9, 5)
+    assert change_filter.stats()["change_filter_suppressed"] == 3
+    assert change_filter.stats()["change_filter_emitted"] == 3
+
+
+def test_strings_and_bools_are_compared_exactly():
+    change_filter = ChangeFilter(deadband=10.0)
+    assert change_filter.changed(SERIES, "icon", "stove", 0)
+    assert not change_filter.changed(SERIES, "icon", "stove", 1)
+    assert change_filter.changed(SERIES, "icon", "fridge", 2)
+    # bool is not treated as a number, so True and False never fall in the deadband
+    assert change_filter.changed(SERIES, "always_on_state", True, 0)
+    assert change_filter.changed(SERIES, "always_on_state", False, 1)
+
+
+def test_unchanged_value_is_written_again_after_keepalive():
+    change_filter = ChangeFilter(keepalive=60)
+    assert change_filter.changed(SERIES, "icon", "stove", 0)
+    assert not change_filter.changed(SERIES, "icon", "stove", 59)
+    assert change_filter.changed(SERIES, "icon", "stove", 60)
+    # The heartbeat write restarts the keepalive period
+    assert not change_filter.changed(SERIES, "icon", "stove", 119)
+    assert change_filter.changed(SERIES, "icon", "stove", 120)
+
+
+def test_fields_and_series_are_tracked_separately():
+    change_filter = ChangeFilter()
+    other = ("sense_devices", ("device_id", "b"))
+    assert change_filter.changed(SERIES, "watts", 1.0, 0)
+    assert change_filter.changed(SERIES, "sd_watts", 1.0, 0)
+    assert change_filter.changed(other, "watts", 1.0, 0)
+    assert not change_filter.changed(other, "watts", 1.0, 1)
+
+
+def test_none_is_always_passed_and_not_remembered():
+    change_filter = ChangeFilter()
+    assert change_filter.changed(SERIES, "watts", None, 0)
+    assert change_filter.last == {}
+    assert change_filter.changed(SERIES, "watts", 1.0, 1)
+    assert change_filter.changed(SERIES, "watts", None, 2)
+    assert not change_filter.changed(SERIES, "watts", 1.0, 3)
+
+
+def test_table_is_reset_when_full():
+    change_filter = ChangeFilter(max_entries=2)
+    change_filter.changed(SERIES, "a", 1.0, 0)
+    change_filter.changed(SERIES, "b", 1.0, 0)
+    change_filter.changed(SERIES, "c", 1.0, 0)
+    assert list(change_filter.last) == [(SERIES, "c")]
+    assert change_filter.changed(SERIES, "a", 1.0, 1)
+
+
+def test_point_holds_only_changed_fields():
+    change_filter = ChangeFilter(keepalive=60)
+    tags = {"device_id": "a"}
+    first = change_filter.point("sense_devices", tags, {"icon": "stove", "w": 1.0}, 0)
+    assert first.to_line_protocol() == "sense_devices,device_id=a icon=\"stove\",w=1 0"
+    second = change_filter.point("sense_devices", tags, {"icon": "stove", "w": 2.0}, 1)
+    assert second.to_line_protocol() == "sense_devices,device_id=a w=2 1"
+    assert change_filter.point("sense_devices", tags, {"icon": "stove", "w": 2.0}, 2) is None
+
+
+def test_passthrough_writes_everything():
+    passthrough = PassthroughFilter()
+    assert passthrough.changed(SERIES, "watts", 1.0, 0)
+    assert passthrough.changed(SERIES, "watts", 1.0, 1)
+
+
+def test_is_number():
+    assert is_number(1)
+    assert is_number(1.5)
+    assert not is_number(True)
+    assert not is_number("1")
+    assert not is_number(None)
@@ -0,0 +1,107 @@
+import asyncio
+
+from device_cache import DeviceCache
+
+
+class Fetcher:
+    # Counts calls and returns the next value once released
+    def __init__(self, *values):
+        self.values = list(values)
+        self.calls = 0
+        self.release = asyncio.Event()
+        self.release.set()
+
+    async def __call__(self):
+        self.calls += 1
+        await self.release.wait()
+        return self.values.pop(0)
+
+
+def age(cache, key, seconds):
+    value, fetched_at = cache.entries[key]
+    cache.entries[key] = (value, fetched_at - seconds)
+
+
+def test_concurrent_misses_share_one_fetch():
+    async def run():
+        cache = DeviceCache()
+        fetch = Fetcher({"name": "Fridge"})
+        fetch.release.clear()
+        lookups = [asyncio.create_task(cache.get("a", fetch)) for _ in range(3)]
+        await asyncio.sleep(0)
+        fetch.release.set()
+        return cache, fetch, await asyncio.gather(*lookups)
+
+    cache, fetch, values = asyncio.run(run())
+    assert fetch.calls == 1
+    assert values == [{"name": "Fridge"}] * 3
+    assert cache.misses == 1
+    assert cache.coalesced == 2
+    assert cache.inflight == {}
+
+
+def test_fresh_entry_is_served_without_fetching():
+    async def run():
+        cache = DeviceCache(ttl_seconds=60)
+        fetch = Fetcher("v1", "v2")
+        await cache.get("a", fetch)
+        return fetch, await cache.get("a", fetch)
+
+    fetch, value = asyncio.run(run())
+    assert value == "v1"
+    assert fetch.calls == 1
+
+
+def test_stale_entry_is_served_while_it_revalidates():
+    async def run():
+        cache = DeviceCache(ttl_seconds=60, stale_seconds=600)
+        fetch = Fetcher("v1", "v2")
+        await cache.get("a", fetch)
+        age(cache, "a", 120)
+        fetch.release.clear()
+        # Served at once from the stale entry; a second stale hit does not
+        # start another refresh
+        assert await cache.get("a", fetch) == "v1"
+        assert await cache.get("a", fetch) == "v1"
+        fetch.release.set()
+        await cache.inflight["a"]
+        return cache, fetch, cache.peek("a")
+
+    cache, fetch, value = asyncio.run(run())
+    assert value == "v2"
+    assert fetch.calls == 2
+    assert cache.stale_hits == 2
+    assert cache.refreshes == 1
+
+
+def test_expired_entry_is_fetched_again():
+    async def run():
+        cache = DeviceCache(ttl_seconds=60, stale_seconds=600)
+        fetch = Fetcher("v1", "v2")
+        await cache.get("a", fetch)
+        age(cache, "a", 700)
+        return cache, await cache.get("a", fetch)
+
+    cache, value = asyncio.run(run())
+    assert value == "v2"
+    assert cache.misses == 2
+
+
+def test_failed_fetch_is_not_cached():
+    async def run():
+        cache = DeviceCache()
+        fetch = Fetcher(None, "v1")
+        assert await cache.get("a", fetch) is None
+        return await cache.get("a", fetch)
+
+    assert asyncio.run(run()) == "v1"
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = DeviceCache(max_entries=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.entries.move_to_end("a")
+    cache.set("c", 3)
+    assert list(cache.entries) == ["a", "c"]
+    assert cache.evictions == 1
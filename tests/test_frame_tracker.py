@@ -0,0 +1,55 @@
+from frame_tracker import DUPLICATE, LATE, NEW, FrameTracker
+
+
+def frame_key(epoch, watts):
+    return (epoch, watts, 10.0, 60.0)
+
+
+def test_two_frames_in_the_same_second_are_both_kept():
+    tracker = FrameTracker("monitor")
+    outcomes = [
+        tracker.observe(epoch, frame_key(epoch, watts))
+        for epoch, watts in ((100.0, 1.0), (100.5, 2.0), (101.0, 3.0), (101.5, 4.0))
+    ]
+    assert outcomes == [(NEW, None)] * 4
+    assert tracker.duplicates == 0
+    assert tracker.missing == 0
+
+
+def test_integer_epochs_in_the_same_second_are_both_kept():
+    # The dict decoder truncates epochs, so two frames can share an epoch
+    tracker = FrameTracker("monitor")
+    assert tracker.observe(101, frame_key(101, 1.0)) == (NEW, None)
+    assert tracker.observe(101, frame_key(101, 2.0)) == (NEW, None)
+    assert tracker.observe(102, frame_key(102, 3.0)) == (NEW, None)
+    assert tracker.stats()["realtime_frames"] == 3
+
+
+def test_identical_frame_is_dropped():
+    tracker = FrameTracker("monitor")
+    tracker.observe(100.0, frame_key(100.0, 1.0))
+    assert tracker.observe(100.0, frame_key(100.0, 1.0)) == (DUPLICATE, None)
+    assert tracker.duplicates == 1
+    assert tracker.stats()["realtime_frames"] == 1
+
+
+def test_frame_resent_after_a_reconnect_is_dropped():
+    # No rotation is in progress; Sense replays a few frames on the new socket
+    tracker = FrameTracker("monitor")
+    for epoch in (100.0, 100.5, 101.0):
+        tracker.observe(epoch, frame_key(epoch, epoch))
+    assert tracker.observe(100.5, frame_key(100.5, 100.5)) == (DUPLICATE, None)
+    assert tracker.observe(101.0, frame_key(101.0, 101.0)) == (DUPLICATE, None)
+    assert tracker.observe(101.5, frame_key(101.5, 101.5)) == (NEW, None)
+    assert tracker.duplicates == 2
+    assert tracker.late == 0
+
+
+def test_skipped_seconds_are_a_gap_until_filled():
+    tracker = FrameTracker("monitor")
+    tracker.observe(100.2)
+    assert tracker.observe(103.7) == (NEW, (101, 102, 2))
+    assert tracker.missing == 2
+    assert tracker.observe(101.4) == (LATE, None)
+    assert tracker.missing == 1
+    assert tracker.stats()["realtime_completeness"] == 0.75
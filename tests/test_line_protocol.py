@@ -0,0 +1,127 @@
+from influxdb_client import Point
+
+from benchmark import encode_with_points, frame_arguments, synthetic_realtime_frames
+from change_filter import ChangeFilter
+from line_protocol import RealtimeEncoder, encode_fields, encode_prefix
+from models import FrameDevices
+
+
+def frame(devices, **overrides):
+    payload = {
+        "hz": 60.0,
+        "c": 25.5,
+        "w": 1500.25,
+        "epoch": 1700000000,
+        "voltage": [121.5, 122],
+        "channels": [700, 800.5],
+        "devices": devices,
+    }
+    payload.update(overrides)
+    return payload
+
+
+def assert_same_as_points(payload, monitor_id="monitor"):
+    args = frame_arguments(monitor_id, payload)
+    data, count = RealtimeEncoder().encode_realtime(*args)
+    expected = encode_with_points(*args).splitlines()
+    assert data.splitlines() == expected
+    assert count == len(expected)
+
+
+def test_synthetic_frames_match_points():
+    for payload in synthetic_realtime_frames(5, 12):
+        assert_same_as_points(payload)
+
+
+def test_tags_and_fields_are_escaped_like_points():
+    devices = [
+        {
+            "id": "dev,1 =x",
+            "name": 'Kitchen, "main" = on\\',
+            "icon": 'say "hi" \\ bye',
+            "w": 12.5,
+        },
+        {"id": "tab\tnew\nline", "name": "Trailing\\", "icon": "stove", "w": 3},
+    ]
+    assert_same_as_points(frame(devices), monitor_id="monitor id,with=chars")
+
+
+def test_int_and_float_fields_keep_their_types():
+    devices = [
+        {
+            "id": "plug",
+            "name": "Plug",
+            "icon": "socket",
+            "w": 120,
+            "sd": {"w": 120.0, "i": 1, "v": 119.75, "e": 5},
+            "ao_w": 80,
+            "ao_st": True,
+        },
+        {"id": "big", "name": "Big", "w": 1e21, "ao_st": False},
+        {"id": "nan", "name": "NaN", "w": float("nan"), "icon": None},
+    ]
+    assert_same_as_points(frame(devices, voltage=[120, 120.0]))
+    data, _ = RealtimeEncoder().encode_realtime(
+        *frame_arguments("monitor", frame(devices))
+    )
+    assert b"sd_energy=5i" in data
+    assert b"sd_watts=120," in data
+    assert b"watts=nan" not in data
+
+
+def test_devices_without_fields_are_dropped():
+    devices = [{"id": "empty", "name": "Empty"}, {"id": "a", "name": "A", "w": 1.5}]
+    assert_same_as_points(frame(devices))
+
+
+def test_encode_devices_matches_points():
+    devices = frame(
+        [
+            {"id": "a", "name": "A", "icon": "stove", "w": 10.5},
+            {"id": "b", "name": "B", "sd": {"w": 1, "i": None}, "ao_w": 2.0},
+        ]
+    )["devices"]
+    encoder = RealtimeEncoder()
+    count = encoder.encode_devices("monitor", FrameDevices(devices), 1700000000)
+    expected = [
+        line
+        for line in encode_with_points(
+            *frame_arguments("monitor", frame(devices))
+        ).splitlines()
+        if line.startswith(b"sense_devices")
+    ]
+    assert bytes(encoder.buffer).splitlines() == expected
+    assert count == 2
+
+
+def test_change_filter_drops_unchanged_device_fields():
+    encoder = RealtimeEncoder(change_filter=ChangeFilter())
+    device = {"id": "a", "name": "A", "icon": "stove", "w": 10.5, "ao_st": True}
+    encoder.encode_devices("monitor", FrameDevices([device]), 100)
+    encoder.buffer.clear()
+    encoder.encode_devices("monitor", FrameDevices([dict(device, w=11.0)]), 101)
+
+    # Only the frequently changing watts field is written again
+    expected = (
+        Point("sense_devices")
+        .tag("monitor_id", "monitor")
+        .tag("device_id", "a")
+        .tag("device_name", "A")
+        .tag("is_plug", "false")
+        .field("watts", 11.0)
+        .time(101, write_precision="s")
+        .to_line_protocol()
+    )
+    assert bytes(encoder.buffer) == f"{expected}\n".encode()
+
+
+def test_prefix_and_fields_helpers_match_points():
+    tags = {"b": "x y", "a": "1,2", "empty": "", "none": None}
+    fields = [("f", 1), ("g", 2.0), ("h", "q\"uote"), ("i", None), ("j", False)]
+    point = Point("m e,as")
+    for key, value in tags.items():
+        point.tag(key, value)
+    for key, value in fields:
+        point.field(key, value)
+    expected = point.time(5, write_precision="s").to_line_protocol()
+    assert f"{encode_prefix('m e,as', tags)}{encode_fields(fields)} 5" == expected
@@ -0,0 +1,58 @@
+import asyncio
+import glob
+import os
+
+import pytest
+
+pyarrow = pytest.importorskip("pyarrow")
+import pyarrow.parquet  # noqa: E402
+
+from parquet_sink import ParquetSink  # noqa: E402
+
+DEVICES = [{"id": "device0", "name": "Device 0", "w": 12.5, "sd": {"w": 11.0}}]
+
+
+def part_files(folder, pattern):
+    return glob.glob(os.path.join(folder, "**", pattern), recursive=True)
+
+
+def test_every_flush_finishes_its_part_files(tmp_path):
+    async def run():
+        sink = ParquetSink(str(tmp_path))
+        await sink.persist_realtime_data(
+            "monitor", 60.0, 10.0, 1200.0, 1704067200, [120.0, 121.0], DEVICES, [600.0, 600.0]
+        )
+        await sink.flush()
+        # Finished and readable while the partition is still current
+        assert part_files(str(tmp_path), "*.parquet.tmp") == []
+        first = part_files(str(tmp_path), "*.parquet")
+        await sink.persist_realtime_data(
+            "monitor", 60.0, 10.0, 1300.0, 1704067201, [120.0, 121.0], DEVICES, [650.0, 650.0]
+        )
+        await sink.close()
+        return first
+
+    first = asyncio.run(run())
+    assert len(first) == 2
+    devices = pyarrow.parquet.read_table(
+        os.path.join(str(tmp_path), "realtime_devices")
+    )
+    assert devices.num_rows == 2
+    assert devices.column("sd_watts").to_pylist() == [11.0, 11.0]
+    assert len(part_files(str(tmp_path), "*.parquet")) == 4
+
+
+def test_unfinished_files_from_a_crash_are_removed(tmp_path):
+    orphan = tmp_path / "realtime_mains" / "date=2024-01-01" / "hour=00"
+    orphan.mkdir(parents=True)
+    (orphan / "part-1-1-1.parquet.tmp").write_bytes(b"PAR1 truncated")
+
+    async def run():
+        sink = ParquetSink(str(tmp_path))
+        await asyncio.sleep(0.05)
+        await sink.close()
+        return sink
+
+    sink = asyncio.run(run())
+    assert part_files(str(tmp_path), "*.tmp") == []
+    assert sink.stats()["parquet_orphans_removed"] == 1
@@ -0,0 +1,93 @@
+import asyncio
+import time
+
+import pytest
+
+from rate_limiter import AdaptiveRateLimiter, parse_retry_after
+
+
+class FakeResponse:
+    def __init__(self, status, headers=None, data=None):
+        self.status = status
+        self.headers = headers or {}
+        self.data = data
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+    def raise_for_status(self):
+        assert self.status < 400
+
+    async def json(self):
+        return self.data
+
+
+class FakeSession:
+    # Replies with the given responses in order and records request times
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.requested_at = []
+
+    def get(self, url, **kwargs):
+        self.requested_at.append(time.monotonic())
+        return self.responses.pop(0)
+
+
+def test_rate_grows_on_success_and_is_cut_on_429():
+    limiter = AdaptiveRateLimiter(
+        initial_rate=2.0, min_rate=0.5, max_rate=2.1, increase_step=0.05
+    )
+    limiter.on_success()
+    assert limiter.rate == pytest.approx(2.05)
+    limiter.on_success()
+    limiter.on_success()
+    assert limiter.rate == 2.1
+
+    limiter.on_throttled(0)
+    assert limiter.rate == pytest.approx(1.05)
+    assert limiter.tokens == 0.0
+    limiter.on_throttled(0)
+    limiter.on_throttled(0)
+    assert limiter.rate == 0.5
+    assert limiter.throttled == 3
+
+
+def test_429_pauses_for_retry_after_then_retries():
+    session = FakeSession(
+        [
+            FakeResponse(429, {"Retry-After": "0.2"}),
+            FakeResponse(200, data={"ok": True}),
+        ]
+    )
+    limiter = AdaptiveRateLimiter(initial_rate=8.0, burst=4)
+
+    data = asyncio.run(limiter.get_json(session, "http://sense/api"))
+
+    assert data == {"ok": True}
+    assert session.requested_at[1] - session.requested_at[0] >= 0.2
+    # Halved by the 429, then one additive step for the success
+    assert limiter.rate == pytest.approx(8.0 * 0.5 + 0.05)
+    assert limiter.stats()["api_retries"] == 1
+    assert limiter.stats()["api_requests"] == 2
+
+
+def test_retry_after_pauses_every_caller():
+    async def run():
+        limiter = AdaptiveRateLimiter(initial_rate=100.0, burst=4)
+        start = time.monotonic()
+        limiter.on_throttled(0.2)
+        await asyncio.gather(limiter.acquire(), limiter.acquire())
+        return time.monotonic() - start
+
+    assert asyncio.run(run()) >= 0.2
+
+
+def test_parse_retry_after():
+    assert parse_retry_after("3", 1.0) == 3.0
+    assert parse_retry_after("-5", 1.0) == 0.0
+    assert parse_retry_after(None, 1.5) == 1.5
+    # HTTP dates are not parsed; the backoff delay is used instead
+    assert parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT", 2.0) == 2.0
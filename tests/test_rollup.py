@@ -0,0 +1,98 @@
+import pytest
+
+from rollup import RollupStage
+
+
+def add_frame(stage, epoch, watts):
+    return stage.add_frame("monitor", 60.0, 10.0, watts, epoch, [], [], [])
+
+
+def parse(data):
+    # {(window, partial): {field: value}} for the sense_mains lines in data
+    points = {}
+    for line in data.decode().splitlines():
+        prefix, fields, timestamp = line.split(" ")
+        tags = dict(tag.split("=") for tag in prefix.split(",")[1:])
+        values = {
+            key: float(value) for key, value in (f.split("=") for f in fields.split(","))
+        }
+        points[(tags["window"], tags.get("partial"), int(timestamp))] = values
+    return points
+
+
+def test_windows_must_nest():
+    RollupStage((1, 10, 60))
+    with pytest.raises(ValueError, match="15s is not a multiple of 10s"):
+        RollupStage((1, 10, 15))
+    # Each window is a multiple of the finest one, but 30 does not divide 45
+    with pytest.raises(ValueError, match="45s is not a multiple of 30s"):
+        RollupStage((5, 30, 45))
+
+
+def test_coarser_windows_merge_min_max_mean_and_count():
+    stage = RollupStage((1, 2, 4))
+    output = b""
+    # Two frames a second for 4 seconds, then one frame to close every window
+    for epoch, watts in (
+        (100, 5.0),
+        (100.5, 1.0),
+        (101, 8.0),
+        (101.5, 2.0),
+        (102, 4.0),
+        (102.5, 4.0),
+        (103, 10.0),
+        (103.5, 0.0),
+    ):
+        data, _ = add_frame(stage, epoch, watts)
+        output += data
+
+    # Closed windows only reach the coarser one once they close themselves
+    levels = stage.monitors["monitor"]
+    assert levels[0].series[("mains", "monitor", None)]["watts"].count == 2
+    assert levels[1].series[("mains", "monitor", None)]["watts"].count == 2
+    assert levels[2].series[("mains", "monitor", None)]["watts"].count == 4
+
+    data, _ = add_frame(stage, 104, 3.0)
+    output += data
+    points = parse(output)
+
+    assert points[("1s", None, 100)]["watts_min"] == 1.0
+    assert points[("1s", None, 100)]["watts_max"] == 5.0
+    assert points[("1s", None, 100)]["watts_mean"] == 3.0
+    assert points[("2s", None, 100)]["watts_min"] == 1.0
+    assert points[("2s", None, 100)]["watts_max"] == 8.0
+    assert points[("2s", None, 100)]["watts_mean"] == 4.0
+    assert points[("2s", None, 102)]["watts_mean"] == 4.5
+    assert points[("4s", None, 100)] == {
+        "current_last": 10.0,
+        "current_max": 10.0,
+        "current_mean": 10.0,
+        "current_min": 10.0,
+        "hertz_last": 60.0,
+        "hertz_max": 60.0,
+        "hertz_mean": 60.0,
+        "hertz_min": 60.0,
+        "watts_last": 0.0,
+        "watts_max": 10.0,
+        "watts_mean": 4.25,
+        "watts_min": 0.0,
+    }
+
+
+def test_flush_marks_windows_cut_short_as_partial():
+    stage = RollupStage((1, 10))
+    add_frame(stage, 100, 2.0)
+    add_frame(stage, 101, 4.0)
+    data, count = stage.flush()
+    points = parse(data)
+
+    assert count == 2
+    assert points[("1s", "true", 101)]["watts_mean"] == 4.0
+    assert points[("10s", "true", 100)]["watts_mean"] == 3.0
+    assert stage.buffered_series() == 0
+
+    # The next run's complete window has no partial tag, so it is its own series
+    stage = RollupStage((1, 10))
+    add_frame(stage, 102, 6.0)
+    data, _ = add_frame(stage, 110, 6.0)
+    assert ("10s", None, 100) in parse(data)
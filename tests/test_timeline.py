@@ -0,0 +1,87 @@
+import asyncio
+
+from timeline import TimelineIngester
+
+
+class RecordingStorage:
+    def __init__(self):
+        self.events = []
+
+    async def persist_timeline_events(self, events):
+        self.events.extend(events)
+
+
+class SlowCollector:
+    # Device lookups wait until released, like a lookup held by the rate limiter
+    monitor_id = "monitor"
+
+    def __init__(self):
+        self.release = asyncio.Event()
+        self.lookups = 0
+
+    async def lookup_device_data(self, device_id):
+        self.lookups += 1
+        if device_id == "slow":
+            await self.release.wait()
+        return {"device": {"name": f"Device {device_id}"}}
+
+
+def item(device_id, time, guid):
+    return {"device_id": device_id, "time": time, "guid": guid, "type": "DeviceWasOn"}
+
+
+def test_lookups_do_not_hold_the_cursor_lock():
+    async def run():
+        storage = RecordingStorage()
+        collector = SlowCollector()
+        timeline = TimelineIngester(storage)
+        timeline.add_collector(collector)
+
+        poll = asyncio.create_task(
+            timeline.ingest([item("slow", "2024-01-01T00:00:00Z", "a")])
+        )
+        await asyncio.sleep(0.01)
+        # The poll waits on its lookup; pushed items must still get through
+        written = await asyncio.wait_for(
+            timeline.ingest(
+                [item("fast", "2024-01-01T00:00:01Z", "b")], advance_cursor=False
+            ),
+            timeout=1,
+        )
+        assert written == 1
+        assert not poll.done()
+
+        # An item claimed by the pending poll is not written twice
+        assert (
+            await timeline.ingest(
+                [item("slow", "2024-01-01T00:00:00Z", "a")], advance_cursor=False
+            )
+            == 0
+        )
+
+        collector.release.set()
+        assert await poll == 1
+        return storage, timeline
+
+    storage, timeline = asyncio.run(run())
+    assert [event[1] for event in storage.events] == ["Device fast", "Device slow"]
+    assert timeline.cursor_keys == {"a"}
+
+
+def test_pushed_items_are_ingested_in_the_background():
+    async def run():
+        storage = RecordingStorage()
+        collector = SlowCollector()
+        timeline = TimelineIngester(storage)
+        timeline.add_collector(collector)
+
+        timeline.ingest_in_background([item("slow", "2024-01-01T00:00:00Z", "a")])
+        await asyncio.sleep(0.01)
+        assert storage.events == []
+        collector.release.set()
+        await timeline.close()
+        return storage, timeline
+
+    storage, timeline = asyncio.run(run())
+    assert len(storage.events) == 1
+    assert timeline.cursor_time is None
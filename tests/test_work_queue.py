@@ -0,0 +1,78 @@
+import asyncio
+
+from work_queue import PRIORITY_EVENT, PRIORITY_SWEEP, KeyedWorkQueue
+
+
+async def drain(queue):
+    items = []
+    while queue.qsize():
+        items.append(await queue.get())
+        queue.task_done()
+    return items
+
+
+def test_pending_key_is_collapsed():
+    async def run():
+        queue = KeyedWorkQueue()
+        assert queue.put_nowait("a", 1)
+        assert not queue.put_nowait("a", 2)
+        assert queue.put_nowait("b", 3)
+        assert queue.qsize() == 2
+        return queue, await drain(queue)
+
+    queue, items = asyncio.run(run())
+    # The first item of a collapsed key is kept
+    assert items == [("a", 1), ("b", 3)]
+    stats = queue.stats()
+    assert stats["lookup_queue_enqueued"] == 2
+    assert stats["lookup_queue_deduplicated"] == 1
+    assert stats["lookup_queue_processed"] == 2
+
+
+def test_key_can_be_queued_again_once_taken():
+    async def run():
+        queue = KeyedWorkQueue()
+        queue.put_nowait("a", 1)
+        first = await queue.get()
+        assert queue.put_nowait("a", 2)
+        return first, await queue.get()
+
+    assert asyncio.run(run()) == (("a", 1), ("a", 2))
+
+
+def test_events_are_served_before_sweeps():
+    async def run():
+        queue = KeyedWorkQueue()
+        queue.put_nowait("sweep1", 1, PRIORITY_SWEEP)
+        queue.put_nowait("sweep2", 2, PRIORITY_SWEEP)
+        queue.put_nowait("event", 3, PRIORITY_EVENT)
+        return await drain(queue)
+
+    assert asyncio.run(run()) == [("event", 3), ("sweep1", 1), ("sweep2", 2)]
+
+
+def test_pending_sweep_is_promoted_by_an_event():
+    async def run():
+        queue = KeyedWorkQueue()
+        queue.put_nowait("sweep1", 1, PRIORITY_SWEEP)
+        queue.put_nowait("sweep2", 2, PRIORITY_SWEEP)
+        assert not queue.put_nowait("sweep2", 20, PRIORITY_EVENT)
+        # A lower priority put does not demote or replace the entry
+        assert not queue.put_nowait("sweep2", 200, PRIORITY_SWEEP)
+        assert queue.qsize() == 2
+        return await drain(queue)
+
+    # The stale heap entry left by the promotion is skipped
+    assert asyncio.run(run()) == [("sweep2", 20), ("sweep1", 1)]
+
+
+def test_get_waits_for_a_put():
+    async def run():
+        queue = KeyedWorkQueue()
+        getter = asyncio.create_task(queue.get())
+        await asyncio.sleep(0)
+        assert not getter.done()
+        await queue.put("a", 1)
+        return await asyncio.wait_for(getter, 1)
+
+    assert asyncio.run(run()) == ("a", 1)
@@ -0,0 +1,166 @@
+import asyncio
+import errno
+import os
+import time
+
+from influxdb_client.rest import ApiException
+
+from spool import QUARANTINE_SUFFIX, Spool
+from write_pipeline import OVERFLOW_SPILL, WritePipeline
+
+
+def test_segment_deleted_mid_drain_does_not_stop_the_flusher(tmp_path):
+    written = []
+    spool = Spool(str(tmp_path))
+    spool.append(b"m v=1 1\n")
+    spool.append(b"m v=2 2\n")
+
+    read_segment = spool.read_segment
+
+    def read_after_discard(file_name):
+        # enforce_limit removing the segment while the drain reads it
+        os.remove(spool.segment_path(file_name))
+        return read_segment(file_name)
+
+    spool.read_segment = read_after_discard
+
+    async def run():
+        pipeline = WritePipeline(written.append, flush_interval=0.01, spool=spool)
+        pipeline.start()
+        await pipeline.put(b"m v=3 3\n", 1)
+        await asyncio.sleep(0.05)
+        assert not pipeline.flusher_task.done()
+        await pipeline.put(b"m v=4 4\n", 1)
+        await pipeline.close()
+        return pipeline
+
+    pipeline = asyncio.run(run())
+    assert written == [b"m v=3 3\n", b"m v=4 4\n"]
+    assert pipeline.points_written == 2
+    assert not spool.closed_segments
+
+
+def test_unreadable_segment_is_quarantined(tmp_path):
+    spool = Spool(str(tmp_path))
+    spool.append(b"m v=1 1\n")
+
+    def unreadable(file_name):
+        raise PermissionError(errno.EACCES, "Permission denied")
+
+    spool.read_segment = unreadable
+
+    async def run():
+        pipeline = WritePipeline(lambda data: None, flush_interval=0.01, spool=spool)
+        pipeline.start()
+        await pipeline.put(b"m v=2 2\n", 1)
+        await pipeline.close()
+
+    asyncio.run(run())
+    assert not spool.closed_segments
+    assert spool.stats()["spool_segments_quarantined"] == 1
+    assert any(name.endswith(QUARANTINE_SUFFIX) for name in os.listdir(tmp_path))
+
+
+def test_failed_spill_drops_and_counts_instead_of_raising(tmp_path):
+    spool = Spool(str(tmp_path))
+
+    def disk_full(data):
+        raise OSError(errno.ENOSPC, "No space left on device")
+
+    def influxdb_down(data):
+        raise ConnectionError("InfluxDB is down")
+
+    spool.append = disk_full
+
+    async def run():
+        pipeline = WritePipeline(
+            influxdb_down,
+            max_queue_size=1,
+            flush_interval=0.01,
+            overflow_policy=OVERFLOW_SPILL,
+            spool=spool,
+        )
+        pipeline.start()
+        for epoch in range(5):
+            await pipeline.put(f"m v={epoch} {epoch}\n".encode(), 1)
+            await asyncio.sleep(0.02)
+        assert not pipeline.flusher_task.done()
+        await pipeline.close()
+        return pipeline
+
+    pipeline = asyncio.run(run())
+    assert pipeline.points_spilled == 0
+    assert pipeline.points_dropped == 5
+
+
+def test_rejected_spool_segment_is_quarantined_and_live_writes_flow(tmp_path):
+    written = []
+    spool = Spool(str(tmp_path))
+    spool.append(b"m v=\"conflict\" 1\n")
+
+    def reject_bulk(data):
+        raise ApiException(status=400, reason="field type conflict")
+
+    async def run():
+        pipeline = WritePipeline(
+            written.append,
+            flush_interval=0.01,
+            spool=spool,
+            bulk_write_function=reject_bulk,
+        )
+        pipeline.start()
+        for epoch in range(2, 6):
+            await pipeline.put(f"m v={epoch} {epoch}\n".encode(), 1)
+            await asyncio.sleep(0.02)
+        await pipeline.close()
+        return pipeline
+
+    pipeline = asyncio.run(run())
+    assert len(written) == 4
+    assert pipeline.points_written == 4
+    assert pipeline.points_spilled == 0
+    assert pipeline.points_rejected == 1
+    assert not spool.closed_segments
+    assert any(name.endswith(QUARANTINE_SUFFIX) for name in os.listdir(tmp_path))
+
+
+def test_rejected_live_batch_is_dropped_not_spooled(tmp_path):
+    spool = Spool(str(tmp_path))
+
+    def reject(data):
+        raise ApiException(status=422, reason="unprocessable")
+
+    async def run():
+        pipeline = WritePipeline(reject, flush_interval=0.01, spool=spool)
+        pipeline.start()
+        await pipeline.put(b"m v=1 1\n", 1)
+        await pipeline.close()
+        return pipeline
+
+    pipeline = asyncio.run(run())
+    assert pipeline.points_rejected == 1
+    assert pipeline.points_spilled == 0
+    assert pipeline.retry_at == 0.0
+    assert not spool.has_data()
+
+
+def test_rate_limited_batch_is_spooled_for_retry_after(tmp_path):
+    spool = Spool(str(tmp_path))
+
+    def rate_limited(data):
+        error = ApiException(status=429, reason="too many requests")
+        error.headers = {"Retry-After": "30"}
+        raise error
+
+    async def run():
+        pipeline = WritePipeline(
+            rate_limited, flush_interval=0.01, spool=spool, retry_interval=5.0
+        )
+        pipeline.start()
+        await pipeline.put(b"m v=1 1\n", 1)
+        await pipeline.close()
+        return pipeline
+
+    pipeline = asyncio.run(run())
+    assert pipeline.points_spilled == 1
+    assert pipeline.retry_at - time.monotonic() > 25